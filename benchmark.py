@@ -0,0 +1,284 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import time
+
+import pygame
+
+import lm_com
+from fake_ollama import FakeOllama, FakeOllamaServer
+from llm_logic import description_cache, llm_logic
+from scripted_input import ScriptedInput, hold_key
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MAP_PATH = os.path.join(ROOT, "assets", "map", "demo_map.tmx")
+TILESET_PATH = os.path.join(ROOT, "tilesets", "1bit", "colored-transparent_packed.png")
+
+# (command type, turn, text, entity the player stands next to)
+COMMANDS = [
+    ("look", "player", "look", "torch"),
+    ("look at", "player", "look at torch", "torch"),
+    ("pickup", "player", "pickup apple", "apple"),
+    ("do", "interact -> torch", "light the torch", "torch"),
+    ("trade", "trade -> shop keeper", "I offer my dagger for the key to inn", "shop keeper"),
+]
+
+
+def walk_script(frames, leg=45):
+    """Walks the player in a square, into whatever walls are in the way, for the given number of frames."""
+    entries = []
+    keys = ["d", "s", "a", "w"]
+    for i, start in enumerate(range(0, frames, leg)):
+        entries += hold_key(start, keys[i % len(keys)], leg)
+    return entries
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Swallows the prompts and debug output the game prints while a command runs."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class Benchmark:
+    """
+    Times player commands end to end against a model server (by default a FakeOllama).
+
+    The "logic" suite calls llm_logic.parse_player_input and consumes its output like the
+    text box does; the "game" suite types the command into a headless Game and steps
+    frames until the answer is in the chat. Both record the time to the first visible
+    text and to the complete answer. The "frames" suite times Game.step() while a script
+    walks the player around, with and without rendering.
+    """
+
+    def __init__(self, iterations=20, warm=False, verbose=False):
+        """
+        Args:
+            iterations (int): Runs per command and suite
+            warm (bool): Keep caches between runs instead of clearing them before each one
+            verbose (bool): Let the game's own output through
+        """
+        self.iterations = iterations
+        self.warm = warm
+        self.verbose = verbose
+        self.results = {}  # (suite, command) -> {"first": [...], "total": [...]} in seconds
+        self.frame_times = {}  # run name -> Game.step() durations in seconds
+        self.game = None
+
+    def record(self, suite, command, first, total):
+        samples = self.results.setdefault((suite, command), {"first": [], "total": []})
+        samples["first"].append(first)
+        samples["total"].append(total)
+
+    def reset_caches(self):
+        if self.warm:
+            return
+        description_cache.clear()
+        cache = lm_com.get_cache()
+        if cache is not None:
+            cache.clear()
+
+    def setup_game(self):
+        import main
+
+        with quiet(not self.verbose):
+            self.game = main.Game(MAP_PATH, TILESET_PATH, prefetch=False, headless=True)
+        self.entities = {entity.properties.get("name"): entity for entity in self.game.logic_entities}
+
+    def place_player(self, entity_name):
+        game = self.game
+        target = self.entities[entity_name]
+        game.player.position = pygame.math.Vector2(target.position.x + 1, target.position.y)
+        game.player.update()
+        game.interactable_entities.refresh(game.player)
+
+    def restore_world(self, entity_name):
+        """Undoes what a successful command changed, so every run starts from the same world."""
+        entity = self.entities[entity_name]
+        self.game.player.inventory.discard(entity)
+        self.game.set_entity_visible(entity, True)
+
+    def run_logic(self, command, turn, text, entity_name):
+        game = self.game
+        for _ in range(self.iterations):
+            self.reset_caches()
+            self.place_player(entity_name)
+            with quiet(not self.verbose):
+                started = time.perf_counter()
+                output = llm_logic.parse_player_input(turn, text, game.player, game.interactable_entities)
+                first = None
+                for chunk in output["output"]:
+                    if first is None and chunk:
+                        first = time.perf_counter()
+                finished = time.perf_counter()
+            self.record("logic", command, (first or finished) - started, finished - started)
+
+    def run_game(self, command, turn, text, entity_name, timeout=60.0):
+        game = self.game
+        text_box = game.text_box
+        for _ in range(self.iterations):
+            self.reset_caches()
+            self.restore_world(entity_name)
+            self.place_player(entity_name)
+            text_box.active = True
+            text_box.turn, text_box.text = turn, text
+            messages = len(text_box.history)
+
+            with quiet(not self.verbose):
+                pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_RETURN, mod=0, unicode="\r", scancode=0))
+                started = time.perf_counter()
+                first = None
+                while len(text_box.history) < messages + 2 or game.awaiting_llm or text_box.streaming:
+                    game.step()
+                    if first is None and text_box.streaming and text_box.text:
+                        first = time.perf_counter()
+                    if time.perf_counter() - started > timeout:
+                        raise TimeoutError(f"{command!r} did not finish within {timeout} s")
+                finished = time.perf_counter()
+
+                # Effects posted by the stream parser are applied on the next frame, and a
+                # two-call "do" queues its property update then; let both settle before the next run.
+                game.step()
+                while game.awaiting_llm:
+                    game.step()
+            self.record("game", command, (first or finished) - started, finished - started)
+            text_box.turn = "player"
+
+    def run_frames(self, frames, draw=True):
+        import main
+
+        with quiet(not self.verbose):
+            game = main.Game(MAP_PATH, TILESET_PATH, prefetch=False, headless=True, draw=draw,
+                             input_script=ScriptedInput(walk_script(frames)))
+            samples = self.frame_times.setdefault("walk" if draw else "walk, no draw", [])
+            for _ in range(frames):
+                started = time.perf_counter()
+                game.step()
+                samples.append(time.perf_counter() - started)
+            game.shutdown()
+
+    def run(self, suites, commands=COMMANDS, frames=600):
+        if "frames" in suites:
+            self.run_frames(frames, draw=True)
+            self.run_frames(frames, draw=False)
+        if "logic" not in suites and "game" not in suites:
+            return
+
+        self.setup_game()
+        for command, turn, text, entity_name in commands:
+            if "logic" in suites:
+                self.run_logic(command, turn, text, entity_name)
+            if "game" in suites:
+                self.run_game(command, turn, text, entity_name)
+        with quiet(not self.verbose):
+            self.game.shutdown()
+
+    def summary(self):
+        """Per suite and command: run count and p50/p95/p99 in milliseconds."""
+        rows = []
+        for (suite, command), samples in self.results.items():
+            row = {"suite": suite, "command": command, "runs": len(samples["total"])}
+            for kind in ("first", "total"):
+                for q in (50, 95, 99):
+                    row[f"{kind}_p{q}"] = 1000 * percentile(samples[kind], q)
+            rows.append(row)
+        return rows
+
+    def frame_summary(self):
+        """Per frames run: frame count, p50/p95/p99/max frame time in milliseconds and the frame rate it allows."""
+        rows = []
+        for name, samples in self.frame_times.items():
+            row = {"suite": "frames", "run": name, "frames": len(samples)}
+            for q in (50, 95, 99):
+                row[f"p{q}"] = 1000 * percentile(samples, q)
+            row["max"] = 1000 * max(samples)
+            row["fps"] = len(samples) / sum(samples)
+            rows.append(row)
+        return rows
+
+    def report(self):
+        lines = []
+        if self.frame_times:
+            lines.append(f"{'frames':<16} {'count':>5}   {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7}   {'fps':>7}")
+            for row in self.frame_summary():
+                lines.append(
+                    f"{row['run']:<16} {row['frames']:>5}   {row['p50']:>7.2f} {row['p95']:>7.2f} "
+                    f"{row['p99']:>7.2f} {row['max']:>7.2f}   {row['fps']:>7.0f}"
+                )
+        if not self.results:
+            return "\n".join(lines)
+
+        lines += [
+            f"{'suite':<6} {'command':<8} {'runs':>4}   {'first p50':>9} {'p95':>7} {'p99':>7}   {'total p50':>9} {'p95':>7} {'p99':>7}"
+        ]
+        for row in self.summary():
+            lines.append(
+                f"{row['suite']:<6} {row['command']:<8} {row['runs']:>4}   "
+                f"{row['first_p50']:>9.1f} {row['first_p95']:>7.1f} {row['first_p99']:>7.1f}   "
+                f"{row['total_p50']:>9.1f} {row['total_p95']:>7.1f} {row['total_p99']:>7.1f}"
+            )
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of player commands, in milliseconds, against a (fake) model server.")
+    parser.add_argument("--iterations", type=int, default=20, help="runs per command and suite")
+    parser.add_argument("--suite", choices=("logic", "game", "frames", "all"), default="all")
+    parser.add_argument("--frames", type=int, default=600, help="frames per run of the frames suite")
+    parser.add_argument("--url", help="benchmark this Ollama server instead of starting a fake one")
+    parser.add_argument("--ttft", type=float, default=0.2, help="fake server: seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="fake server: generation speed")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=None, help="fake server: prompt evaluation speed")
+    parser.add_argument("--parallel", type=int, default=1, help="fake server: requests served at once")
+    parser.add_argument("--responses", help="fake server: JSON file mapping template names to canned answers")
+    parser.add_argument("--cache", action="store_true", help="use the on-disk response cache (off by default)")
+    parser.add_argument("--warm", action="store_true", help="keep caches between runs")
+    parser.add_argument("--json", help="also write the summary rows to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the game's own output")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        responses = None
+        if args.responses:
+            with open(args.responses, encoding="utf-8") as f:
+                responses = json.load(f)
+        fake = FakeOllama(args.ttft, args.tokens_per_second, args.prompt_tokens_per_second, args.parallel, responses)
+        server = FakeOllamaServer(fake=fake).start()
+        url = server.url
+
+    lm_com.set_backend(lm_com.create_backend("ollama", base_url=url))
+    if not args.cache:
+        lm_com.set_cache(None)
+
+    benchmark = Benchmark(args.iterations, warm=args.warm, verbose=args.verbose)
+    suites = ("logic", "game", "frames") if args.suite == "all" else (args.suite,)
+    try:
+        benchmark.run(suites, frames=args.frames)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(benchmark.report())
+    if server is not None:
+        print(f"server requests: {server.fake.stats()}, coalesced in lm_com: {lm_com.in_flight.coalesced}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(benchmark.summary() + benchmark.frame_summary(), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import pygame
+
+
+class Camera:
+    """
+    A viewport onto the map, in screen pixels (map pixels * scale).
+
+    follow() centers it on a target and clamps it to the map, so maps larger than the
+    window scroll while smaller ones stay fixed at the origin.
+    """
+
+    def __init__(self, viewport_width, viewport_height, world_width, world_height, scale=2):
+        self.width = viewport_width
+        self.height = viewport_height
+        self.world_width = world_width
+        self.world_height = world_height
+        self.scale = scale
+        self.x = 0
+        self.y = 0
+
+    @property
+    def offset(self):
+        return (self.x, self.y)
+
+    @property
+    def rect(self):
+        """The visible part of the world, in screen pixels."""
+        return pygame.Rect(self.x, self.y, self.width, self.height)
+
+    def follow(self, target_rect):
+        """Centers the viewport on a rect given in map pixels."""
+        center_x = target_rect.centerx * self.scale
+        center_y = target_rect.centery * self.scale
+        self.x = int(max(0, min(center_x - self.width // 2, self.world_width - self.width)))
+        self.y = int(max(0, min(center_y - self.height // 2, self.world_height - self.height)))
+
+    def world_to_screen(self, rect):
+        """Moves a rect in (scaled) world pixels into window coordinates."""
+        return rect.move(-self.x, -self.y)
+
+    def screen_to_world(self, pos):
+        """Converts a window position to (scaled) world pixels."""
+        return (pos[0] + self.x, pos[1] + self.y)
@@ -0,0 +1,158 @@
+import json
+import tempfile
+import textwrap
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def wrap_text(text, width):
+    return tuple(textwrap.wrap(text, width))
+
+
+class ChatHistory:
+    """
+    Append-only chat log with bounded memory.
+
+    The newest messages are kept in memory. Once there are more than memory_entries of them,
+    the oldest page_size messages are written to a spill file as one JSON line and dropped,
+    and are read back a page at a time (with a small page cache) if the player scrolls that far.
+    """
+
+    def __init__(self, memory_entries=500, page_size=100, spill_path=None, cached_pages=4):
+        self.memory_entries = memory_entries
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+        self.memory = []          # messages not spilled yet, oldest first
+        self.page_offsets = []    # spill file offset of each spilled page
+        self.pages = OrderedDict()  # page number -> messages, LRU
+        self.spill_path = spill_path
+        self.spill_file = None
+
+    def __len__(self):
+        return self.spilled + len(self.memory)
+
+    @property
+    def spilled(self):
+        return len(self.page_offsets) * self.page_size
+
+    def append(self, message):
+        self.memory.append(message)
+        if len(self.memory) > self.memory_entries:
+            self._spill_page()
+
+    def _spill_page(self):
+        if self.spill_file is None:
+            if self.spill_path:
+                self.spill_file = open(self.spill_path, "w+", encoding="utf-8")
+            else:
+                self.spill_file = tempfile.TemporaryFile("w+", encoding="utf-8")
+
+        page, self.memory = self.memory[:self.page_size], self.memory[self.page_size:]
+        self.spill_file.seek(0, 2)
+        self.page_offsets.append(self.spill_file.tell())
+        self.spill_file.write(json.dumps(page) + "\n")
+
+    def _load_page(self, page_number):
+        page = self.pages.get(page_number)
+        if page is not None:
+            self.pages.move_to_end(page_number)
+            return page
+
+        self.spill_file.flush()
+        self.spill_file.seek(self.page_offsets[page_number])
+        page = json.loads(self.spill_file.readline())
+        self.pages[page_number] = page
+        if len(self.pages) > self.cached_pages:
+            self.pages.popitem(last=False)
+        return page
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chat history index out of range")
+
+        if index >= self.spilled:
+            return self.memory[index - self.spilled]
+        page_number, offset = divmod(index, self.page_size)
+        return self._load_page(page_number)[offset]
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+class ChatView:
+    """
+    Virtualized, line-based view of a ChatHistory.
+
+    The wrapped height of every message is measured once, when it is added, and kept as a
+    running total, so a binary search finds the first message on screen and only the messages
+    that are actually visible are wrapped (or read back from the spill file). Scroll position
+    is counted in lines above the newest one.
+    """
+
+    def __init__(self, history, wrap_width=115):
+        self.history = history
+        self.wrap_width = wrap_width
+        self.line_ends = array("Q")  # wrapped lines up to and including each message
+        self.page_lines = 1  # lines that fit on the panel, as of the last layout
+
+    def sync(self):
+        """Measures messages appended to the history since the last call."""
+        for index in range(len(self.line_ends), len(self.history)):
+            count = len(wrap_text(self.history[index]["text"], self.wrap_width))
+            self.line_ends.append(self.total_lines + count)
+
+    @property
+    def total_lines(self):
+        return self.line_ends[-1] if self.line_ends else 0
+
+    def message_lines(self, message):
+        lines = list(wrap_text(message["text"], self.wrap_width))
+        if len(lines) > 0:
+            lines[0] = f"{message['speaker']}: {lines[0]}"
+        return lines
+
+    def max_scroll(self, tail_lines=0):
+        self.sync()
+        return max(0, self.total_lines + tail_lines - self.page_lines)
+
+    def lines(self, scroll, max_lines, tail=None):
+        """
+        The lines to show on a panel max_lines high.
+
+        Args:
+            scroll (int): how many lines the view is scrolled up from the newest line
+            max_lines (int): panel height in lines
+            tail (dict): optional message shown after the history (e.g. the line being typed)
+
+        Returns:
+            list: the visible lines, top to bottom
+        """
+        self.sync()
+        self.page_lines = max_lines
+        tail_lines = self.message_lines(tail) if tail is not None else []
+        scroll = max(0, min(scroll, self.max_scroll(len(tail_lines))))
+
+        # The window in lines, counting the history first and the tail after it.
+        history_lines = self.total_lines
+        end = history_lines + len(tail_lines) - scroll
+        start = max(0, end - max_lines)
+
+        visible = []
+        index = bisect_right(self.line_ends, start)  # first message ending after start
+        while index < len(self.line_ends) and start + len(visible) < min(end, history_lines):
+            first_line = self.line_ends[index - 1] if index > 0 else 0
+            if self.line_ends[index] > first_line:
+                lines = self.message_lines(self.history[index])
+                visible += lines[max(0, start - first_line):min(end, history_lines) - first_line]
+            index += 1
+
+        if end > history_lines:
+            visible += tail_lines[max(0, start - history_lines):end - history_lines]
+        return visible
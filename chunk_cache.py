@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+
+class ChunkCache:
+    """
+    Least-recently-used store for pre-rendered map chunks.
+
+    Chunks are keyed by their (chunk_x, chunk_y) position. Once more than max_chunks are
+    held, the ones that have gone longest without being drawn (i.e. far from the camera)
+    are dropped and re-baked if the camera comes back.
+    """
+
+    def __init__(self, max_chunks=64):
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()
+        self.baked = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def get(self, key, bake):
+        """Returns the chunk for key, calling bake(key) to build it if it isn't cached."""
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+
+        chunk = bake(key)
+        self.baked += 1
+        self.chunks[key] = chunk
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+            self.evicted += 1
+        return chunk
+
+    def clear(self):
+        self.chunks.clear()
@@ -1,8 +1,10 @@
-look = """You are tasked with generating concise descriptions for objects in a game. When a player uses the 'look' command on an object, your description will be what they see. Your goal is to create a natural-sounding description based solely on the properties provided, without adding speculative elements.
-Here are the object properties to describe:
-<object_properties>
-$OBJECT_PROPERTIES
-</object_properties>
+from templates import Template
+
+# Every prompt is split into a static system section (instructions, rules, examples) and a
+# variable tail holding the per-call data. The system section is sent as the system message, so
+# the model server can reuse its evaluated prefix across calls; keep per-call data out of it.
+
+look_system = """You are tasked with generating concise descriptions for objects in a game. When a player uses the 'look' command on an object, your description will be what they see. Your goal is to create a natural-sounding description based solely on the properties provided, without adding speculative elements.
 Follow these guidelines to create your description:
 
 Write in natural language that feels immersive and game-appropriate.
@@ -35,11 +37,56 @@ Description: This healing potion is red and small. When you drink it, it will re
 Create a single paragraph description that brings the object to life through evocative but accurate details. Don't label or categorize the object explicitly - let the description itself reveal what it is.
 Write your description in <description> tags."""
 
-lookat = f"""You are tasked with describing an object in a text adventure game. The player has used the 'look at $OBJECT_NAME' command. Transnslate these object properties into a natural language description of the object: $PROPERTIES"""
+look = """Here are the object properties to describe:
+<object_properties>
+$OBJECT_PROPERTIES
+</object_properties>"""
+
+look_batch_system = """You are tasked with generating concise descriptions for objects in a game. When a player uses the 'look' command, each nearby object gets its own description, which is what they see. Your goal is to create natural-sounding descriptions based solely on the properties provided, without adding speculative elements.
+Follow these guidelines to create each description:
+
+Write in natural language that feels immersive and game-appropriate.
+Keep descriptions concise (1-3 sentences for simple objects, 3-5 for complex ones).
+Focus only on observable properties - what the player would actually see, hear, or otherwise sense.
+Don't mention game mechanics, stats, or properties by their technical names.
+Don't speculate about elements not included in the properties.
+Use sensory details when appropriate (appearance, texture, sound, smell).
+If the object has a condition property, subtly incorporate it without explicitly stating the condition level.
+For unique or special objects, emphasize their distinctive qualities.
+Describe every object on its own, as if it were the only one; don't refer to the other objects.
+
+<examples>
+<good_example>
+Properties: {name: "Rusty Sword", type: "weapon", material: "iron", condition: "poor", damage: 3}
+Description: A weathered iron sword with orange-brown rust creeping along its blade. The once-sharp edge is now pitted and dull, and the leather wrapping on the handle is beginning to unravel.
+</good_example>
+<bad_example>
+Properties: {name: "Rusty Sword", type: "weapon", material: "iron", condition: "poor", damage: 3}
+Description: This is a Rusty Sword. It is a weapon made of iron in poor condition. It does 3 damage when used in combat.
+</bad_example>
+</examples>
+Each object is given as <object id="N"> followed by its name and properties. For every object, write a single paragraph description that brings it to life through evocative but accurate details, inside an <object id="N"> tag with the same id:
+<object id="1">
+...description of object 1...
+</object>
+<object id="2">
+...description of object 2...
+</object>"""
 
-lookat_fail = f"""The player has used the '$COMMAND' command. However, the object the player is trying to look at doesn't exist!. Write a short  comment to inform the player the command has failed."""
+look_batch = """Here are the objects to describe:
+<objects>
+$OBJECTS
+</objects>"""
 
-deterministic_action = """You are an action resolution system for an adventure game. You will receive descriptions of an actor, an entity they're interacting with, and an action being attempted. Your job is to determine if the action succeeds or fails based on the actor's capabilities and the nature of the action. The actors motives are irrelevant.
+lookat_system = """You are tasked with describing an object in a text adventure game."""
+
+lookat = """The player has used the 'look at $OBJECT_NAME' command. Transnslate these object properties into a natural language description of the object: $PROPERTIES"""
+
+lookat_fail_system = """You are tasked with describing an object in a text adventure game."""
+
+lookat_fail = """The player has used the '$COMMAND' command. However, the object the player is trying to look at doesn't exist!. Write a short  comment to inform the player the command has failed."""
+
+deterministic_action_system = """You are an action resolution system for an adventure game. You will receive descriptions of an actor, an entity they're interacting with, and an action being attempted. Your job is to determine if the action succeeds or fails based on the actor's capabilities and the nature of the action. The actors motives are irrelevant.
 
 RESOLUTION RULES:
 1. If the action does not require tools or skills/properties, it succeeds.
@@ -80,9 +127,9 @@ Straighten the bent door using smithing skills
 </scratchpad>
 success()
 
-Now, analyze your inputs and determine the outcome. Write your thought process in <scratchpad> tags, then provide your command in the next line.
+Now, analyze your inputs and determine the outcome. Write your thought process in <scratchpad> tags, then provide your command in the next line."""
 
-Here are the descriptions you will analyze:
+deterministic_action = """Here are the descriptions you will analyze:
 
 <actor>
 $ACTOR_DESCRIPTION
@@ -96,7 +143,7 @@ $ENTITY_DESCRIPTION
 $ACTION_DESCRIPTION
 </action>"""
 
-interaction_update_all_properties_prompt = """You are an **Action Resolution Engine** for a text adventure.  
+interaction_update_all_properties_prompt_system = """You are an **Action Resolution Engine** for a text adventure.  
 Your job: receive an ACTOR description, an ENTITY description, and an ACTION that has *already succeeded*.  
 Produce *only* the property updates for the entity, using one `set_property` call per changed property.
 
@@ -159,9 +206,9 @@ set_property("metal door", "bent", false)
 set_property("metal door", "appearance", "straightened dull iron slab")
 </update>
 
-Follow these steps for every turn.  Remember: **action always succeeds**, update only the affected properties, and keep string descriptions rich and consistent.
+Follow these steps for every turn.  Remember: **action always succeeds**, update only the affected properties, and keep string descriptions rich and consistent."""
 
-<Inputs>
+interaction_update_all_properties_prompt = """<Inputs>
 <actor>
 $ACTOR
 </actor>
@@ -173,22 +220,7 @@ $ACTION
 </action>
 </Inputs>"""
 
-trade_validation = """You are evaluating trade interactions between characters in an adventure game setting. Your task is to determine whether a proposed trade succeeds based on the characters' motivations, inventories, and the items being traded.
-
-Here is the description of the actor (the one making the trade offer):
-<actor_description>
-$ACTOR_DESCRIPTION
-</actor_description>
-
-Here is the description of the other character:
-<entity_description>
-$ENTITY_DESCRIPTION
-</entity_description>
-
-Here is the description of the trade offer:
-<action_description>
-$ACTION_DESCRIPTION
-</action_description>
+trade_validation_system = """You are evaluating trade interactions between characters in an adventure game setting. Your task is to determine whether a proposed trade succeeds based on the characters' motivations, inventories, and the items being traded.
 
 Follow these rules to evaluate the trade:
 
@@ -245,7 +277,118 @@ Here's an example:
 - The trade aligns well with the librarian's presumed motivations
 </thinking>
 trade("rare magic book", "small silver statue")
-</example>
+</example>"""
+
+trade_validation = """Here is the description of the actor (the one making the trade offer):
+<actor_description>
+$ACTOR_DESCRIPTION
+</actor_description>
+
+Here is the description of the other character:
+<entity_description>
+$ENTITY_DESCRIPTION
+</entity_description>
+
+Here is the description of the trade offer:
+<action_description>
+$ACTION_DESCRIPTION
+</action_description>
 
 Begin your evaluation now.
-"""
\ No newline at end of file
+"""
+
+deterministic_action_with_updates_system = """You are an action resolution system for an adventure game. You will receive descriptions of an actor, an entity they're interacting with, and an action being attempted. Your job is to determine if the action succeeds or fails based on the actor's capabilities and the nature of the action, describe the outcome to the player, and list how the entity's properties change. The actors motives are irrelevant.
+
+RESOLUTION RULES:
+1. If the action does not require tools or skills/properties, it succeeds.
+2. If the action requires a tool and the actor has an appropriate tool, the action succeeds
+3. If the action requires a skill/property that the actor has or is implied to have (through background), the action succeeds
+4. If the action requires both a tool and skill:
+   a. Having the tool alone is sufficient for success
+   b. Missing the tool results in failure
+5. If none of the above conditions are met, the action fails
+
+UPDATE RULES:
+- Only when the verdict is "success", list every property of the entity that the action modifies. When the verdict is "fail", the list is empty.
+- Use the exact property names of the entity.
+- Boolean values are written true or false, numeric values stay numeric.
+- String values keep the relevant original description plus the change.
+- Do not list properties that do not change.
+
+OUTPUT FORMAT:
+Answer with a single JSON object with these fields, in this order:
+- "reasoning": first decide whether the action requires a skill, then whether the action requires a tool, then follow the resolution rules to reach a decision
+- "verdict": "success" if the action succeeds, "fail" if it fails
+- "narration": one to three sentences telling the player what happens, in second person
+- "updates": a list of {"property": "<property-name>", "value": "<new value>"} objects
+
+EXAMPLE:
+<actor>
+- name: John Smith
+- background: Blacksmith
+- tool: Hammer
+- strength: very strong
+</actor>
+
+<entity>
+- name: metal door
+- locked: false
+- bent: true
+- appearance: dull iron slab
+</entity>
+
+<action>
+Straighten the bent door using smithing skills
+</action>
+
+{"reasoning": "Action requires smithing skill - actor has blacksmith background. Action requires smithing tools - actor has hammer. Actor has both relevant skill and tool - action should succeed.", "verdict": "success", "narration": "You hammer the twisted iron back into shape until the door hangs straight again.", "updates": [{"property": "bent", "value": "false"}, {"property": "appearance", "value": "straightened dull iron slab"}]}"""
+
+deterministic_action_with_updates = """Here are the descriptions you will analyze:
+
+<actor>
+$ACTOR_DESCRIPTION
+</actor>
+
+<entity>
+$ENTITY_DESCRIPTION
+</entity>
+
+<action>
+$ACTION_DESCRIPTION
+</action>"""
+
+npc_action_system = """You are playing a non-player character (NPC) in a text adventure game. Every now and then the NPC gets a turn of its own: it may say something, react to what just happened, or do something small with itself or its surroundings. Stay in character and base the turn only on the NPC's description, its surroundings and the recent events.
+Rules:
+- Write one or two short sentences in the third person and present tense, for example: The knight sighs and polishes his shield.
+- Put anything the NPC says in double quotes.
+- Never act or decide for the player.
+- Don't use objects that are neither around the NPC nor in its inventory.
+- If the NPC would simply carry on with what it is doing, describe that briefly.
+You may think in <thinking> tags first. Write the turn in <action> tags."""
+
+npc_action = """The NPC:
+$NPC_DESCRIPTION
+
+Around the NPC:
+$SURROUNDINGS
+
+Recent events:
+$RECENT_EVENTS
+
+Write $NPC_NAME's turn."""
+
+# Parsed once at import; template name -> templates.Template
+templates = {
+    name: Template(name, text, system)
+    for name, system, text in [
+        ("look", look_system, look),
+        ("look_batch", look_batch_system, look_batch),
+        ("lookat", lookat_system, lookat),
+        ("lookat_fail", lookat_fail_system, lookat_fail),
+        ("deterministic_action", deterministic_action_system, deterministic_action),
+        ("interaction_update_all_properties_prompt", interaction_update_all_properties_prompt_system, interaction_update_all_properties_prompt),
+        ("trade_validation", trade_validation_system, trade_validation),
+        ("deterministic_action_with_updates", deterministic_action_with_updates_system, deterministic_action_with_updates),
+        ("npc_action", npc_action_system, npc_action),
+    ]
+}
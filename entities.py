@@ -3,20 +3,18 @@ from pygame.locals import *
 from render import Render
 
 class EntitySprite(pygame.sprite.Sprite):
-    def __init__(self, image):
+    def __init__(self, image, display_image=None):
         super().__init__()
         self.image = image
+        self.display_image = display_image  # Optional copy of image at screen scale, used for drawing
         self.rect = self.image.get_rect()
-        self.collision_rects = None  # Rectangles for collision detection
+        self.collision_index = None  # SpatialHash of the rectangles this sprite collides with
 
     def check_collision(self, rect):
         """Checks for collisions with other rectangles."""
-        for collision_rect in self.collision_rects or []:
-            if rect.colliderect(collision_rect):
-                # print(f"{collision_rect=}")
-                # print(f"{rect=}")
-                return collision_rect
-        return None
+        if self.collision_index is None:
+            return None
+        return self.collision_index.first_collision(rect)
 
     def sync_position(self, pos):
         """Syncs the sprite's position with the logical player's position."""
@@ -24,7 +22,7 @@ class EntitySprite(pygame.sprite.Sprite):
 
 
 class MovableEntity:
-    def __init__(self, image, pos, properties={}, speed=0.125, render_image=True):
+    def __init__(self, image, pos, properties={}, speed=0.125, render_image=True, display_image=None):
         self.position = pygame.math.Vector2(pos) / 16 # Logical position
         self.velocity = pygame.math.Vector2(0, 0)
         self.speed = speed
@@ -52,7 +50,7 @@ class MovableEntity:
         if image is None:
             return
         
-        self.sprite = EntitySprite(image)  # Create the associated sprite
+        self.sprite = EntitySprite(image, display_image)  # Create the associated sprite
         self.sync_position()  # Sync sprite position
 
     def move(self, direction):
@@ -0,0 +1,171 @@
+def normalize_name(name):
+    """Lower case with single spaces, the form names are indexed and looked up in."""
+    return " ".join(str(name or "").lower().split())
+
+
+def name_grams(name, size=3):
+    """Every substring of name up to size characters long."""
+    return {name[i:i + n] for n in range(1, size + 1) for i in range(len(name) - n + 1)}
+
+
+class EntityRegistry:
+    """
+    The entities the player can interact with, indexed by id, grid cell and name.
+
+    Ids are handed out in registration order and never reused, so they stay valid as the
+    object_index of a turn even when entities are added meanwhile. Indexing, len() and
+    iteration work like the list this replaces (iteration is in id order).
+
+    - cells: grid cell (the rounded position) -> ids, for clicks and radius queries
+    - names: normalized name -> ids, for exact lookups
+    - grams: every 1 to 3 character substring of a name -> names, so substring lookups
+      only verify the few names sharing the query's trigrams
+
+    Positions and names are read when an entity is added; call refresh() after moving or
+    renaming one. Id buckets are only appended to or replaced, never edited in place, so worker
+    threads may query while the main thread updates.
+    """
+
+    def __init__(self, entities=()):
+        self.entities = []      # id -> entity
+        self.ids = {}           # id(entity) -> registry id
+        self.entity_cells = []  # registry id -> indexed cell
+        self.entity_names = []  # registry id -> indexed normalized name
+        self.cells = {}         # cell -> list of ids, ascending
+        self.names = {}         # normalized name -> list of ids, ascending
+        self.grams = {}         # substring -> set of normalized names
+        for entity in entities:
+            self.add(entity)
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __iter__(self):
+        return iter(self.entities)
+
+    def __getitem__(self, entity_id):
+        return self.entities[entity_id]
+
+    def __contains__(self, entity):
+        return id(entity) in self.ids
+
+    def index(self, entity):
+        """The id of entity; raises ValueError if it is not registered."""
+        try:
+            return self.ids[id(entity)]
+        except KeyError:
+            raise ValueError(f"{entity!r} is not registered") from None
+
+    @staticmethod
+    def cell_of(position):
+        rounded = round(position)  # Vector2 rounds halves away from zero, unlike round() on floats
+        return (int(rounded.x), int(rounded.y))
+
+    def add(self, entity):
+        """Registers entity and returns its id."""
+        entity_id = len(self.entities)
+        self.entities.append(entity)
+        self.ids[id(entity)] = entity_id
+        self.entity_cells.append(None)
+        self.entity_names.append(None)
+        self._index_cell(entity_id, self.cell_of(entity.position))
+        self._index_name(entity_id, normalize_name(entity.properties.get("name", "")))
+        return entity_id
+
+    def refresh(self, entity):
+        """Re-indexes entity after its position or name changed. Cheap when nothing did."""
+        entity_id = self.index(entity)
+        cell = self.cell_of(entity.position)
+        if cell != self.entity_cells[entity_id]:
+            self._unindex(self.cells, self.entity_cells[entity_id], entity_id)
+            self._index_cell(entity_id, cell)
+        name = normalize_name(entity.properties.get("name", ""))
+        if name != self.entity_names[entity_id]:
+            old_name = self.entity_names[entity_id]
+            self._unindex(self.names, old_name, entity_id)
+            if old_name not in self.names:
+                for gram in name_grams(old_name):
+                    self.grams[gram].discard(old_name)
+            self._index_name(entity_id, name)
+
+    def _index_cell(self, entity_id, cell):
+        self.entity_cells[entity_id] = cell
+        self._insert(self.cells, cell, entity_id)
+
+    def _index_name(self, entity_id, name):
+        self.entity_names[entity_id] = name
+        if name not in self.names:
+            for gram in name_grams(name):
+                self.grams.setdefault(gram, set()).add(name)
+        self._insert(self.names, name, entity_id)
+
+    @staticmethod
+    def _insert(index, key, entity_id):
+        bucket = index.get(key)
+        if bucket is None:
+            index[key] = [entity_id]
+        elif bucket[-1] < entity_id:
+            bucket.append(entity_id)  # the common case when registering; appending is atomic
+        else:
+            index[key] = sorted(bucket + [entity_id])
+
+    @staticmethod
+    def _unindex(index, key, entity_id):
+        remaining = [i for i in index[key] if i != entity_id]
+        if remaining:
+            index[key] = remaining
+        else:
+            del index[key]
+
+    def at_cell(self, cell):
+        """Entities whose rounded position is cell, in id order."""
+        return [self.entities[i] for i in self.cells.get(tuple(cell), ())]
+
+    def within(self, center, radius):
+        """
+        Entities closer than radius to center, nearest first (ties in id order).
+        Only the cells around center are visited.
+        """
+        center_x, center_y = self.cell_of(center)
+        reach = int(radius) + 1  # a position is at most half a cell away from its cell
+        found = []
+        for x in range(center_x - reach, center_x + reach + 1):
+            for y in range(center_y - reach, center_y + reach + 1):
+                for entity_id in self.cells.get((x, y), ()):
+                    distance = center.distance_to(self.entities[entity_id].position)
+                    if distance < radius:
+                        found.append((distance, entity_id))
+        found.sort()
+        return [self.entities[entity_id] for _, entity_id in found]
+
+    def named(self, name):
+        """Entities with exactly this (normalized) name, in id order."""
+        return [self.entities[i] for i in self.names.get(normalize_name(name), ())]
+
+    def containing(self, fragment):
+        """Entities whose name contains fragment, in id order."""
+        fragment = normalize_name(fragment)
+        if not fragment:
+            return list(self.entities)
+        # Gram sets grow in place; copying or intersecting them is atomic, iterating them is not.
+        if len(fragment) <= 3:
+            candidates = self.grams.get(fragment, set()).copy()
+        else:
+            gram_sets = sorted((self.grams.get(fragment[i:i + 3], set()) for i in range(len(fragment) - 2)), key=len)
+            candidates = gram_sets[0].intersection(*gram_sets[1:])
+        ids = sorted(i for name in candidates if fragment in name for i in self.names[name])
+        return [self.entities[i] for i in ids]
+
+    def named_within(self, text):
+        """Entities whose whole name appears in text as whole words, in id order."""
+        text = normalize_name(text)
+        if not text:
+            return []
+        # Names are normalized to single spaces too, so only spans of whole words can match.
+        starts = [0] + [i + 1 for i, char in enumerate(text) if char == " "]
+        ends = [start - 1 for start in starts[1:]] + [len(text)]
+        ids = set()
+        for first, start in enumerate(starts):
+            for end in ends[first:]:
+                ids.update(self.names.get(text[start:end], ()))
+        return [self.entities[i] for i in sorted(ids)]
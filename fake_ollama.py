@@ -0,0 +1,290 @@
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import descriptive_prompts as dp
+from prompt_builder import estimate_tokens
+
+TOKEN_PATTERN = re.compile(r"\s*\S+|\s+$")
+OBJECT_PATTERN = re.compile(r'<object id="(\d+)">\n([^:\n]*):')
+
+
+def look_batch_response(prompt):
+    """One description per <object id="N"> block of the prompt."""
+    objects = OBJECT_PATTERN.findall(prompt[prompt.find("<objects>"):])
+    return "<thinking>Describing every object.</thinking>\n" + "\n".join(
+        f'<object id="{object_id}">\nA plain {name.strip()}, much like any other.\n</object>' for object_id, name in objects
+    )
+
+
+# Default answers per prompt template, shaped like what the game's parsers expect.
+DEFAULT_RESPONSES = {
+    "look": "<thinking>Nothing special.</thinking><description>A quiet spot with a few things lying around.</description>",
+    "look_batch": look_batch_response,
+    "lookat": "<description>It looks exactly as you would expect.</description>",
+    "lookat_fail": "There is nothing like that here.",
+    "deterministic_action": "<thinking>The actor can do this.</thinking>\nThe attempt works out. success()",
+    "interaction_update_all_properties_prompt": "<thinking>Nothing changes.</thinking>",
+    "trade_validation": "<thinking>Not interested.</thinking>\nThe offer is declined. skip()",
+    "deterministic_action_with_updates": json.dumps({
+        "reasoning": "The actor can do this.",
+        "verdict": "success",
+        "narration": "The attempt works out.",
+        "updates": [],
+    }),
+    "npc_action": "<action>The NPC glances around and carries on.</action>",
+    "other": "OK.",
+}
+
+
+def matches(template, prompt):
+    """True if every literal part of template appears in prompt, in order."""
+    position = 0
+    for literal in template.segments[0::2]:
+        literal = literal.strip()
+        found = prompt.find(literal, position)
+        if found == -1:
+            return False
+        position = found + len(literal)
+    return True
+
+
+def template_name(system, prompt):
+    """The template that renders to (system, prompt); the most specific one when several share a system."""
+    candidates = [
+        template for template in dp.templates.values()
+        if template.system == (system or "") and matches(template, prompt)
+    ]
+    if not candidates:
+        return "other"
+    return max(candidates, key=lambda template: len(template.literal_text)).name
+
+
+class FakeOllama:
+    """
+    Generates answers the way an Ollama server would time them.
+
+    Every request waits ttft seconds (plus the prompt's evaluation time, when
+    prompt_tokens_per_second is set) before its first token and then streams at
+    tokens_per_second. Like Ollama, each of the parallel slots keeps its last prompt,
+    so a request only pays for the part after the longest prefix it shares with it.
+    Answers are chosen per prompt template (recognised by its system section and
+    literal text), from responses or else DEFAULT_RESPONSES.
+    """
+
+    def __init__(self, ttft=0.2, tokens_per_second=40.0, prompt_tokens_per_second=None, parallel=1, responses=None):
+        """
+        Args:
+            ttft (float): Seconds before the first token, on top of prompt evaluation
+            tokens_per_second (float): Generation speed, 0 for no delay
+            prompt_tokens_per_second (float | None): Prompt evaluation speed, None to make it free
+            parallel (int): Requests served at once (OLLAMA_NUM_PARALLEL); the rest wait
+            responses (dict, optional): template name -> canned answer (str), overriding the defaults
+        """
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.responses = {**DEFAULT_RESPONSES, **(responses or {})}
+        self.slots = [""] * parallel  # last evaluated text per slot
+        self.free_slots = list(range(parallel))
+        self.slot_condition = threading.Condition()
+        self.lock = threading.Lock()
+        self.requests = {}  # template name -> number of requests
+        self.cancelled = 0
+
+    def respond(self, name, prompt):
+        response = self.responses.get(name, self.responses["other"])
+        return response(prompt) if callable(response) else response
+
+    def acquire_slot(self, text):
+        """Waits for a free slot, preferring the one whose last prompt shares the longest prefix with text."""
+        with self.slot_condition:
+            while not self.free_slots:
+                self.slot_condition.wait()
+            slot = max(self.free_slots, key=lambda i: len(common_prefix(self.slots[i], text)))
+            self.free_slots.remove(slot)
+            return slot
+
+    def release_slot(self, slot, text):
+        with self.slot_condition:
+            self.slots[slot] = text
+            self.free_slots.append(slot)
+            self.slot_condition.notify()
+
+    def generate(self, system, prompt, options=None):
+        """
+        Yields (token, None) pairs, then ("", stats) with Ollama's final-line fields.
+        Holds a slot until the generator is exhausted or closed.
+        """
+        name = template_name(system, prompt)
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+        text = f"{system}\n\n{prompt}" if system else prompt
+        started = time.perf_counter()
+        slot = self.acquire_slot(text)
+        try:
+            prompt_tokens = estimate_tokens(text)
+            recomputed = prompt_tokens - estimate_tokens(common_prefix(self.slots[slot], text))
+            prompt_eval = recomputed / self.prompt_tokens_per_second if self.prompt_tokens_per_second else 0.0
+            time.sleep(self.ttft + prompt_eval)
+
+            tokens = TOKEN_PATTERN.findall(self.respond(name, prompt))
+            num_predict = (options or {}).get("num_predict")
+            if num_predict is not None and num_predict >= 0:
+                tokens = tokens[:num_predict]
+
+            generation_started = time.perf_counter()
+            for i, token in enumerate(tokens):
+                if self.tokens_per_second:
+                    # Sleep until the token is due, so timer overshoot doesn't add up.
+                    delay = generation_started + (i + 1) / self.tokens_per_second - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                yield token, None
+
+            finished = time.perf_counter()
+            yield "", {
+                "total_duration": int((finished - started) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": recomputed,
+                "prompt_eval_duration": int(prompt_eval * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int((finished - generation_started) * 1e9),
+            }
+        finally:
+            self.release_slot(slot, text)
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.requests), "cancelled": self.cancelled}
+
+
+def common_prefix(a, b):
+    n = 0
+    limit = min(len(a), len(b))
+    while n < limit and a[n] == b[n]:
+        n += 1
+    return a[:n]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """/api/generate and /api/chat, streamed as NDJSON over chunked transfer encoding like Ollama."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        model = payload.get("model", "fake")
+
+        if self.path == "/api/generate":
+            system, prompt = payload.get("system"), payload.get("prompt", "")
+            line = lambda token: {"model": model, "response": token}
+        elif self.path == "/api/chat":
+            messages = payload.get("messages", [])
+            system = "\n\n".join(m["content"] for m in messages if m.get("role") == "system") or None
+            prompt = "\n\n".join(m["content"] for m in messages if m.get("role") != "system")
+            line = lambda token: {"model": model, "message": {"role": "assistant", "content": token}}
+        else:
+            self.send_error(404)
+            return
+
+        tokens = self.server.fake.generate(system, prompt, payload.get("options"))
+        if not payload.get("stream", True):
+            text, stats = [], {}
+            for token, final in tokens:
+                text.append(token)
+                stats = final or stats
+            body = json.dumps({**line("".join(text)), "done": True, **stats}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token, final in tokens:
+                message = {**line(token), "done": final is not None, **(final or {})}
+                data = (json.dumps(message) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; like Ollama, stop generating.
+            tokens.close()
+            with self.server.fake.lock:
+                self.server.fake.cancelled += 1
+            self.close_connection = True
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), fake=None):
+        super().__init__(address, FakeOllamaHandler)
+        self.fake = fake or FakeOllama()
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is routine, not worth a traceback.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serves on a background thread; returns self."""
+        threading.Thread(target=self.serve_forever, name="fake_ollama", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for an Ollama server with scripted timing and answers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=None,
+                        help="prompt evaluation speed; unset makes prompt evaluation free")
+    parser.add_argument("--parallel", type=int, default=1, help="requests served at once")
+    parser.add_argument("--responses", help="JSON file mapping template names to canned answers")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            responses = json.load(f)
+
+    fake = FakeOllama(args.ttft, args.tokens_per_second, args.prompt_tokens_per_second, args.parallel, responses)
+    server = FakeOllamaServer((args.host, args.port), fake)
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(fake.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
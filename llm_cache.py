@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "llm_responses.sqlite")
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for model responses.
+
+    Two tiers: an in-memory LRU in front of a persistent SQLite table. Both are
+    size bounded; the disk tier evicts the least recently used rows. The cache
+    is shared by the LLM worker threads, so every access is serialized by a lock.
+    Disk hits don't write: their use times are kept in memory and written with the
+    next put() (before it evicts), flush() or close().
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_entries=256, disk_entries=5000):
+        """
+        Args:
+            path (str | None): SQLite file for the persistent tier, None for memory only
+            memory_entries (int): Maximum responses kept in the in-memory LRU
+            disk_entries (int): Maximum responses kept on disk
+        """
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory = OrderedDict()
+        self.touched = {}  # key -> last use of a disk hit, not written yet
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self.db.commit()
+            self.disk_count = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, prompt, options=None):
+        """Hash of everything that determines the generated text."""
+        payload = json.dumps([model, prompt, options or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns the cached response for key or None."""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.touched[key] = time.time()
+                    self._remember(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        with self.lock:
+            self._remember(key, response)
+
+            if self.db is None:
+                return
+            self._write_touched()
+            exists = self.db.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+                (key, response, time.time()),
+            )
+            if not exists:
+                self.disk_count += 1
+            if self.disk_count > self.disk_entries:
+                overflow = self.disk_count - self.disk_entries
+                self.db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                self.disk_count -= overflow
+            self.db.commit()
+
+    def _write_touched(self):
+        """Writes the pending use times of disk hits; the caller commits."""
+        if self.touched:
+            self.db.executemany(
+                "UPDATE responses SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self.touched.items()],
+            )
+            self.touched.clear()
+
+    def flush(self):
+        """Writes the pending use times of disk hits."""
+        with self.lock:
+            if self.db is not None and self.touched:
+                self._write_touched()
+                self.db.commit()
+
+    def _remember(self, key, response):
+        self.memory[key] = response
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.touched.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses")
+                self.db.commit()
+                self.disk_count = 0
+
+    def stats(self):
+        """Hit/miss counters and current tier sizes."""
+        with self.lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self.memory),
+                "disk_entries": self.disk_count if self.db is not None else 0,
+            }
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self._write_touched()
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+
+class DescriptionCache:
+    """
+    Generated entity descriptions, keyed by a hash of what the player can see of the entity.
+
+    An entity whose visible properties didn't change since it was last described is served
+    from here; changing any visible property changes the key. Memory only, LRU bounded, and
+    shared with the LLM worker threads.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def make_key(visible_description):
+        return hashlib.sha256(visible_description.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            description = self.entries.get(key)
+            if description is not None:
+                self.entries.move_to_end(key)
+            return description
+
+    def put(self, key, description):
+        with self.lock:
+            self.entries[key] = description
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,284 @@
+import heapq
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Job priorities; lower values run first.
+PLAYER_PRIORITY = 0
+NPC_PRIORITY = 1
+BACKGROUND_PRIORITY = 2  # prefetching and speculative warm-ups, only on otherwise idle slots
+
+# Requests the model server evaluates at once (Ollama's OLLAMA_NUM_PARALLEL); LLM_PARALLEL overrides it.
+PARALLEL_SLOTS = int(os.environ.get("LLM_PARALLEL", "1"))
+
+
+class LLMJob:
+    """A submitted call and its scheduling state."""
+
+    def __init__(self, fn, args, kwargs, priority, sequence, stale, cancellable):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.sequence = sequence
+        self.stale = stale
+        self.cancel_event = threading.Event() if cancellable else None
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.started = None
+        self.preempted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class LLMDispatcher:
+    """
+    Runs LLM jobs on a worker pool so the game loop never blocks on the model.
+
+    Jobs are submitted from the main thread and return a Future. Completion
+    callbacks are NOT run on the worker thread: the game calls poll() once per
+    frame and callbacks are executed there, so every world mutation (properties,
+    inventories, trades) still happens on the main thread.
+
+    Jobs wait in a priority queue (lower priority first, then submission order) and at
+    most max_workers run at once, which should match the model server's parallel slots.
+    reserve() holds slots for model work done outside the dispatcher, like the player's
+    streamed answer. When higher priority work cannot get a slot, running cancellable
+    jobs of lower priority are preempted: their cancel_event is set and, once they
+    return, they are queued again. A job whose stale() is True by the time it would
+    start is dropped and its future cancelled.
+    """
+
+    def __init__(self, max_workers=1, max_samples=200):
+        """
+        Args:
+            max_workers (int): How many jobs may run at once
+            max_samples (int): How many queue wait times to keep per priority, for stats()
+        """
+        self.max_workers = max_workers
+        self.max_samples = max_samples
+        self.pending = []  # (future, on_done, on_error, priority) in submission order
+        self.posted = queue.SimpleQueue()  # callables handed over from other threads
+        self.queue = []  # heap of waiting LLMJobs
+        self.running = set()
+        self.reserved = 0
+        self.reserved_priority = PLAYER_PRIORITY
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.waits = {}  # priority -> recent queue wait times in seconds
+        self.dropped = 0
+        self.preempted = 0
+        self.workers = [
+            threading.Thread(target=self._work, name=f"llm_{i}", daemon=True) for i in range(max_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    @property
+    def busy(self):
+        """True while at least one submitted job has not been delivered by poll()."""
+        return len(self.pending) > 0
+
+    def busy_with(self, priority):
+        """True while a job of this priority (or a higher one) has not been delivered by poll()."""
+        return any(entry[3] <= priority for entry in self.pending)
+
+    @property
+    def depth(self):
+        """Number of jobs waiting for a slot."""
+        return len(self.queue)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, priority=PLAYER_PRIORITY, stale=None,
+               cancellable=False, **kwargs):
+        """
+        Queue fn(*args, **kwargs) on the worker pool.
+
+        Args:
+            fn (callable): The blocking job to run (usually an llm_logic call).
+            on_done (callable, optional): Called on the main thread with the job's result.
+            on_error (callable, optional): Called on the main thread with the raised exception.
+            priority (int): PLAYER_PRIORITY, NPC_PRIORITY, ...; lower values run first.
+            stale (callable, optional): Checked right before the job starts; if it returns True
+                the job is dropped. Called on a worker thread with the queue locked, keep it cheap.
+            cancellable (bool): fn accepts a cancel_event keyword argument and returns soon after
+                it is set, which lets higher priority jobs preempt it.
+
+        Returns:
+            Future: The future tracking the job.
+        """
+        job = LLMJob(fn, args, kwargs, priority, next(self.sequence), stale, cancellable)
+        if cancellable:
+            job.kwargs = {**kwargs, "cancel_event": job.cancel_event}
+            # Cancelling the future of a running job asks the job to stop as well.
+            job.future.add_done_callback(lambda future: future.cancelled() and job.cancel_event.set())
+        with self.condition:
+            heapq.heappush(self.queue, job)
+            self._preempt_locked()
+            self.condition.notify()
+        self.pending.append((job.future, on_done, on_error, priority))
+        return job.future
+
+    def reserve(self, slots, priority=PLAYER_PRIORITY):
+        """Holds slots for model work of this priority done outside the dispatcher; 0 releases them."""
+        with self.condition:
+            if slots == self.reserved and priority == self.reserved_priority:
+                return
+            self.reserved = slots
+            self.reserved_priority = priority
+            self._preempt_locked()
+            self.condition.notify_all()
+
+    def _free_slots_locked(self, job):
+        reserved = self.reserved if self.reserved_priority <= job.priority else 0
+        return self.max_workers - reserved - len(self.running)
+
+    def _preempt_locked(self):
+        """Preempts running jobs that would not get a slot if every slot were handed out by priority again."""
+        contenders = [(self.reserved_priority, -1)] * self.reserved
+        contenders += [(job.priority, job.sequence) for job in self.running if not job.preempted]
+        contenders += [(job.priority, job.sequence) for job in heapq.nsmallest(self.max_workers, self.queue)]
+        winners = set(heapq.nsmallest(self.max_workers, contenders))
+
+        for job in sorted(self.running, reverse=True):
+            if job.cancel_event is not None and not job.preempted and (job.priority, job.sequence) not in winners:
+                logger.debug(f"Preempting {job.fn.__name__} (priority {job.priority})")
+                job.preempted = True
+                job.cancel_event.set()
+                self.preempted += 1
+
+    def _next_job_locked(self):
+        """Pops the next job that may start now, dropping cancelled and stale ones on the way."""
+        while self.queue and self._free_slots_locked(self.queue[0]) > 0:
+            job = heapq.heappop(self.queue)
+            if job.future.cancelled():
+                continue
+            if job.stale is not None and job.stale():
+                logger.debug(f"Dropping stale {job.fn.__name__} (priority {job.priority})")
+                job.future.cancel()
+                self.dropped += 1
+                continue
+            return job
+        return None
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed:
+                        return
+                    job = self._next_job_locked()
+                    if job is not None:
+                        break
+                    self.condition.wait()
+                if job.started is None:
+                    waits = self.waits.setdefault(job.priority, deque(maxlen=self.max_samples))
+                    waits.append(time.monotonic() - job.submitted)
+                job.started = time.monotonic()
+                self.running.add(job)
+
+            result = error = None
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except BaseException as e:
+                error = e
+
+            with self.condition:
+                self.running.discard(job)
+                requeue = job.preempted and not self.closed and not job.future.cancelled()
+                if requeue:
+                    job.preempted = False
+                    job.cancel_event.clear()
+                    heapq.heappush(self.queue, job)
+                self.condition.notify_all()
+            if requeue or not job.future.set_running_or_notify_cancel():
+                continue
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def post(self, fn, *args):
+        """Schedule fn(*args) to run on the main thread during the next poll(). Thread safe."""
+        self.posted.put((fn, args))
+
+    def poll(self):
+        """Deliver the results of finished jobs and run posted callables. Must be called from the main thread."""
+        while True:
+            try:
+                fn, args = self.posted.get_nowait()
+            except queue.Empty:
+                break
+            fn(*args)
+
+        if not self.pending:
+            return
+
+        still_pending = []
+        finished = []
+        for entry in self.pending:
+            if entry[0].done():
+                finished.append(entry)
+            else:
+                still_pending.append(entry)
+        self.pending = still_pending
+
+        for future, on_done, on_error, _ in finished:
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None:
+                logger.error(f"LLM job failed: {error!r}")
+                if on_error:
+                    on_error(error)
+                continue
+            if on_done:
+                on_done(future.result())
+
+    def stats(self):
+        """Queue depth, running jobs and recent queue wait times (in ms) per priority."""
+        with self.condition:
+            queued = {}
+            for job in self.queue:
+                queued[job.priority] = queued.get(job.priority, 0) + 1
+            waits = {priority: sorted(samples) for priority, samples in self.waits.items()}
+            stats = {
+                "depth": len(self.queue),
+                "queued": queued,
+                "running": len(self.running),
+                "reserved": self.reserved,
+                "dropped": self.dropped,
+                "preempted": self.preempted,
+            }
+        stats["wait_ms"] = {
+            priority: {
+                "count": len(samples),
+                "p50": 1000 * samples[len(samples) // 2],
+                "p95": 1000 * samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                "max": 1000 * samples[-1],
+            }
+            for priority, samples in waits.items() if samples
+        }
+        return stats
+
+    def shutdown(self):
+        with self.condition:
+            self.closed = True
+            for job in self.queue:
+                job.future.cancel()
+            self.queue = []
+            for job in self.running:
+                if job.cancel_event is not None:
+                    job.cancel_event.set()
+            self.condition.notify_all()
+        for future, _, _, _ in self.pending:
+            future.cancel()
+        self.pending = []
@@ -1,27 +1,100 @@
-from lm_com import generate_text_stream, generate_text_non_streaming
+import json
+
+from llm_cache import DescriptionCache
+from lm_com import generate_text_stream, generate_text_non_streaming, warm_prompt
 import descriptive_prompts as dp
-from utils import extract_called_function_args, extract_tags, get_entity_description
+from prompt_builder import EntitySection, get_prompt_builder
+from stream_parser import ObjectTagStreamParser, ResolutionStreamParser, TagStreamParser
+from utils import extract_property_info, get_entity_description, parse_property_value
+
+# Output schema of dp.deterministic_action_with_updates, passed to the model server as "format".
+# Update values are strings so every backend's grammar can express them; parse_property_value types them.
+ACTION_RESOLUTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reasoning": {"type": "string"},
+        "verdict": {"type": "string", "enum": ["success", "fail"]},
+        "narration": {"type": "string"},
+        "updates": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "property": {"type": "string"},
+                    "value": {"type": "string"},
+                },
+                "required": ["property", "value"],
+            },
+        },
+    },
+    "required": ["reasoning", "verdict", "narration", "updates"],
+}
+
+
+# Descriptions written by batched "look" calls, keyed by each entity's visible properties.
+description_cache = DescriptionCache()
 
 
 class llm_logic:
 
+    # Resolve "do" actions with one schema-constrained call instead of verdict + property update calls.
+    combined_do_resolution = True
+
+    # Describe "look" targets one by one in a single call, reusing descriptions of unchanged entities.
+    batched_look = True
+
+
+    def resolve_player_input(turn, text, player_entity, obj_entities):
+        """
+        Prepares one player turn. Meant to be executed off the main thread (see
+        llm_dispatch.LLMDispatcher); it only reads the world.
+
+        The returned llm_output["output"] is a lazy generator: the model is queried while it
+        is consumed. llm_output["parser"] (if not None) fires on_verdict / on_trade /
+        on_complete while streaming, which is where the game applies the turn's effects.
+        """
+        return llm_logic.parse_player_input(turn, text, player_entity, obj_entities)
+
+
+    def resolve_property_updates(turn, text, player_entity, obj_entities, object_index):
+        """
+        Second step of the two-call "do" resolution: asks which properties a successful
+        action changed. Returns the parsed set_property calls.
+        """
+        prompt, obj_index = llm_logic.do_interact_all_command(turn, text, player_entity, obj_entities, object_index)
+        if obj_index == -1:
+            return []
+        print(prompt)
+        template = dp.templates["interaction_update_all_properties_prompt"]
+        text_output = generate_text_non_streaming(prompt, system=template.system, template_name=template.name)
+        print(f"{text_output=}")
+        return extract_property_info(text_output or "")
+
 
     def parse_player_input(
         turn, text, player_entity, obj_entities, 
     ):  # todo replace with target entity (singular)
         if text.lower().startswith("look at"):
+            if llm_logic.batched_look:
+                # Entities near the player are usually described already (see prefetch.py).
+                target = llm_logic.look_at_target(text, obj_entities)
+                description = description_cache.get(description_key(target)) if target is not None else None
+                if description is not None:
+                    return {"output": string_gen(description), "parser": None, "type": "print", "generated": True, "target": None}
+
             prompt = llm_logic.look_at_command(text, obj_entities)
-            text_output  = generate_text_stream(prompt)
-            return {"output": text_output, "type": "print", "generated": True, "target": None} 
+            template = dp.templates["lookat"]
+            parser = TagStreamParser()
+            return {"output": parser.wrap(generate_text_stream(prompt, system=template.system, template_name=template.name)), "parser": parser, "type": "print", "generated": True, "target": None} 
         
         elif text.lower().startswith("look"):
-            prompt = llm_logic.look_command(text, player_entity, 
-                                            [obj for obj in obj_entities if 
-                                             obj.properties.get("name", "") != player_entity.properties["name"]
-            ])
-            text_output  = generate_text_non_streaming(prompt)
-            text_output = extract_tags(text_output, tag_name='description')
-            return {"output": string_gen(text_output), "type": "print", "generated": True, "target": None} 
+            if llm_logic.batched_look:
+                return llm_logic.look_batch_command(text, player_entity, obj_entities)
+
+            prompt = llm_logic.look_command(text, player_entity, obj_entities)
+            template = dp.templates["look"]
+            parser = TagStreamParser(only_tag="description")
+            return {"output": parser.wrap(generate_text_stream(prompt, system=template.system, template_name=template.name)), "parser": parser, "type": "print", "generated": True, "target": None} 
 
         elif text.lower().startswith("pickup") or text.lower().startswith("pick up"):
 
@@ -30,35 +103,49 @@ class llm_logic:
             if obj_index == -1:
                 return {
                     "output": string_gen(prompt),
+                    "parser": None,
                     "text": prompt,
                     "type": "pickup", 
                     "generated": False, 
                     "target": None
                 }
             
-            text_output = generate_text_non_streaming(prompt)
-
+            template = dp.templates["deterministic_action"]
+            parser = TagStreamParser()
             return {
-                "output": string_gen(text_output),
-                "text": text_output,
+                "output": parser.wrap(generate_text_stream(prompt, system=template.system, template_name=template.name)),
+                "parser": parser,
                 "type": "pickup", 
                 "generated": False, 
                 "target": {
                     "entity_index": obj_index,
-                    "property": "success()" in text_output and "failure()" not in text_output,
+                    "property": None,
                 }
             }
         
         elif turn.lower().startswith("interact"):
 
+            if llm_logic.combined_do_resolution:
+                return llm_logic.do_combined_command(turn, text, player_entity, obj_entities)
+
             prompt, obj_index = llm_logic.do_command(turn, text, player_entity, obj_entities)
-            text_output = generate_text_non_streaming(prompt)
+
+            if obj_index == -1:
+                return {
+                    "output": string_gen(prompt),
+                    "parser": None,
+                    "text": prompt,
+                    "type": "do",
+                    "generated": False,
+                    "target": None
+                }
+
             print(prompt)
-            print("# ---")
-            print(text_output)
+            template = dp.templates["deterministic_action"]
+            parser = TagStreamParser()
             return {
-                "output": string_gen(text_output),
-                "text": text_output,
+                "output": parser.wrap(generate_text_stream(prompt, system=template.system, template_name=template.name)),
+                "parser": parser,
                 "type": "do", 
                 "generated": False, 
                 "target": {
@@ -69,178 +156,398 @@ class llm_logic:
         elif turn.lower().startswith("trade"):
             prompt, trade_target, obj_index = llm_logic.inventory_trade_command(turn, text, player_entity, obj_entities)
             print(prompt)
-            text_output = generate_text_non_streaming(prompt)
-            trade_result = extract_called_function_args(text_output, "trade")
+            template = dp.templates["trade_validation"]
+            parser = TagStreamParser()
 
             return {
-                "output": string_gen(text_output),
-                "text": text_output,
+                "output": parser.wrap(generate_text_stream(prompt, system=template.system, template_name=template.name)),
+                "parser": parser,
                 "type": "trade", 
                 "generated": False, 
                 "target": {
                     "entity_index": obj_index,
-                    "property": trade_result,
+                    "property": None,
                 }
             }
         else:
             prompt = text
 
-        text_generator = generate_text_stream(prompt=prompt)
-        return {"output": text_generator, "type": "print", "generated": True, "target": None} 
+        parser = TagStreamParser()
+        return {"output": parser.wrap(generate_text_stream(prompt=prompt)), "parser": parser, "type": "print", "generated": True, "target": None} 
 
 
-    def look_command(text, player_entity, obj_entities):
-        fitting_objs = [
+    def look_targets(player_entity, obj_entities):
+        """Entities other than the player within look range, nearest first."""
+        return [
             obj
-            for obj in obj_entities
-            if (player_entity.position).distance_to(obj.position) < 4
+            for obj in obj_entities.within(player_entity.position, 4)
+            if obj.properties.get("name", "") != player_entity.properties["name"]
         ]
 
-        fitting_objs = sorted(fitting_objs, key=lambda x: x.position.distance_to(player_entity.position))
 
-        obj_properties = "\n".join([f"{obj.properties["name"]}:\n * {'\n * '.join([f"{k}: {v}" 
-                            for k, v in obj.properties.items() 
-                            if k not in ["name", "npc"]])}".strip()
-                            for obj in fitting_objs])
-        
-        obj_properties = "\n".join([
-                            f"{obj.properties["name"]}:\n" + get_entity_description(obj, include_inventory=False, exclude_properties=["name", "npc"], exclude_invisible_properties=True)
-                            for obj in fitting_objs])
-                
-        prompt = dp.look.replace("$OBJECT_PROPERTIES", obj_properties)
+    def in_reach(player_entity, candidates):
+        """The first of candidates (found by name in the registry, in id order) within reach (distance < 4), or None."""
+        for obj in candidates:
+            if player_entity.position.distance_to(obj.position) < 4:
+                return obj
+        return None
+
+
+    def look_command(text, player_entity, obj_entities):
+        fitting_objs = llm_logic.look_targets(player_entity, obj_entities)
+
+        template = dp.templates["look"]
+        prompt = get_prompt_builder().build(
+            "look",
+            template,
+            sections={
+                "OBJECT_PROPERTIES": EntitySection(
+                    fitting_objs, include_inventory=False, exclude_properties=["name", "npc"],
+                    exclude_invisible_properties=True, headers=True, origin=player_entity.position,
+                ),
+            },
+            query=text,
+        )
 
         return prompt
 
 
+    def look_batch_command(text, player_entity, obj_entities):
+        """
+        "look" with one description per entity. Entities whose visible properties are unchanged
+        since they were last described come from description_cache; the rest are described
+        together in one call, and their descriptions are cached once the stream is consumed.
+        """
+        fitting_objs = llm_logic.look_targets(player_entity, obj_entities)
+        keys = [description_key(obj) for obj in fitting_objs]
+        cached = [description_cache.get(key) for key in keys]
+        known = [description for description in cached if description is not None]
+        missing = [(obj, key) for obj, key, description in zip(fitting_objs, keys, cached) if description is None]
+
+        if not missing:
+            answer = "\n\n".join(known) if known else "There is nothing of note around you."
+            return {"output": string_gen(answer), "parser": None, "type": "print", "generated": True, "target": None}
+
+        prompt, template = llm_logic.look_batch_prompt(text, player_entity, [obj for obj, _ in missing])
+        parser = ObjectTagStreamParser()
+        chunks = generate_text_stream(prompt, system=template.system, template_name=template.name)
+
+        def describe():
+            if known:
+                yield "\n\n".join(known) + "\n\n"
+            yield from parser.wrap(chunks)
+            llm_logic.store_descriptions(parser, missing)
+
+        return {"output": describe(), "parser": parser, "type": "print", "generated": True, "target": None}
+
+
+    def look_batch_prompt(text, player_entity, objs):
+        """The look_batch prompt describing objs, numbered from 1 in the given order."""
+        template = dp.templates["look_batch"]
+        prompt = get_prompt_builder().build(
+            "look_batch",
+            template,
+            sections={
+                "OBJECTS": EntitySection(
+                    objs, include_inventory=False, exclude_properties=["name", "npc"],
+                    exclude_invisible_properties=True, headers=('<object id="{index}">\n{name}:\n', "\n</object>"),
+                    origin=player_entity.position,
+                ),
+            },
+            query=text,
+        )
+        return prompt, template
+
+
+    def store_descriptions(parser, missing):
+        """
+        Caches the descriptions a look_batch call produced.
+
+        Args:
+            parser (ObjectTagStreamParser): parser the call's stream went through
+            missing (list): (entity, description_key) pairs, in prompt order
+
+        Returns:
+            int: how many descriptions were cached
+        """
+        stored = 0
+        for object_id, description in parser.result().items():
+            if object_id.isdigit() and 0 < int(object_id) <= len(missing):
+                description_cache.put(missing[int(object_id) - 1][1], description)
+                stored += 1
+        return stored
+
+
+    def prefetch_descriptions(player_entity, obj_entities, cancel_event=None):
+        """
+        Describes the entities of obj_entities that are not in description_cache yet, in one
+        look_batch call, so a later "look" is answered from the cache. Meant for a worker
+        thread (see prefetch.DescriptionPrefetcher).
+
+        Args:
+            cancel_event (threading.Event, optional): once set, the call is abandoned at the
+                next streamed chunk and nothing is cached
+
+        Returns:
+            int: how many descriptions were cached
+        """
+        missing = [(obj, description_key(obj)) for obj in obj_entities]
+        missing = [(obj, key) for obj, key in missing if description_cache.get(key) is None]
+        if not missing:
+            return 0
+
+        prompt, template = llm_logic.look_batch_prompt("look", player_entity, [obj for obj, _ in missing])
+        parser = ObjectTagStreamParser()
+        chunks = generate_text_stream(prompt, system=template.system, template_name=template.name)
+        output = parser.wrap(chunks)
+        for _ in output:
+            if cancel_event is not None and cancel_event.is_set():
+                # Closing the stream drops the connection, which stops the generation server side.
+                output.close()
+                chunks.close()
+                return 0
+        return llm_logic.store_descriptions(parser, missing)
+
+
+    def look_at_target(text, obj_entities):
+        """The first entity whose name contains what follows "look at ", or None."""
+        fitting_objs = obj_entities.containing(text[len("look at "):])
+
+        return fitting_objs[0] if len(fitting_objs) > 0 else None
+
+
     def look_at_command(text, obj_entities):
         
-        obj_named = text[len("look at "):].strip()
+        obj = llm_logic.look_at_target(text, obj_entities)
 
-        fitting_objs = [
-            obj
-            for obj in obj_entities
-            if obj_named in obj.properties.get("name", "")
-        ]
-
-        if len(fitting_objs) > 0:
-            obj = fitting_objs[0]
+        if obj is not None:
             obj_name = obj.properties["name"]
-            obj_properties = get_entity_description(obj, include_inventory=False, exclude_properties=["name", "npc"], exclude_invisible_properties=True)
-            prompt = dp.lookat.replace("$OBJECT_NAME", obj_name).replace(
-                "$PROPERTIES", obj_properties
-            )
+            template = dp.templates["lookat"]
+            prompt = get_prompt_builder().build(
+                "look_at",
+                template,
+                fixed={"OBJECT_NAME": obj_name},
+                sections={
+                    "PROPERTIES": EntitySection(
+                        [obj], include_inventory=False, exclude_properties=["name", "npc"], exclude_invisible_properties=True
+                    ),
+                },
+                query=text,
+                )
         else:
-            prompt = dp.lookat_fail.replace("$COMMAND", text)
+            prompt = dp.templates["lookat_fail"].render(COMMAND=text)
 
         return prompt
 
 
     def pick_up_command(turn, text, player_entity, obj_entities):
 
-        actor_desc = get_entity_description(player_entity, include_inventory=False, exclude_properties=None, exclude_invisible_properties=False)
-
         if text.startswith("pick up"):
             text = text.replace("pick up", "pickup")
 
         entity_name = text[text.find(" ") + 1 :].strip()
         action = "pickup"
-        item_name = text[len("pickup"):].strip().lower()
+        item_name = text[len("pickup"):]
 
-        fitting_objs = [
-            obj
-            for obj in obj_entities
-            if (player_entity.position).distance_to(obj.position) < 4
-        ]
-
-        fitting_objs = [
-            obj
-            for obj in fitting_objs
-            if (obj.properties.get("name", "") in entity_name.strip().lower()) and (item_name == obj.properties.get("name", "") and obj.render_image)
-        ]
+        obj = llm_logic.in_reach(
+            player_entity, [obj for obj in obj_entities.named(item_name) if obj.render_image]
+        )
 
-        if len(fitting_objs) == 0:
+        if obj is None:
             return f"There is no {entity_name} here.", -1
 
-        obj = fitting_objs[0]
-
-        obj_properties = get_entity_description(obj, include_inventory=False, exclude_properties=None, exclude_invisible_properties=False)
         obj_index = obj_entities.index(obj)
-        
-        prompt = (
-            dp.deterministic_action.replace("$ACTOR_DESCRIPTION", actor_desc)
-            .replace("$ENTITY_DESCRIPTION", obj_properties)
-            .replace("$ACTION_DESCRIPTION", action)
+
+        template = dp.templates["deterministic_action"]
+        prompt = get_prompt_builder().build(
+            "pickup",
+            template,
+            fixed={"ACTION_DESCRIPTION": action},
+            sections={
+                "ACTOR_DESCRIPTION": EntitySection([player_entity], include_inventory=False, exclude_invisible_properties=False),
+                "ENTITY_DESCRIPTION": EntitySection([obj], include_inventory=False, exclude_invisible_properties=False),
+            },
+            query=text,
         )
 
         print(f"pickup")
         print(prompt)
         return prompt, obj_index
 
-    def do_command(turn, text, player_entity, obj_entities):
-
-        actor_desc = get_entity_description(player_entity, include_inventory=True, exclude_properties=None, exclude_invisible_properties=False)
+    def do_command(turn, text, player_entity, obj_entities, template_name="deterministic_action"):
 
         _, entity_name = tuple(turn.split("->"))
         action = text
 
-        entity_name = entity_name.strip()
+        obj = llm_logic.in_reach(player_entity, obj_entities.named_within(entity_name))
 
-        fitting_objs = [
-            obj
-            for obj in obj_entities
-            if (player_entity.position).distance_to(obj.position) < 4
-        ]
+        if obj is None:
+            return f"There is no {entity_name.strip()} here.", -1
 
-        fitting_objs = [
-            obj
-            for obj in fitting_objs
-            if obj.properties.get("name", "") in entity_name.strip()
-        ]
-        obj = fitting_objs[0]
         obj_index = obj_entities.index(obj)
-        obj_properties = get_entity_description(obj, include_inventory=True, exclude_properties=None, exclude_invisible_properties=False)
-        
-        prompt = (
-            dp.deterministic_action.replace("$ACTOR_DESCRIPTION", actor_desc)
-            .replace("$ENTITY_DESCRIPTION", obj_properties)
-            .replace("$ACTION_DESCRIPTION", action)
+
+        template = dp.templates[template_name]
+        prompt = get_prompt_builder().build(
+            "do",
+            template,
+            fixed={"ACTION_DESCRIPTION": action},
+            sections={
+                "ACTOR_DESCRIPTION": EntitySection([player_entity], include_inventory=True, exclude_invisible_properties=False),
+                "ENTITY_DESCRIPTION": EntitySection([obj], include_inventory=True, exclude_invisible_properties=False),
+            },
+            query=action,
         )
 
         return prompt, obj_index
 
 
-    def do_interact_all_command(turn, text, player_entity, obj_entities, object_index=-1):
+    def do_combined_command(turn, text, player_entity, obj_entities):
+        """
+        Resolves a "do" action with a single generation returning verdict, narration and
+        property updates as one JSON object. The narration streams to the player; the parser's
+        on_complete receives the parsed resolution (None if the JSON is invalid).
+        """
+        prompt, obj_index = llm_logic.do_command(turn, text, player_entity, obj_entities, template_name="deterministic_action_with_updates")
+        if obj_index == -1:
+            return {"output": string_gen(prompt), "parser": None, "text": prompt, "type": "do", "generated": False, "target": None}
+
+        template = dp.templates["deterministic_action_with_updates"]
+        parser = ResolutionStreamParser(parse_action_resolution)
+        return {
+            "output": parser.wrap(generate_text_stream(
+                prompt, format=ACTION_RESOLUTION_SCHEMA, system=template.system, template_name=template.name
+            )),
+            "parser": parser,
+            "type": "do",
+            "generated": False,
+            "combined": True,
+            "target": {
+                "entity_index": obj_index,
+                "property": None,
+            },
+        }
+
+
+    def do_template_name():
+        return "deterministic_action_with_updates" if llm_logic.combined_do_resolution else "deterministic_action"
+
+
+    def do_prompt_prefix(turn, player_entity, obj_entities):
+        """
+        The part of the "do" prompt's variable tail known as soon as the target is selected:
+        actor and entity, up to where the action text goes. Returns None if the target is out of reach.
+        """
+        prompt, obj_index = llm_logic.do_command(turn, "$ACTION_DESCRIPTION", player_entity, obj_entities, template_name=llm_logic.do_template_name())
+        if obj_index == -1:
+            return None
+        return prompt[:prompt.index("$ACTION_DESCRIPTION")]
+
+
+    def warm_do_command(turn, player_entity, obj_entities, keep_alive=None, cancel_event=None):
+        """Pre-evaluates the system section and the known prefix of the upcoming "do" prompt on the model server."""
+        if cancel_event is not None and cancel_event.is_set():
+            return False
+        prefix = llm_logic.do_prompt_prefix(turn, player_entity, obj_entities)
+        if prefix is None:
+            return False
+        template = dp.templates[llm_logic.do_template_name()]
+        return warm_prompt(prefix, keep_alive=keep_alive, system=template.system)
+
+
+    def prefetch_look_at(entity_name, obj_entities, cancel_event=None):
+        """
+        Generates the "look at <entity_name>" answer ahead of time so it is served from the response cache.
+
+        Args:
+            cancel_event (threading.Event, optional): once set, the call is abandoned at the
+                next streamed chunk and nothing is cached
+
+        Returns:
+            str | None: the answer, None if cancelled
+        """
+        prompt = llm_logic.look_at_command(f"look at {entity_name}", obj_entities)
+        template = dp.templates["lookat"]
+        chunks = generate_text_stream(prompt, system=template.system, template_name=template.name)
+        answer = []
+        for chunk in chunks:
+            if cancel_event is not None and cancel_event.is_set():
+                chunks.close()
+                return None
+            answer.append(chunk)
+        return "".join(answer).strip()
+
+
+    def npc_turn(npc_entity, player_entity, obj_entities, recent_events, cancel_event=None):
+        """
+        One turn of an NPC acting on its own: what it does or says. Meant for a worker thread
+        (see npc_scheduler.NPCScheduler); it only reads the world.
+
+        Args:
+            recent_events (list): the last few chat lines, oldest first
+            cancel_event (threading.Event, optional): once set, the call is abandoned at the next streamed chunk
+
+        Returns:
+            str | None: the NPC's action, None if cancelled
+        """
+        surroundings = [
+            obj for obj in obj_entities.within(npc_entity.position, 4)
+            if obj is not npc_entity and obj.render_image
+        ]
+        template = dp.templates["npc_action"]
+        prompt = get_prompt_builder().build(
+            "npc",
+            template,
+            fixed={
+                "NPC_NAME": npc_entity.properties.get("name", ""),
+                "RECENT_EVENTS": "\n".join(recent_events) or "Nothing happened yet.",
+            },
+            sections={
+                "NPC_DESCRIPTION": EntitySection([npc_entity], include_inventory=True, exclude_properties=["_npc"], exclude_invisible_properties=False),
+                "SURROUNDINGS": EntitySection(
+                    surroundings, include_inventory=False, exclude_properties=["name", "npc"],
+                    exclude_invisible_properties=True, headers=True, origin=npc_entity.position,
+                ),
+            },
+            query=" ".join(recent_events[-1:]),
+        )
+
+        parser = TagStreamParser(only_tag="action")
+        chunks = generate_text_stream(prompt, system=template.system, template_name=template.name)
+        visible = []
+        for chunk in chunks:
+            if cancel_event is not None and cancel_event.is_set():
+                chunks.close()
+                return None
+            visible.append(parser.feed(chunk))
+        visible.append(parser.close())
+        return "".join(visible).strip()
 
-        actor_desc = get_entity_description(player_entity, include_inventory=True, exclude_properties=None, exclude_invisible_properties=False)
+
+    def do_interact_all_command(turn, text, player_entity, obj_entities, object_index=-1):
 
         _, entity_name = tuple(turn.split("->"))
         action = text
 
         if object_index < 0:
-            entity_name = entity_name.strip()
-            fitting_objs = [
-                obj
-                for obj in obj_entities
-                if (player_entity.position).distance_to(obj.position) < 4
-            ]
-            fitting_objs = [
-                obj
-                for obj in fitting_objs
-                if obj.properties.get("name", "") in entity_name.strip().lower()
-            ]
-            obj = fitting_objs[0]
+            obj = llm_logic.in_reach(player_entity, obj_entities.named_within(entity_name))
+            if obj is None:
+                return f"There is no {entity_name.strip()} here.", -1
             obj_index = obj_entities.index(obj)
 
         else:
             obj = obj_entities[object_index]
             obj_index = object_index
 
-        obj_properties = get_entity_description(obj, include_inventory=True, exclude_properties=None, exclude_invisible_properties=False)
-
-        prompt = (
-            dp.interaction_update_all_properties_prompt.replace("$ACTOR", actor_desc)
-            .replace("$ENTITY", obj_properties)
-            .replace("$ACTION", action)
+        template = dp.templates["interaction_update_all_properties_prompt"]
+        prompt = get_prompt_builder().build(
+            "do_updates",
+            template,
+            fixed={"ACTION": action},
+            sections={
+                "ACTOR": EntitySection([player_entity], include_inventory=True, exclude_invisible_properties=False),
+                "ENTITY": EntitySection([obj], include_inventory=True, exclude_invisible_properties=False),
+            },
+            query=action,
         )
 
         return prompt, obj_index
@@ -248,28 +555,76 @@ class llm_logic:
     def inventory_trade_command(turn, text, player_entity, obj_entities):
         # _, obj_named, _ = turn.split("->")
         _, obj_named = turn.split("->")
-        
-        actor_desc = get_entity_description(player_entity, include_inventory=True, exclude_properties=None, exclude_invisible_properties=False)
 
         action = text
         obj_index = -1
-        fitting_objs = [
-            obj
-            for obj in obj_entities
-            if obj_named.strip().lower() in obj.properties.get("name", "")
-        ]
+        fitting_objs = obj_entities.named_within(obj_named)
 
         obj = None
-        obj_properties = ""
         if len(fitting_objs) > 0:
-            obj = fitting_objs[0]
+            # "inn sign" also names "sign"; trade with the most specific match.
+            obj = max(fitting_objs, key=lambda obj: len(obj.properties.get("name", "")))
             obj_index = obj_entities.index(obj)
-            
-            obj_properties = get_entity_description(obj, include_inventory=True, exclude_properties=None, exclude_invisible_properties=False)
 
-        prompt = dp.trade_validation.replace("$ENTITY_DESCRIPTION", obj_properties).replace("$ACTION_DESCRIPTION", action).replace("$ACTOR_DESCRIPTION", actor_desc)
+        template = dp.templates["trade_validation"]
+        prompt = get_prompt_builder().build(
+            "trade",
+            template,
+            fixed={"ACTION_DESCRIPTION": action},
+            sections={
+                "ACTOR_DESCRIPTION": EntitySection([player_entity], include_inventory=True, exclude_invisible_properties=False),
+                "ENTITY_DESCRIPTION": EntitySection([obj] if obj is not None else [], include_inventory=True, exclude_invisible_properties=False),
+            },
+            query=action,
+        )
         
         return prompt, obj, obj_index
 
+def description_key(obj):
+    """description_cache key: a hash of everything the player can see of obj."""
+    return DescriptionCache.make_key(
+        get_entity_description(obj, include_inventory=False, exclude_properties=None, exclude_invisible_properties=True)
+    )
+
+
 def string_gen(asting):
-    yield asting
\ No newline at end of file
+    yield asting
+
+
+def parse_action_resolution(text_output):
+    """
+    Parses the JSON object produced for ACTION_RESOLUTION_SCHEMA.
+
+    Returns:
+        dict | None: {"verdict", "narration", "updates"} or None if the text isn't a valid resolution
+    """
+    try:
+        resolution = json.loads(text_output or "")
+    except json.JSONDecodeError:
+        return None
+
+    if not isinstance(resolution, dict) or resolution.get("verdict") not in ("success", "fail"):
+        return None
+
+    updates = resolution.get("updates") or []
+    if not isinstance(updates, list):
+        return None
+
+    return {
+        "verdict": resolution["verdict"],
+        "narration": str(resolution.get("narration", "")).strip(),
+        "updates": [u for u in updates if isinstance(u, dict) and "property" in u and "value" in u],
+    }
+
+
+def resolution_updates(resolution, entity_name):
+    """
+    Property updates of a parsed resolution, in the same shape as utils.extract_property_info.
+    A failed action changes nothing.
+    """
+    if resolution is None or resolution["verdict"] != "success":
+        return []
+    return [
+        {"entity_name": entity_name, "property_name": update["property"], "value": parse_property_value(str(update["value"]))}
+        for update in resolution["updates"]
+    ]
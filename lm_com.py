@@ -1,6 +1,18 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import os
+import re
 import sys
+import threading
+import time
+
+from llm_cache import DEFAULT_CACHE_PATH, ResponseCache
+from prefill_meter import get_prefill_meter
+from profiler import get_profiler
+from prompt_builder import estimate_tokens
+from single_flight import SingleFlight
 
 # MODEL = "qwen3:14b"
 # MODEL = "qwen2.5:14b"
@@ -9,14 +21,420 @@ import sys
 # MODEL = "hf.co/LatitudeGames/Wayfarer-Large-70B-Llama-3.3-GGUF:IQ1_S"
 MODEL = "phi4:14b-q8_0"
 
-def generate_text_stream(prompt, model=MODEL, options={"temperature": 0}):
+OLLAMA_URL = "http://localhost:11434"
+
+# How long the server keeps the model (and the evaluated system prompt) loaded between calls.
+KEEP_ALIVE = os.environ.get("LLM_KEEP_ALIVE", "30m")
+
+# Timing / token count fields of Ollama's final response line, copied into the stats dict of stream().
+STAT_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+
+
+class LLMBackend:
+    """
+    Interface shared by every model backend.
+
+    A backend owns its connection state and default model. Subclasses implement
+    stream(); generate() is derived from it.
+    """
+
+    name = "base"
+
+    def __init__(self, model=MODEL):
+        self.model = model
+
+    def stream(self, prompt, model=None, options=None, format=None, system=None, keep_alive=None, stats=None):
+        """
+        Generate text for prompt.
+
+        Args:
+            prompt (str): The input prompt for text generation
+            model (str, optional): Overrides the backend's default model
+            options (dict, optional): Sampling options (Ollama naming, e.g. temperature, num_predict)
+            format (dict, optional): JSON schema the output is constrained to
+            system (str, optional): Static system prompt, sent ahead of prompt so its evaluation can be reused
+            keep_alive (str, optional): How long the server should keep the model loaded afterwards
+            stats (dict, optional): Filled with the server's timing and token counts (STAT_FIELDS) when available
+
+        Yields:
+            str: Each token or chunk of the generated text response.
+        """
+        raise NotImplementedError
+
+    def generate(self, prompt, model=None, options=None, format=None, system=None, keep_alive=None, stats=None):
+        """Collects stream() into a single stripped string."""
+        return "".join(
+            self.stream(prompt, model=model, options=options, format=format, system=system, keep_alive=keep_alive, stats=stats)
+        ).strip()
+
+    def warm(self, prompt, model=None, keep_alive=None, system=None):
+        """
+        Have the server load the model and evaluate prompt without producing a real answer,
+        so a later request starting with the same text only pays for its new suffix.
+        Backends without prefix caching ignore this.
+        """
+
+    def close(self):
+        pass
+
+
+class HTTPBackend(LLMBackend):
+    """
+    Base class for backends talking to a model server over HTTP.
+
+    Keeps one pooled keep-alive session for the lifetime of the backend, so
+    consecutive turns reuse the TCP connection instead of reconnecting.
+    """
+
+    def __init__(self, base_url, model=MODEL, timeout=(3.05, 300), retries=2, pool_size=4, headers=None):
+        """
+        Args:
+            base_url (str): Server root, e.g. "http://localhost:11434"
+            model (str): Default model name
+            timeout (float | tuple): requests timeout, (connect, read) in seconds
+            retries (int): Retries on connection errors and 502/503/504 responses
+            pool_size (int): Maximum pooled connections kept alive to the server
+            headers (dict, optional): Extra headers sent with every request
+        """
+        super().__init__(model)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def post_lines(self, path, payload):
+        """POST payload as JSON and yield the non-empty lines of the streamed response."""
+        with self.session.post(f"{self.base_url}{path}", json=payload, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield line
+
+    def close(self):
+        self.session.close()
+
+
+class OllamaBackend(HTTPBackend):
     """
-    Send a request to the Ollama API to generate text using the specified model.
+    Ollama's native API (NDJSON streaming). Prompts with a system section go to /api/chat as a
+    system + user message pair, plain prompts to /api/generate.
+    """
+
+    name = "ollama"
+
+    def __init__(self, base_url=OLLAMA_URL, model=MODEL, **kwargs):
+        super().__init__(base_url, model, **kwargs)
+
+    def request(self, prompt, model=None, system=None, keep_alive=None):
+        """Returns (path, payload) for prompt."""
+        if system is None:
+            path, payload = "/api/generate", {"model": model or self.model, "prompt": prompt}
+        else:
+            path, payload = "/api/chat", {
+                "model": model or self.model,
+                "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+            }
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        return path, payload
+
+    def stream(self, prompt, model=None, options=None, format=None, system=None, keep_alive=None, stats=None):
+        path, payload = self.request(prompt, model, system, keep_alive)
+        if options:
+            payload["options"] = options
+        if format:
+            payload["format"] = format
+
+        for line in self.post_lines(path, payload):
+            json_response = json.loads(line)
+            if "response" in json_response:
+                yield json_response["response"]
+            elif "message" in json_response:
+                yield json_response["message"].get("content", "")
+
+            # Stop yielding if this is the last message
+            if json_response.get("done", False):
+                if stats is not None:
+                    stats.update({k: json_response[k] for k in STAT_FIELDS if k in json_response})
+                break
+
+    def warm(self, prompt, model=None, keep_alive=None, system=None):
+        # Ollama keeps the evaluated prompt in the slot's KV cache and reuses the longest
+        # matching prefix for the next request, so one generated token is enough.
+        path, payload = self.request(prompt, model, system, keep_alive)
+        payload.update({"stream": False, "options": {"num_predict": 1, "temperature": 0}})
+        self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout).raise_for_status()
+
+
+class OpenAICompatibleBackend(HTTPBackend):
+    """
+    Any server exposing the OpenAI /v1/completions endpoint (vLLM, llama.cpp server, LM Studio...).
+    Ollama-style option names are translated to their OpenAI equivalents.
+    """
+
+    name = "openai"
+
+    OPTION_NAMES = {
+        "temperature": "temperature",
+        "top_p": "top_p",
+        "num_predict": "max_tokens",
+        "stop": "stop",
+        "seed": "seed",
+        "presence_penalty": "presence_penalty",
+        "frequency_penalty": "frequency_penalty",
+    }
+
+    def __init__(self, base_url="http://localhost:8000/v1", model=MODEL, api_key=None, **kwargs):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+        super().__init__(base_url, model, headers=headers, **kwargs)
+
+    def stream(self, prompt, model=None, options=None, format=None, system=None, keep_alive=None, stats=None):
+        # The system section goes first in the raw prompt; "cache_prompt" lets llama.cpp's server reuse it.
+        if system is not None:
+            prompt = f"{system}\n\n{prompt}"
+        payload = {"model": model or self.model, "prompt": prompt, "stream": True, "cache_prompt": True}
+        for key, value in (options or {}).items():
+            if key in self.OPTION_NAMES:
+                payload[self.OPTION_NAMES[key]] = value
+        if format:
+            payload["response_format"] = {"type": "json_schema", "json_schema": {"name": "response", "schema": format}}
+
+        for line in self.post_lines("/completions", payload):
+            line = line.decode("utf-8") if isinstance(line, bytes) else line
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            json_response = json.loads(data)
+            choices = json_response.get("choices", [])
+            if choices and choices[0].get("text"):
+                yield choices[0]["text"]
+            # llama.cpp's server reports how many prompt tokens it actually evaluated.
+            if stats is not None and "timings" in json_response:
+                stats["prompt_eval_count"] = json_response["timings"].get("prompt_n")
+
+    def warm(self, prompt, model=None, keep_alive=None, system=None):
+        # "cache_prompt" is understood by llama.cpp's server and ignored elsewhere.
+        if system is not None:
+            prompt = f"{system}\n\n{prompt}"
+        payload = {"model": model or self.model, "prompt": prompt, "max_tokens": 1, "cache_prompt": True}
+        self.session.post(f"{self.base_url}/completions", json=payload, timeout=self.timeout).raise_for_status()
+
+
+class FakeBackend(LLMBackend):
+    """
+    In-process backend returning canned text, for running the game and tests without a model server.
+
+    Responses are picked by the first pattern (regular expression) found in the system section
+    or prompt; every handled prompt is recorded in self.calls. The server's prefix cache is
+    imitated too: stats report as evaluated only the tokens after the part shared with the
+    previous request.
+    """
+
+    name = "fake"
+
+    def __init__(self, responses=None, default="success()", model="fake", chunk_size=4):
+        """
+        Args:
+            responses (list, optional): (pattern, text) pairs, checked in order
+            default (str): Text returned when no pattern matches
+            chunk_size (int): Characters per yielded chunk, to mimic token streaming
+        """
+        super().__init__(model)
+        self.responses = list(responses or [])
+        self.default = default
+        self.chunk_size = chunk_size
+        self.calls = []
+        self.context = ""  # last evaluated system section + prompt
+
+    def respond(self, prompt):
+        for pattern, text in self.responses:
+            if re.search(pattern, prompt):
+                return text
+        return self.default
+
+    def evaluate(self, prompt, system=None):
+        """Returns the estimated number of tokens a prefix-caching server would evaluate."""
+        context = prompt if system is None else f"{system}\n\n{prompt}"
+        shared = len(os.path.commonprefix([self.context, context]))
+        self.context = context
+        return estimate_tokens(context[shared:])
+
+    def stream(self, prompt, model=None, options=None, format=None, system=None, keep_alive=None, stats=None):
+        self.calls.append({
+            "model": model or self.model, "prompt": prompt, "options": options, "format": format,
+            "system": system, "keep_alive": keep_alive,
+        })
+        evaluated = self.evaluate(prompt, system)
+        if stats is not None:
+            stats["prompt_eval_count"] = evaluated
+        text = self.respond(prompt if system is None else f"{system}\n\n{prompt}")
+        for i in range(0, len(text), self.chunk_size):
+            yield text[i:i + self.chunk_size]
+
+    def warm(self, prompt, model=None, keep_alive=None, system=None):
+        self.evaluate(prompt, system)
+        self.calls.append({"model": model or self.model, "prompt": prompt, "warm": True, "keep_alive": keep_alive, "system": system})
+
+
+BACKENDS = {
+    OllamaBackend.name: OllamaBackend,
+    OpenAICompatibleBackend.name: OpenAICompatibleBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+_backend = None
+
+
+def create_backend(kind=None, **kwargs):
+    """
+    Build a backend by name ("ollama", "openai" or "fake").
+    Defaults come from the LLM_BACKEND, LLM_BASE_URL and LLM_MODEL environment variables.
+    """
+    kind = kind or os.environ.get("LLM_BACKEND", OllamaBackend.name)
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend {kind!r}, expected one of {sorted(BACKENDS)}")
+
+    if kind != FakeBackend.name:
+        if "base_url" not in kwargs and os.environ.get("LLM_BASE_URL"):
+            kwargs["base_url"] = os.environ["LLM_BASE_URL"]
+        kwargs.setdefault("model", os.environ.get("LLM_MODEL", MODEL))
+
+    return BACKENDS[kind](**kwargs)
+
+
+def get_backend():
+    """Returns the active backend, creating the default one on first use."""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """Replaces the active backend (closing the previous one) and returns it."""
+    global _backend
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
+    return backend
+
+
+_cache = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the response cache, or None when caching is disabled.
+    The on-disk location comes from the LLM_CACHE environment variable ("off" disables it).
+    """
+    global _cache, _cache_configured
+    with _cache_lock:
+        if not _cache_configured:
+            path = os.environ.get("LLM_CACHE", DEFAULT_CACHE_PATH)
+            _cache = None if path.lower() in ("", "0", "off") else ResponseCache(path)
+            _cache_configured = True
+        return _cache
+
+
+def set_cache(cache):
+    """Replaces the response cache; pass None to disable caching."""
+    global _cache, _cache_configured
+    with _cache_lock:
+        _cache = cache
+        _cache_configured = True
+    return cache
+
+
+def request_key(prompt, model=None, options=None, format=None, system=None):
+    """Hash of everything sent to the backend for a request."""
+    backend = get_backend()
+    options = dict(options or {})
+    if format:
+        options["format"] = format
+    if system is not None:
+        options["system"] = system
+    return ResponseCache.make_key(f"{backend.name}:{model or backend.model}", prompt, options)
+
+
+def cache_key(prompt, model=None, options=None, format=None, system=None):
+    """
+    Cache key for a request, or None if its output is not reproducible.
+    Only greedy requests (temperature 0) are cached.
+    """
+    if not options or options.get("temperature") != 0:
+        return None
+    return request_key(prompt, model, options, format, system)
+
+
+# Identical requests in flight at the same time share one generation.
+in_flight = SingleFlight()
+
+
+def _generate(prompt, model, options, format, system, template_name, key, cache):
+    """The backend call behind a (possibly shared) request; records prefill stats and timings and caches the answer once."""
+    meter = get_prefill_meter()
+    profiler = get_profiler()
+    stats = {} if meter or profiler.enabled else None
+    chunks = []
+    started, first_chunk = time.perf_counter_ns(), None
+    try:
+        for chunk in get_backend().stream(
+            prompt, model=model, options=options, format=format, system=system, keep_alive=KEEP_ALIVE, stats=stats
+        ):
+            if first_chunk is None:
+                first_chunk = time.perf_counter_ns()
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        # Abandoned and failed calls are recorded too; their stats are whatever arrived.
+        profiler.record_call(template_name, started, first_chunk, time.perf_counter_ns(), stats)
+
+    if meter:
+        meter.record(template_name, prompt, system, stats)
+    if cache and chunks:
+        cache.put(key, "".join(chunks))
+
+
+def shared_stream(prompt, model=None, options=None, format=None, system=None, template_name=None):
+    """
+    A tee of the generation for this request: a new one, or the identical request already
+    in flight. Raises the backend's errors.
+    """
+    key = cache_key(prompt, model, options, format, system)
+    cache = get_cache() if key else None
+    return in_flight.stream(
+        request_key(prompt, model, options, format, system),
+        lambda: _generate(prompt, model, options, format, system, template_name, key, cache),
+    )
+
+
+def generate_text_stream(prompt, model=None, options={"temperature": 0}, format=None, system=None, template_name=None):
+    """
+    Generate text with the active backend.
     Returns a generator that yields each token/chunk of the response.
 
     Args:
-        prompt (str): The input prompt for text generation
-        model (str): The model to use (default: "qwen2.5")
+        prompt (str): The input prompt for text generation (the variable part)
+        model (str): The model to use (default: the backend's model)
+        format (dict, optional): JSON schema constraining the output
+        system (str, optional): Static system section of the prompt
+        template_name (str, optional): Which prompt template this is, for the prefill measurements
 
     Yields:
         str: Each token or chunk of the generated text response.
@@ -25,77 +443,67 @@ def generate_text_stream(prompt, model=MODEL, options={"temperature": 0}):
         Presence penalty prevents: "Cats are mammals. Cats have fur. Cats make good pets."
         Frequency penalty prevents: "I really like this. I really enjoy that. I really appreciate those."
     """
-    url = "http://localhost:11434/api/generate"
-
-    # Prepare the request payload
-    payload = {
-        "model": model, 
-        "prompt": prompt,
-    }
-
-    if options:
-        payload["options"] = options
+    key = cache_key(prompt, model, options, format, system)
+    cache = get_cache() if key else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
 
+    stream = shared_stream(prompt, model, options, format, system, template_name)
     try:
-        # Send POST request with stream=True to get response chunks
-        with requests.post(url, json=payload, stream=True) as response:
-            response.raise_for_status()
-
-            for line in response.iter_lines():
-                if line:
-                    json_response = json.loads(line)
-                    if "response" in json_response:
-                        chunk = json_response["response"]
-                        yield chunk
-
-                    # Stop yielding if this is the last message
-                    if json_response.get("done", False):
-                        break
+        yield from stream
     except requests.exceptions.RequestException as e:
         print(f"Error making request: {e}", file=sys.stderr)
         return
+    finally:
+        # Stops this caller's tee; the request itself is dropped once nobody reads it.
+        stream.close()
 
 
-def generate_text_non_streaming(prompt, model=MODEL, options={}):
+def generate_text_non_streaming(prompt, model=None, options={"temperature": 0}, format=None, system=None, template_name=None):
     """
-    Send a request to the Ollama API to generate text using the specified model.
+    Generate text with the active backend.
     Collects the entire response and returns it as a single string.
 
     Args:
-        prompt (str): The input prompt for text generation
-        model (str): The model to use (default: "qwen2.5")
+        prompt (str): The input prompt for text generation (the variable part)
+        model (str): The model to use (default: the backend's model)
+        format (dict, optional): JSON schema constraining the output
+        system (str, optional): Static system section of the prompt
+        template_name (str, optional): Which prompt template this is, for the prefill measurements
 
     Returns:
         str: The full generated text response.
     """
-    url = "http://localhost:11434/api/generate"
+    key = cache_key(prompt, model, options, format, system)
+    cache = get_cache() if key else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.strip()
+
+    try:
+        return "".join(shared_stream(prompt, model, options, format, system, template_name)).strip()
+    except requests.exceptions.RequestException as e:
+        print(f"Error making request: {e}", file=sys.stderr)
+        return None
 
-    # Prepare the request payload
-    payload = {"model": model, "prompt": prompt}
 
-    if options:
-        payload["options"] = options
+def warm_prompt(prompt, model=None, keep_alive=None, system=None):
+    """
+    Pre-evaluate prompt on the active backend (see LLMBackend.warm).
 
+    Returns:
+        bool: False if the request failed
+    """
     try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-
-        # Collect the entire response as JSON
-        full_response = ""
-        for line in response.iter_lines():
-            if line:
-                json_response = json.loads(line)
-                if "response" in json_response:
-                    full_response += json_response["response"]
-
-                # Stop processing if this is the last message
-                if json_response.get("done", False):
-                    break
-
-        return full_response.strip()
+        get_backend().warm(prompt, model=model, keep_alive=keep_alive or KEEP_ALIVE, system=system)
+        return True
     except requests.exceptions.RequestException as e:
         print(f"Error making request: {e}", file=sys.stderr)
-        return None
+        return False
 
 
 if __name__ == "__main__":
@@ -109,4 +517,4 @@ if __name__ == "__main__":
             print("done")
             break
 
-    print("done stream")
\ No newline at end of file
+    print("done stream")
@@ -1,6 +1,9 @@
+import argparse
 import logging
+import os
 import sys
 import re
+import time
 import pygame
 from pygame.locals import (
     QUIT,
@@ -13,16 +16,29 @@ from pygame.locals import (
     K_BACKSPACE,
     K_UP,
     K_DOWN,
+    K_F3,
 )
 import pytmx
 from pytmx import TiledObjectGroup, load_pygame
 
 # External modules from your project
-from lm_com import generate_text_non_streaming
+from chat_history import ChatHistory, ChatView
 from render import Render
+from scripted_input import InputRecorder, ScriptedInput, use_dummy_drivers
 from entities import MovableEntity
-from llm_logic import llm_logic
-from utils import extract_property_info, extract_tags, get_best_match, remove_scratchpad
+from entity_registry import EntityRegistry
+from llm_dispatch import NPC_PRIORITY, PARALLEL_SLOTS, PLAYER_PRIORITY, LLMDispatcher
+from llm_logic import llm_logic, resolution_updates, string_gen
+from lm_com import get_cache
+from npc_scheduler import NPCScheduler
+from prefill_meter import PrefillMeter, get_prefill_meter, set_prefill_meter
+from profiler import Profiler, get_profiler, set_profiler
+from spatial_index import SpatialHash
+from prefetch import DescriptionPrefetcher
+from speculation import SpeculativeEngine
+from stream_reader import StreamReader
+from tile_atlas import TileAtlas
+from utils import get_best_match
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -42,11 +58,12 @@ class TextBox:
     def __init__(self):
         self.text = ""
         self.active = False
-        self.history = []
-        self.text_generator = None
+        self.history = ChatHistory()
+        self.history_view = ChatView(self.history)
+        self.stream_reader = None
+        self.stream_budget = 0.002  # seconds per frame spent appending streamed text
         self.turn = "player"
-        self.cursor_pos = 0
-        self.window_size = 10
+        self.cursor_pos = 0  # lines scrolled up from the newest one
 
     def toggle(self):
         self.active = not self.active
@@ -56,6 +73,18 @@ class TextBox:
         self.text = ""
         self.turn = "player" if self.turn == "system" else "system"
 
+    def add_message(self, speaker, text):
+        """Adds a line to the history without touching the turn being typed or streamed."""
+        self.history.append({"speaker": speaker, "text": text})
+
+    def recent_messages(self, count=6, max_length=300):
+        """The last count history lines as "speaker: text", oldest first."""
+        start = max(0, len(self.history) - count)
+        return [
+            f"{message['speaker']}: {message['text'][:max_length]}"
+            for message in (self.history[i] for i in range(start, len(self.history)))
+        ]
+
     def write_text(self, key):
         self.text += key
 
@@ -63,23 +92,56 @@ class TextBox:
         if self.text:
             self.text = self.text[:-1]
 
+    @property
+    def streaming(self):
+        return self.stream_reader is not None
+
+    def start_stream(self, text_generator):
+        """Starts printing a generator's output; it is consumed on a background thread."""
+        self.stream_reader = StreamReader(text_generator)
+
     def update(self):
-        if self.text_generator:
-            try:
-                next_text = next(self.text_generator)
-                self.write_text(next_text)
-            except StopIteration:
-                self.text_generator = None
+        if self.stream_reader:
+            self.write_text(self.stream_reader.drain(self.stream_budget))
+            if self.stream_reader.done:
+                if self.stream_reader.error:
+                    logger.error(f"Text stream failed: {self.stream_reader.error!r}")
+                self.stream_reader = None
                 self.update_text()
 
+    def tail_message(self):
+        """The line being typed or streamed, shown after the history."""
+        return {"speaker": self.turn, "text": f"{self.text}_"}
+
     def move_cursor(self, direction):
-        self.cursor_pos -= direction
-        self.cursor_pos = max(0, min(self.cursor_pos, len(self.history)))
+        tail_lines = len(self.history_view.message_lines(self.tail_message()))
+        self.cursor_pos += direction
+        self.cursor_pos = max(0, min(self.cursor_pos, self.history_view.max_scroll(tail_lines)))
+
+    def get_lines_to_display(self, max_lines):
+        """The wrapped history lines that fit in max_lines, followed by the line being typed."""
+        return self.history_view.lines(self.cursor_pos, max_lines, self.tail_message())
+
+
+class ProfilerOverlay:
+    """The profiler's frame and LLM timings over the map (F3); the text is refreshed a few times per second."""
+    def __init__(self, profiler, refresh_interval=0.5):
+        self.profiler = profiler
+        self.refresh_interval = refresh_interval
+        self.active = False
+        self.lines = []
+        self.last_refresh = None
 
-    def get_history_to_display(self):
-        start = self.cursor_pos
-        end = start + self.window_size
-        return self.history[start:end]
+    def toggle(self):
+        self.active = not self.active
+        self.last_refresh = None
+
+    def get_lines(self):
+        now = time.monotonic()
+        if self.last_refresh is None or now - self.last_refresh >= self.refresh_interval:
+            self.lines = self.profiler.overlay_lines()
+            self.last_refresh = now
+        return self.lines
 
 
 class OptionBox:
@@ -124,39 +186,47 @@ class InputSystem:
         self.game = game
 
     def find_closest_entity(self, mouse_grid_pos, entities):
-        mouse_vector = pygame.math.Vector2(mouse_grid_pos)
-        for entity in entities:
-            # Assumes an entity is "clicked" if its grid position matches exactly.
-            if mouse_vector.distance_to(round(entity.position)) == 0:
-                logger.debug(f"Entity found: {entity.properties.get('name', 'Unknown')} at {entity.position}")
-                return entity
-        return None
+        # Assumes an entity is "clicked" if its grid position matches exactly.
+        found = entities.at_cell((int(mouse_grid_pos[0]), int(mouse_grid_pos[1])))
+        if not found:
+            return None
+        entity = found[0]
+        logger.debug(f"Entity found: {entity.properties.get('name', 'Unknown')} at {entity.position}")
+        return entity
+
+    def screen_to_grid(self, pos):
+        """Converts a mouse position in screen pixels to map grid coordinates."""
+        mouse_x, mouse_y = self.game.render.camera.screen_to_world(pos)
+        scale = self.game.scale
+        return ((mouse_x // scale) // TILE_SIZE, (mouse_y // scale) // TILE_SIZE)
 
     def is_point_inside(self, x, y, rect_x, rect_y, rect_w, rect_h):
         return rect_x <= x <= rect_x + rect_w and rect_y <= y <= rect_y + rect_h
 
-    def process_events(self):
+    def process_events(self, events):
         """Process all events, including UI events; returns False if a QUIT event is received."""
-        for event in pygame.event.get():
+        for event in events:
             if event.type == QUIT:
                 return False
 
             # --- MOUSE EVENTS ---
-            if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.type == pygame.MOUSEMOTION:
+                if self.game.speculation.enabled:
+                    hovered_entity = self.find_closest_entity(self.screen_to_grid(event.pos), self.game.interactable_entities)
+                    self.game.speculation.on_hover(hovered_entity, self.game.interactable_entities)
+
+            elif event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_x, mouse_y = event.pos
                 scale = self.game.scale
-                adjusted_x = mouse_x // scale
-                adjusted_y = mouse_y // scale
-                grid_x = adjusted_x // TILE_SIZE
-                grid_y = adjusted_y // TILE_SIZE
 
-                clicked_entity = self.find_closest_entity((grid_x, grid_y), self.game.interactable_entities)
+                clicked_entity = self.find_closest_entity(self.screen_to_grid(event.pos), self.game.interactable_entities)
 
                 if event.button == 1:  # Left-click
                         if self.game.text_box.turn.startswith("interact ->") and clicked_entity:
                             self.game.text_box.turn = f"trade -> {clicked_entity.properties.get('name', '')}"
                         elif clicked_entity:
                             self.game.text_box.turn = f"interact -> {clicked_entity.properties.get('name', '')}"
+                            self.game.speculation.on_target_selected(self.game.text_box.turn, self.game.player, self.game.interactable_entities)
                         else:
                             self.game.text_box.turn = "player"
                         
@@ -188,86 +258,24 @@ class InputSystem:
             elif event.type == pygame.KEYDOWN:
                 if event.key == K_TAB:
                     self.game.text_box.toggle()
+                elif event.key == K_F3:
+                    self.game.toggle_profiler_overlay()
                 elif event.key == K_RETURN and self.game.text_box.active:
+                    if self.game.awaiting_llm or self.game.text_box.streaming:
+                        continue  # The game master is still answering the previous turn.
 
-                    # Parse the player's input using llm_logic.
-                    llm_output = llm_logic.parse_player_input(
-                        self.game.text_box.turn, self.game.text_box.text, self.game.player, self.game.interactable_entities
+                    # Resolve the player's input on the LLM worker; the result is applied in apply_llm_output.
+                    turn, text = self.game.text_box.turn, self.game.text_box.text
+                    self.game.text_box.update_text()
+                    self.game.npc_scheduler.invalidate()
+                    self.game.llm_dispatcher.submit(
+                        llm_logic.resolve_player_input,
+                        turn, text, self.game.player, self.game.interactable_entities,
+                        on_done=lambda llm_output, turn=turn, text=text: self.apply_llm_output(llm_output, turn, text),
+                        on_error=self.report_llm_error,
                     )
-                    if llm_output["type"] == "interact":
-                        target_details = llm_output["target"]
-                        match = re.search(r'new_property_value\("([^"]*)"\)', llm_output["text"])
-                        if match:
-                            interaction_result = match.group(1)
-                            entity_index = target_details["entity_index"]
-                            property_name = target_details["property"].strip()
-                            self.game.interactable_entities[entity_index].properties[property_name] = interaction_result
-                    elif llm_output["type"] == "trade":
-                        # Process trade logic (if any)
-                        trade_result = llm_output["target"]["property"]
-                        if len(trade_result) == 2:
-                            traded, recived = trade_result
-                            print("%%%%", traded, recived)
-                            
-                            entity_to_trade = None
-                            entity_to_recive = None
-                            
-                            inv_items = list(self.game.player.inventory)
-                            possible_matches = [anentity.properties.get("name") for anentity in inv_items]
-                            best_match, best_score = get_best_match(traded, possible_matches)
-                            best_match_index = possible_matches.index(best_match)
-                            entity_to_trade = inv_items[best_match_index]
-
-                            trader_index = llm_output["target"]["entity_index"]
-
-                            inv_items = list(self.game.interactable_entities[trader_index].inventory)
-                            possible_matches = [anentity.properties.get("name") for anentity in self.game.interactable_entities[llm_output["target"]["entity_index"]].inventory]
-                            best_match, best_score = get_best_match(recived, possible_matches)
-                            best_match_index = possible_matches.index(best_match)
-                            entity_to_recive = inv_items[best_match_index]
-
-                            if entity_to_trade and entity_to_recive:
-                                self.game.player.inventory.remove(entity_to_trade)
-                                self.game.interactable_entities[trader_index].inventory.add(entity_to_trade)
-                                self.game.player.inventory.add(entity_to_recive)
-                                self.game.interactable_entities[trader_index].inventory.remove(entity_to_recive)
-                        
-                    elif llm_output["type"] == "pickup":
-                        text_output = llm_output["text"]
-                        text_output = remove_scratchpad(text_output)
-                        if "success" in text_output and "fail" not in text_output:
-                            entity_index = llm_output["target"]["entity_index"]
-                            self.game.player.inventory.add(self.game.interactable_entities[entity_index])
-                            # Mark the entity as picked up.
-                            self.game.interactable_entities[entity_index].render_image = False
-
-                    elif llm_output["type"] == "do":
-                        text_output = llm_output["text"]
-                        text_output = remove_scratchpad(text_output)
-                        if "success" in text_output and "fail" not in text_output:
-                            text_output = llm_output["text"]
-                            object_index = llm_output["target"]["entity_index"]
-                            prompt, _ = llm_logic.do_interact_all_command(self.game.text_box.turn, self.game.text_box.text, self.game.player, self.game.interactable_entities, object_index)                            
-                            print(prompt)
-                            text_output = generate_text_non_streaming(prompt)
-                            print(f"{text_output=}")
-                            out = extract_property_info(text_output)
-                            for o in out:
-                                print(f"{o['entity_name']=}")
-                                print(f"{o['property_name']=}")
-                                print(f"{o['value']=}")
-                                print()
-                                
-                                if self.game.interactable_entities[object_index].properties.get(o['property_name'], None) is not None:
-                                    self.game.interactable_entities[object_index].properties[o['property_name']] = o['value']
 
-                        else:
-                            pass
-                    
-                    self.game.text_box.update_text()
-                    self.game.text_box.text_generator = llm_output["output"]
-                    
-                elif self.game.text_box.active:
+                elif self.game.text_box.active and not self.game.awaiting_llm:
                     if event.key == K_BACKSPACE:
                         self.game.text_box.backspace_text()
                     elif event.key == K_UP:
@@ -279,16 +287,120 @@ class InputSystem:
 
         return True
 
+    def apply_llm_output(self, llm_output, turn, text):
+        """
+        Starts printing the game master's answer and hooks the turn's effects to the stream
+        parser, so they are applied as soon as the verdict / trade call appears in the stream.
+        The parser runs on the text box's reader thread, so its callbacks are posted back to
+        the main thread through the dispatcher.
+        """
+        parser = llm_output.get("parser")
+        target = llm_output["target"]
+        post = self.game.llm_dispatcher.post
+
+        if llm_output["type"] == "interact":
+            target_details = llm_output["target"]
+            match = re.search(r'new_property_value\("([^"]*)"\)', llm_output["text"])
+            if match:
+                interaction_result = match.group(1)
+                entity_index = target_details["entity_index"]
+                property_name = target_details["property"].strip()
+                self.game.interactable_entities[entity_index].properties[property_name] = interaction_result
+                self.game.interactable_entities.refresh(self.game.interactable_entities[entity_index])
+        elif llm_output["type"] == "trade" and parser:
+            parser.on_trade = lambda trade_result: post(self.apply_trade, target["entity_index"], trade_result)
+
+        elif llm_output["type"] == "pickup" and parser:
+            parser.on_verdict = lambda verdict: post(self.apply_pickup, target["entity_index"], verdict)
+
+        elif llm_output["type"] == "do" and parser:
+            object_index = target["entity_index"]
+            if llm_output.get("combined"):
+                parser.on_complete = lambda resolution: post(self.apply_resolution, turn, text, object_index, resolution, parser.verdict)
+            else:
+                parser.on_verdict = lambda verdict: post(self.request_property_updates, turn, text, object_index, verdict)
+
+        self.game.text_box.start_stream(llm_output["output"])
+
+    def apply_trade(self, trader_index, trade_result):
+        if len(trade_result) == 2:
+            traded, recived = trade_result
+            print("%%%%", traded, recived)
+            
+            entity_to_trade = None
+            entity_to_recive = None
+            
+            inv_items = list(self.game.player.inventory)
+            possible_matches = [anentity.properties.get("name") for anentity in inv_items]
+            best_match, best_score = get_best_match(traded, possible_matches)
+            best_match_index = possible_matches.index(best_match)
+            entity_to_trade = inv_items[best_match_index]
+
+            inv_items = list(self.game.interactable_entities[trader_index].inventory)
+            possible_matches = [anentity.properties.get("name") for anentity in self.game.interactable_entities[trader_index].inventory]
+            best_match, best_score = get_best_match(recived, possible_matches)
+            best_match_index = possible_matches.index(best_match)
+            entity_to_recive = inv_items[best_match_index]
+
+            if entity_to_trade and entity_to_recive:
+                self.game.player.inventory.remove(entity_to_trade)
+                self.game.interactable_entities[trader_index].inventory.add(entity_to_trade)
+                self.game.player.inventory.add(entity_to_recive)
+                self.game.interactable_entities[trader_index].inventory.remove(entity_to_recive)
+
+    def apply_pickup(self, entity_index, verdict):
+        if verdict == "success":
+            self.game.player.inventory.add(self.game.interactable_entities[entity_index])
+            # Mark the entity as picked up.
+            self.game.set_entity_visible(self.game.interactable_entities[entity_index], False)
+
+    def apply_resolution(self, turn, text, object_index, resolution, verdict):
+        """
+        Applies the property updates of a combined "do" resolution. If its JSON could not be
+        parsed, falls back to the two-call path with the verdict that was streamed.
+        """
+        if resolution is None:
+            self.request_property_updates(turn, text, object_index, verdict)
+            return
+        object_name = self.game.interactable_entities[object_index].properties.get("name", "")
+        self.apply_property_updates(object_index, resolution_updates(resolution, object_name))
+
+    def request_property_updates(self, turn, text, object_index, verdict):
+        """Two-call "do" resolution: on success, ask the model which properties changed."""
+        if verdict != "success":
+            return
+        self.game.llm_dispatcher.submit(
+            llm_logic.resolve_property_updates,
+            turn, text, self.game.player, self.game.interactable_entities, object_index,
+            on_done=lambda updates: self.apply_property_updates(object_index, updates),
+        )
+
+    def apply_property_updates(self, object_index, updates):
+        for o in updates:
+            print(f"{o['entity_name']=}")
+            print(f"{o['property_name']=}")
+            print(f"{o['value']=}")
+            print()
+            
+            if self.game.interactable_entities[object_index].properties.get(o['property_name'], None) is not None:
+                self.game.interactable_entities[object_index].properties[o['property_name']] = o['value']
+                self.game.interactable_entities.refresh(self.game.interactable_entities[object_index])
+
+    def report_llm_error(self, error):
+        self.game.text_box.start_stream(string_gen(f"The game master could not answer ({error})."))
+
+
 
 class MovementSystem:
     """Updates movement for all entities with a move() method."""
-    def __init__(self, entities, player):
+    def __init__(self, entities, player, key_state=pygame.key.get_pressed):
         self.entities = entities  # List of game entities (NPCs, etc.)
         self.player = player      # The player entity
+        self.key_state = key_state  # pygame.key.get_pressed, or a scripted stand-in
 
     def update(self, dt):
         """Updates the player movement based on key inputs."""
-        keys = pygame.key.get_pressed()
+        keys = self.key_state()
         direction = pygame.math.Vector2(0, 0)
 
         if keys[K_a]:
@@ -323,6 +435,7 @@ class RenderSystem:
             self.screen,
             self.ui_elements.get("text_boxes", []),
             self.ui_elements.get("option_boxes", []),
+            self.ui_elements.get("overlays", []),
         )
 
 
@@ -331,21 +444,51 @@ class RenderSystem:
 # ---------------------------------------------------------------
 
 class Game:
-    def __init__(self, tmx_map_path: str, tileset_image_path: str, scale: int = 2):
+    def __init__(self, tmx_map_path: str, tileset_image_path: str, scale: int = 2, speculative: bool = False, prefetch: bool = True, npcs: bool = False,
+                 headless: bool = False, draw: bool = True, unthrottled: bool = None, input_script: ScriptedInput = None, recorder: InputRecorder = None,
+                 profile: bool = False, trace_path: str = None):
+        """
+        Args:
+            headless (bool): Render offscreen (SDL dummy drivers), for servers and CI
+            draw (bool): Render frames at all; without it only the simulation and the LLM turns run
+            unthrottled (bool): Run frames as fast as possible instead of at render.FPS; defaults to headless
+            input_script (ScriptedInput, optional): Events (and held keys) fed to the game on top of the live ones
+            recorder (InputRecorder, optional): Saves the processed events on shutdown, to replay them later
+            profile (bool): Time every system and LLM call from the start, with the overlay shown (F3 toggles it)
+            trace_path (str, optional): Profile the whole session and save it there as a Chrome trace on shutdown
+        """
+        self.headless = headless
+        self.draw = draw
+        self.unthrottled = headless if unthrottled is None else unthrottled
+        self.input_script = input_script
+        self.recorder = recorder
+        self.frame = 0
+        self.trace_path = trace_path
+        # Records only while the overlay is shown or a trace is being taken; a trace keeps every frame.
+        if trace_path:
+            self.profiler = set_profiler(Profiler(enabled=True, max_frames=None, max_calls=None))
+        else:
+            self.profiler = get_profiler()
+            self.profiler.enabled = profile or self.profiler.enabled
+        if headless:
+            use_dummy_drivers()
         pygame.init()
         # Set a temporary display mode so that image operations (like convert_alpha) work.
         pygame.display.set_mode((1, 1))
 
         self.scale = scale
         self.tmx_data = load_pygame(tmx_map_path)
-        self.tileset_image = pygame.image.load(tileset_image_path).convert_alpha()
+        self.tileset_image_path = tileset_image_path
+
+        # Every tile converted and pre-scaled once, shared by the renderer and entity loading.
+        self.atlas = TileAtlas(self.tmx_data, TILE_SIZE, self.scale)
 
         # Initialize Render object
-        self.render = Render(self.tmx_data, self.tmx_data.width, self.tmx_data.height)
+        self.render = Render(self.tmx_data, self.tmx_data.width, self.tmx_data.height, atlas=self.atlas)
 
-        # Set up screen dimensions based on map size
-        self.screen_width = self.tmx_data.width * TILE_SIZE * self.scale
-        self.screen_height = self.tmx_data.height * TILE_SIZE * self.scale
+        # Set up screen dimensions based on the viewport (the whole map if it fits)
+        self.screen_width = self.render.SCREEN_WIDTH
+        self.screen_height = self.render.SCREEN_HEIGHT
         self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
         pygame.display.set_caption("Tile Map Game - ECS Version with UI")
 
@@ -360,7 +503,10 @@ class Game:
 
         # Load dynamic entities from metadata.
         self.logic_entities = self._load_metadata_entities()
-        self.interactable_entities = self.logic_entities + [self.player]
+        # Entity tiles were cut out of the layers above; bake the layers without them.
+        self.render.invalidate_static_layers()
+        # Indexed by id, cell and name; the ids are the entity_index / object_index of turns.
+        self.interactable_entities = EntityRegistry(self.logic_entities + [self.player])
 
         # Build sprite groups for rendering.
         self.player_group = pygame.sprite.Group(self.player.sprite)
@@ -371,20 +517,44 @@ class Game:
         self.option_box_primary = OptionBox()
         # self.option_box_secondary = OptionBox()
         # self.option_box_thirdy = OptionBox()
+        self.profiler_overlay = ProfilerOverlay(self.profiler)
+        self.profiler_overlay.active = profile
         self.ui_elements = {
             "text_boxes": [self.text_box],
             "option_boxes": [self.option_box_primary],
+            "overlays": [self.profiler_overlay],
         }
 
+        # LLM calls run on workers so rendering and movement keep going while the GM thinks.
+        # Player turns, NPC turns and background work share the model server's parallel slots, player first.
+        self.llm_dispatcher = LLMDispatcher(max_workers=PARALLEL_SLOTS)
+        # Opt-in: NPCs near the player act on their own.
+        self.npc_scheduler = NPCScheduler(
+            self.llm_dispatcher,
+            on_action=lambda npc, text: self.text_box.add_message(npc.properties.get("name", "npc"), text),
+            recent_events=self.text_box.recent_messages,
+            enabled=npcs,
+        )
+        # Opt-in: warm the model for the selected target and pre-describe hovered entities.
+        self.speculation = SpeculativeEngine(self.llm_dispatcher, enabled=speculative)
+        # Describe entities near the player while the model is idle, so "look" is answered from cache.
+        self.prefetcher = DescriptionPrefetcher(self.llm_dispatcher, enabled=prefetch)
+
         # Initialize systems.
         self.input_system = InputSystem(self)
-        self.movement_system = MovementSystem(self.logic_entities, self.player)
+        key_state = self.input_script.pressed if self.input_script else pygame.key.get_pressed
+        self.movement_system = MovementSystem(self.logic_entities, self.player, key_state)
         self.render_system = RenderSystem(self.render, self.screen, self.ui_elements)
 
-        # Initialize dynamic collision list.
-        self.update_dynamic_collisions()
+        # Initialize the collision index (maintained incrementally afterwards).
+        self._build_collision_index()
 
 
+    @property
+    def awaiting_llm(self):
+        """True while a player turn is being resolved by the LLM worker."""
+        return self.llm_dispatcher.busy_with(PLAYER_PRIORITY)
+
     # -------------------------------
     # Helper Methods
     # -------------------------------
@@ -407,63 +577,99 @@ class Game:
                     collision_rects.append(rect)
         return collision_rects
 
-    def update_dynamic_collisions(self):
+    def _build_collision_index(self):
         """
-        Recalculates the active collision rectangles by:
-          1. Filtering the static map collisions to remove any rectangle whose grid cell
-             is occupied by a dynamic entity that is picked up (render_image is False).
-          2. Adding dynamic collision rectangles for visible (render_image True) entities.
-        Then updates the player's sprite collision list.
+        Builds the player's collision index once. Afterwards it is kept up to date by
+        set_entity_visible() / spawn_entity() instead of being rebuilt every frame:
+          1. Static map collisions, except cells occupied by a picked up entity (render_image False).
+          2. One rectangle per visible (render_image True) entity.
         """
-        filtered_static = []
-        for rect in self.map_collision_rects:
-            grid_x = rect.x // TILE_SIZE
-            grid_y = rect.y // TILE_SIZE
-            remove = False
-            for entity in self.logic_entities:
-                if not entity.render_image:
-                    if int(entity.position.x) == grid_x and int(entity.position.y) == grid_y:
-                        remove = True
-                        break
-            if not remove:
-                filtered_static.append(rect)
-
-        dynamic_collisions = []
+        self.collision_index = SpatialHash(TILE_SIZE)
+        self.static_collision_rects = {}  # grid cell -> (static rect of the "collision" layer, its sequence number)
+        self.hidden_entity_cells = {}     # grid cell -> number of picked up entities on it
+
+        for entity in self.logic_entities:
+            if not entity.render_image:
+                cell = self._entity_cell(entity)
+                self.hidden_entity_cells[cell] = self.hidden_entity_cells.get(cell, 0) + 1
+
+        # Static tiles are numbered first and keep their number when re-inserted, so they
+        # always win over entity rects in first_collision(), as in the map's own order.
+        for order, rect in enumerate(self.map_collision_rects):
+            cell = (rect.x // TILE_SIZE, rect.y // TILE_SIZE)
+            self.static_collision_rects[cell] = (rect, order)
+            if cell not in self.hidden_entity_cells:
+                self.collision_index.insert(("tile",) + cell, rect, order)
+        self.collision_index.counter = max(self.collision_index.counter, len(self.map_collision_rects))
+
         for entity in self.logic_entities:
             if entity.render_image:
-                dynamic_collisions.append(
-                    pygame.Rect(
-                        int(entity.position.x) * TILE_SIZE,
-                        int(entity.position.y) * TILE_SIZE,
-                        TILE_SIZE,
-                        TILE_SIZE,
-                    )
-                )
-        self.collision_rects = filtered_static + dynamic_collisions
-        self.player.sprite.collision_rects = self.collision_rects
+                self.collision_index.insert(entity, self._entity_collision_rect(entity))
+
+        self.player.sprite.collision_index = self.collision_index
+
+    def _entity_cell(self, entity):
+        return (int(entity.position.x), int(entity.position.y))
+
+    def _entity_collision_rect(self, entity):
+        grid_x, grid_y = self._entity_cell(entity)
+        return pygame.Rect(grid_x * TILE_SIZE, grid_y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+
+    def set_entity_visible(self, entity, visible):
+        """
+        Shows or hides a map entity (pickup / drop), updating its sprite group membership
+        and the collision index in O(1).
+        """
+        if entity.render_image == visible:
+            return
+        entity.render_image = visible
+        if entity is self.player:
+            return
+        cell = self._entity_cell(entity)
+
+        if visible:
+            self.hidden_entity_cells[cell] -= 1
+            if self.hidden_entity_cells[cell] == 0:
+                del self.hidden_entity_cells[cell]
+                if cell in self.static_collision_rects:
+                    rect, order = self.static_collision_rects[cell]
+                    self.collision_index.insert(("tile",) + cell, rect, order)
+            self.collision_index.insert(entity, self._entity_collision_rect(entity))
+            if entity.sprite is not None:
+                self.entity_sprite_group.add(entity.sprite)
+        else:
+            self.hidden_entity_cells[cell] = self.hidden_entity_cells.get(cell, 0) + 1
+            self.collision_index.remove(("tile",) + cell)
+            self.collision_index.remove(entity)
+            if entity.sprite is not None:
+                self.entity_sprite_group.remove(entity.sprite)
+
+    def spawn_entity(self, entity):
+        """Adds a new entity to the world after the map has been loaded."""
+        self.logic_entities.append(entity)
+        self.interactable_entities.add(entity)
+        if entity.render_image:
+            self.collision_index.insert(entity, self._entity_collision_rect(entity))
+            if entity.sprite is not None:
+                self.entity_sprite_group.add(entity.sprite)
+        else:
+            cell = self._entity_cell(entity)
+            self.hidden_entity_cells[cell] = self.hidden_entity_cells.get(cell, 0) + 1
+            self.collision_index.remove(("tile",) + cell)
 
     def _get_tile_from_tileset(self, tile_x: int, tile_y: int):
-        """Extract and scale a single tile image from the tileset."""
-        rect = pygame.Rect(
-            tile_x * self.render.TILE_SIZE,
-            tile_y * self.render.TILE_SIZE,
-            self.render.TILE_SIZE,
-            self.render.TILE_SIZE,
-        )
-        try:
-            tile_image = self.tileset_image.subsurface(rect).copy()
-        except ValueError:
-            logger.error(f"Tile ({tile_x}, {tile_y}) is out of bounds.")
-            return None
-        tile_image = pygame.transform.scale(tile_image, (self.render.TILE_SIZE, self.render.TILE_SIZE))
-        return tile_image
+        """Returns (native, scaled) images of a single tile of the tileset, or None if out of bounds."""
+        return self.atlas.sheet_tile(self.tileset_image_path, tile_x, tile_y)
 
     def _load_player(self):
         """Loads the player entity using a specific tile from the tileset."""
-        player_image = self._get_tile_from_tileset(31, 1)
-        if player_image is None:
+        player_tile = self._get_tile_from_tileset(31, 1)
+        if player_tile is None:
             player_image = pygame.Surface((self.render.TILE_SIZE, self.render.TILE_SIZE))
             player_image.fill((255, 0, 0))
+            player_display_image = None
+        else:
+            player_image, player_display_image = player_tile
 
         player_start_x = TILE_SIZE * 2
         player_start_y = TILE_SIZE * 2
@@ -483,7 +689,7 @@ class Game:
             "stength": "average person stength, will often fail tasks that require brute force"
         }
 
-        return MovableEntity(player_image, (player_start_x, player_start_y), player_properties)
+        return MovableEntity(player_image, (player_start_x, player_start_y), player_properties, display_image=player_display_image)
 
     def _load_metadata_entities(self):
         """
@@ -507,27 +713,24 @@ class Game:
             grid_x = int(obj.x // self.render.TILE_SIZE)
             grid_y = int(obj.y // self.render.TILE_SIZE)
 
-            tile_image = None
-
-            if npc_layer and npc_layer.data[grid_y][grid_x] != 0:
-                tile_image = self.tmx_data.get_tile_image(x=grid_x, y=grid_y, layer=npc_layer.id - 1)
-                npc_layer.data[grid_y][grid_x] = 0
-            elif above_ground_layer and above_ground_layer.data[grid_y][grid_x] != 0:
-                tile_image = self.tmx_data.get_tile_image(x=grid_x, y=grid_y, layer=above_ground_layer.id - 1)
-                above_ground_layer.data[grid_y][grid_x] = 0
-            elif collision_layer and collision_layer.data[grid_y][grid_x] != 0:
-                tile_image = self.tmx_data.get_tile_image(x=grid_x, y=grid_y, layer=collision_layer.id - 1)
-                collision_layer.data[grid_y][grid_x] = 0
-            elif on_ground_layer and on_ground_layer.data[grid_y][grid_x] != 0:
-                tile_image = self.tmx_data.get_tile_image(x=grid_x, y=grid_y, layer=on_ground_layer.id - 1)
-                on_ground_layer.data[grid_y][grid_x] = 0
+            gid = 0
 
+            # The entity takes its image from the first layer with a tile in its cell; the tile
+            # is then removed from that layer so it isn't drawn twice.
+            for layer in (npc_layer, above_ground_layer, collision_layer, on_ground_layer):
+                if layer and layer.data[grid_y][grid_x] != 0:
+                    gid = layer.data[grid_y][grid_x]
+                    layer.data[grid_y][grid_x] = 0
+                    break
+
+            tile_image = self.atlas.get_native(gid)
             if tile_image:
                 properties = {**obj.properties, "name": obj.name}
                 entity = MovableEntity(
                     tile_image,
                     (grid_x * self.render.TILE_SIZE, grid_y * self.render.TILE_SIZE),
-                    properties
+                    properties,
+                    display_image=self.atlas.get(gid),
                 )
                 entities.append(entity)
         return entities
@@ -536,45 +739,114 @@ class Game:
     # -------------------------------
     # Main Game Loop
     # -------------------------------
-    def run(self):
+    def toggle_profiler_overlay(self):
+        self.profiler_overlay.toggle()
+        self.profiler.enabled = self.profiler_overlay.active or self.trace_path is not None
+
+    @property
+    def idle(self):
+        """True when no player turn is being resolved or printed and no NPC turn is queued or running."""
+        # Background jobs (prefetching, warm-ups) don't count: they are what runs while idle.
+        return not (self.llm_dispatcher.busy_with(NPC_PRIORITY) or self.text_box.streaming)
+
+    def run(self, max_frames=None, until_idle=False):
+        """
+        Runs frames until the player quits, max_frames have run or, with until_idle, the
+        input script has played out and the last turn is answered. A windowed game exits
+        the process afterwards; a headless one returns the number of frames run.
+        """
         running = True
-        while running:
+        while running and (max_frames is None or self.frame < max_frames):
+            running = self.step()
+            if until_idle and (self.input_script is None or self.input_script.finished) and self.idle:
+                break
+
+        self.shutdown()
+        pygame.quit()
+        if not self.headless:
+            sys.exit()
+        return self.frame
+
+    def step(self):
+        """Runs one frame. Returns False once the player has quit."""
+        if self.unthrottled:
+            self.clock.tick()
+            dt = 1.0 / self.render.FPS  # game time still advances at the nominal frame rate
+        else:
             dt = self.clock.tick(self.render.FPS) / 1000.0
 
-            # --- PROCESS INPUT ---
-            running = self.input_system.process_events()
-            if not running:
-                break
+        # The clock's wait for the next frame is left out of the profiled frame.
+        profiler = self.profiler
+        profiler.begin_frame()
+        try:
+            return self._step(dt, profiler)
+        finally:
+            profiler.end_frame()
+
+    def _step(self, dt, profiler):
+        # --- PROCESS INPUT ---
+        with profiler.section("input"):
+            events = pygame.event.get()
+            if self.input_script:
+                events = self.input_script.events(self.frame) + events
+            if self.recorder:
+                self.recorder.record(self.frame, events)
+            if not self.input_system.process_events(events):
+                return False
 
-            # --- UPDATE GAME STATE ---
+        # --- APPLY FINISHED LLM TURNS ---
+        with profiler.section("llm poll"):
+            self.llm_dispatcher.poll()
+
+        # --- UPDATE GAME STATE ---
+        # Collisions are checked inside the player's move, against the incrementally kept collision index.
+        with profiler.section("movement"):
             if not self.text_box.active:
                 self.movement_system.update(dt)
             self.player.update()
-        
-            for entity in self.logic_entities:
-                entity.update()
+            self.interactable_entities.refresh(self.player)
 
-            # --- UPDATE SPRITE GROUPS ---
+        with profiler.section("entities"):
             for entity in self.logic_entities:
-                if entity.render_image:
-                    if entity.sprite not in self.entity_sprite_group:
-                        self.entity_sprite_group.add(entity.sprite)
-                else:
-                    if entity.sprite in self.entity_sprite_group:
-                        self.entity_sprite_group.remove(entity.sprite)
-
-            # --- UPDATE DYNAMIC COLLISIONS ---
-            self.update_dynamic_collisions()
-
-            # --- RENDER FRAME ---
-            render_group = pygame.sprite.Group(self.player_group, self.entity_sprite_group)
-            self.render_system.render_all(render_group)
+                entity.update()
 
-            # Update the UI text box (if a text generator is active)
+        with profiler.section("scheduling"):
+            # The player's streamed answer holds a model slot; NPC calls give it up if needed.
+            self.llm_dispatcher.reserve(1 if self.text_box.streaming else 0)
+            self.npc_scheduler.update(self.player, self.interactable_entities)
+            self.prefetcher.update(self.player, self.interactable_entities, idle=self.idle)
+
+        # --- RENDER FRAME ---
+        if self.draw:
+            with profiler.section("render"):
+                self.render.camera.follow(self.player.sprite.rect)
+                render_group = pygame.sprite.Group(self.player_group, self.entity_sprite_group)
+                self.render_system.render_all(render_group)
+
+        # Update the UI text box (if a text generator is active)
+        with profiler.section("text box"):
             self.text_box.update()
+        self.frame += 1
+        return True
 
-        pygame.quit()
-        sys.exit()
+    def shutdown(self):
+        """Stops the background LLM work and releases the chat history; pygame itself is left running."""
+        if self.npc_scheduler.enabled:
+            logger.info(f"NPC scheduler: {self.npc_scheduler.stats()}")
+        self.prefetcher.shutdown()
+        self.llm_dispatcher.shutdown()
+        if get_cache():
+            get_cache().flush()
+        self.text_box.history.close()
+        if self.recorder:
+            self.recorder.save()
+        if self.trace_path:
+            self.profiler.export_chrome_trace(self.trace_path)
+            print(f"Profile saved to {self.trace_path}")
+        if self.profiler.enabled:
+            print(self.profiler.report())
+        if get_prefill_meter():
+            print(get_prefill_meter().report())
 
 
 # ---------------------------------------------------------------
@@ -582,11 +854,34 @@ class Game:
 # ---------------------------------------------------------------
 
 def main():
-    tmx_map_path = r"assets\map\demo_map.tmx"
-    # tmx_map_path = r"assets\map\level_1.tmx"
-    tileset_image_path = r"tilesets\1bit\colored-transparent_packed.png"
-    game = Game(tmx_map_path, tileset_image_path, scale=2)
-    game.run()
+    tmx_map_path = os.path.join("assets", "map", "demo_map.tmx")
+    # tmx_map_path = os.path.join("assets", "map", "level_1.tmx")
+    tileset_image_path = os.path.join("tilesets", "1bit", "colored-transparent_packed.png")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--measure-prefill", action="store_true")
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument("--no-prefetch", action="store_true")
+    parser.add_argument("--npcs", action="store_true")
+    parser.add_argument("--headless", action="store_true", help="run without a window (SDL dummy drivers), unthrottled")
+    parser.add_argument("--no-draw", action="store_true", help="skip rendering entirely")
+    parser.add_argument("--script", help="replay the events of this JSON input script")
+    parser.add_argument("--record", help="save the events of this session as an input script")
+    parser.add_argument("--frames", type=int, help="stop after this many frames")
+    parser.add_argument("--profile", action="store_true", help="time every system and LLM call, with the overlay shown (F3)")
+    parser.add_argument("--trace", help="save the session's timings to this file as a Chrome trace")
+    args = parser.parse_args()
+
+    if args.measure_prefill:
+        set_prefill_meter(PrefillMeter())
+    game = Game(tmx_map_path, tileset_image_path, scale=2, speculative=args.speculative,
+                prefetch=not args.no_prefetch, npcs=args.npcs, headless=args.headless, draw=not args.no_draw,
+                input_script=ScriptedInput.load(args.script) if args.script else None,
+                recorder=InputRecorder(args.record) if args.record else None,
+                profile=args.profile, trace_path=args.trace)
+    # A headless replay ends once its script has played out and the last turn is answered.
+    frames = game.run(max_frames=args.frames, until_idle=args.headless and args.script is not None and args.frames is None)
+    print(f"{frames} frames")
 
 if __name__ == "__main__":
     main()
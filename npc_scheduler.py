@@ -0,0 +1,114 @@
+import logging
+import time
+
+from llm_dispatch import NPC_PRIORITY
+from llm_logic import llm_logic
+
+logger = logging.getLogger(__name__)
+
+
+def is_npc(entity):
+    """Map objects mark NPCs with an "_npc" property (a bool, or the string "true")."""
+    return str(entity.properties.get("_npc", "")).lower() in ("true", "1")
+
+
+class NPCScheduler:
+    """
+    Lets the NPCs near the player act on their own.
+
+    Every scan_interval seconds, each NPC within radius of the player whose cooldown has
+    passed gets an intent: an llm_logic.npc_turn call queued on the game's dispatcher at
+    NPC_PRIORITY, so player turns always go first and preempt NPC calls when the model
+    server has no free slot. An intent is dropped instead of run when it has waited longer
+    than max_age, when its NPC is out of range by then, or when the player took a turn since
+    it was made, as the NPC would react to a situation that no longer exists. At most
+    max_pending intents are outstanding at a time.
+    """
+
+    def __init__(self, dispatcher, on_action, recent_events, enabled=False, radius=6, cooldown=20.0,
+                 max_age=15.0, max_pending=4, scan_interval=0.5, clock=time.monotonic):
+        """
+        Args:
+            dispatcher (LLMDispatcher): The game's dispatcher, shared with player turns
+            on_action (callable): Called on the main thread with (npc, text) for every NPC turn
+            recent_events (callable): Returns the last few chat lines, passed to the NPC's prompt
+            enabled (bool): NPC turns are off unless explicitly enabled
+            radius (float): Only NPCs closer than this many tiles to the player act
+            cooldown (float): Seconds between two turns of the same NPC
+            max_age (float): Seconds an intent may wait for a slot before it is dropped
+            max_pending (int): Maximum number of queued or running NPC turns
+            scan_interval (float): Seconds between two looks for NPCs ready to act
+            clock (callable): Time source in seconds
+        """
+        self.dispatcher = dispatcher
+        self.on_action = on_action
+        self.recent_events = recent_events
+        self.enabled = enabled
+        self.radius = radius
+        self.cooldown = cooldown
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.scan_interval = scan_interval
+        self.clock = clock
+        self.pending = {}      # id(npc) -> future of its queued or running turn
+        self.last_turn = {}    # id(npc) -> time its last turn was queued
+        self.last_scan = None
+        self.epoch = 0         # bumped by every player turn
+        self.submitted = 0
+        self.completed = 0
+
+    def invalidate(self):
+        """Called when the player takes a turn; intents made before it are stale."""
+        self.epoch += 1
+
+    def update(self, player_entity, obj_entities):
+        """Called once per frame; queues turns for NPCs that are ready to act."""
+        if not self.enabled:
+            return
+
+        self.pending = {key: future for key, future in self.pending.items() if not future.done()}
+        now = self.clock()
+        if self.last_scan is not None and now - self.last_scan < self.scan_interval:
+            return
+        self.last_scan = now
+
+        for npc in obj_entities.within(player_entity.position, self.radius):
+            if len(self.pending) >= self.max_pending:
+                break
+            key = id(npc)
+            if npc is player_entity or not is_npc(npc) or key in self.pending:
+                continue
+            if now - self.last_turn.get(key, -self.cooldown) < self.cooldown:
+                continue
+
+            self.last_turn[key] = now
+            self.submitted += 1
+            logger.debug(f"Queueing a turn for {npc.properties.get('name')}")
+            self.pending[key] = self.dispatcher.submit(
+                llm_logic.npc_turn,
+                npc, player_entity, obj_entities, list(self.recent_events()),
+                priority=NPC_PRIORITY,
+                stale=self._staleness(npc, player_entity, now),
+                cancellable=True,
+                on_done=lambda text, npc=npc: self._on_done(npc, text),
+            )
+
+    def _staleness(self, npc, player_entity, created):
+        epoch = self.epoch
+
+        def stale():
+            return (
+                self.epoch != epoch
+                or self.clock() - created > self.max_age
+                or player_entity.position.distance_to(npc.position) >= self.radius
+            )
+        return stale
+
+    def _on_done(self, npc, text):
+        self.completed += 1
+        if text:
+            self.on_action(npc, text)
+
+    def stats(self):
+        """NPC turn counts plus the dispatcher's queue depth and wait times."""
+        return {"submitted": self.submitted, "completed": self.completed, **self.dispatcher.stats()}
@@ -0,0 +1,118 @@
+import logging
+
+from llm_dispatch import BACKGROUND_PRIORITY
+from llm_logic import description_cache, description_key, llm_logic
+
+logger = logging.getLogger(__name__)
+
+
+class DescriptionPrefetcher:
+    """
+    Low-priority background descriptions of the entities around the player.
+
+    Whenever the player reaches a new tile, entities that came within radius and are not in
+    llm_logic's description_cache are queued, nearest first. Queued entities are described in
+    small look_batch calls, but only while no player or NPC turn is using the model, and
+    never more than max_in_flight calls at a time. The calls go through the game's
+    dispatcher at BACKGROUND_PRIORITY, so they share its slots and get preempted by
+    anything else.
+    Entities that leave the radius are dropped from the queue and their calls cancelled;
+    calls still running when a player or NPC turn starts are cancelled and requeued.
+
+    "look" (and "look at") then find the descriptions in the cache instead of asking the model.
+    """
+
+    def __init__(self, dispatcher, enabled=True, radius=6, max_in_flight=1, batch_size=4):
+        """
+        Args:
+            dispatcher (LLMDispatcher): The game's dispatcher, shared with player and NPC turns
+            enabled (bool): Whether to prefetch at all
+            radius (float): Distance in tiles at which entities get described; keep it above the look range (4)
+            max_in_flight (int): Maximum number of prefetch calls submitted at once
+            batch_size (int): Maximum number of entities described per call
+        """
+        self.enabled = enabled
+        self.radius = radius
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.dispatcher = dispatcher
+        self.queue = []        # entities waiting to be described, nearest first
+        self.nearby = {}       # id(entity) -> entity, for entities within radius
+        self.in_flight = {}    # future -> entities
+        self.last_tile = None
+        self.was_idle = True
+
+    def update(self, player_entity, obj_entities, idle):
+        """
+        Called once per frame.
+
+        Args:
+            player_entity: the player
+            obj_entities (EntityRegistry): every entity that can be described
+            idle (bool): False while a player or NPC turn is using the model
+        """
+        if not self.enabled:
+            return
+
+        self._reap()
+        tile = (round(player_entity.position.x), round(player_entity.position.y))
+        # A finished turn may have changed what entities look like, so rescan then as well.
+        if tile != self.last_tile or (idle and not self.was_idle):
+            self.last_tile = tile
+            self._rescan(player_entity, obj_entities)
+        self.was_idle = idle
+
+        if not idle:
+            self.cancel_in_flight(requeue=True)
+            return
+
+        while self.queue and len(self.in_flight) < self.max_in_flight:
+            batch, self.queue = self.queue[:self.batch_size], self.queue[self.batch_size:]
+            batch = [obj for obj in batch if description_cache.get(description_key(obj)) is None]
+            if not batch:
+                continue
+            logger.debug(f"Prefetching descriptions of {[obj.properties.get('name') for obj in batch]}")
+            future = self.dispatcher.submit(
+                llm_logic.prefetch_descriptions, player_entity, batch, priority=BACKGROUND_PRIORITY, cancellable=True,
+            )
+            self.in_flight[future] = batch
+
+    def _rescan(self, player_entity, obj_entities):
+        inside = [obj for obj in obj_entities.within(player_entity.position, self.radius) if obj is not player_entity]
+        self.nearby = {id(obj): obj for obj in inside}
+
+        # Forget whatever is out of range now.
+        self.queue = [obj for obj in self.queue if id(obj) in self.nearby]
+        for future, batch in list(self.in_flight.items()):
+            if not any(id(obj) in self.nearby for obj in batch):
+                self._cancel(future)
+
+        # Queue entities in range that are neither described, queued nor being described.
+        pending = {id(obj) for obj in self.queue}
+        pending.update(id(obj) for batch in self.in_flight.values() for obj in batch)
+        for obj in inside:
+            if id(obj) not in pending and description_cache.get(description_key(obj)) is None:
+                self.queue.append(obj)
+
+        position = player_entity.position
+        self.queue.sort(key=lambda obj: position.distance_to(obj.position))
+
+    def _cancel(self, future):
+        # Cancelling the future also stops a running call (see LLMDispatcher.submit).
+        future.cancel()
+        del self.in_flight[future]
+
+    def _reap(self):
+        for future in [future for future in self.in_flight if future.done()]:
+            del self.in_flight[future]
+
+    def cancel_in_flight(self, requeue=False):
+        """Abandons every running prefetch call; with requeue, their entities are described later."""
+        for future, batch in list(self.in_flight.items()):
+            self._cancel(future)
+            if requeue:
+                self.queue[:0] = [obj for obj in batch if id(obj) in self.nearby]
+
+    def shutdown(self):
+        self.cancel_in_flight()
+        self.queue = []
@@ -0,0 +1,79 @@
+import os
+import threading
+
+from prompt_builder import get_prompt_builder
+
+
+class PrefillMeter:
+    """
+    Measures how much of each prompt the model server had to evaluate.
+
+    The server reports the prompt tokens it actually evaluated (Ollama's prompt_eval_count);
+    everything else was reused from its prefix cache. Prompt sizes are counted with the
+    prompt builder's tokenizer, so the split is an estimate.
+    """
+
+    def __init__(self):
+        self.templates = {}  # template name -> totals
+        self.lock = threading.Lock()
+
+    def record(self, template_name, prompt, system, stats):
+        """
+        Args:
+            template_name (str | None): prompt template the request was built from
+            prompt (str): variable part of the prompt
+            system (str | None): static system section
+            stats (dict): the backend's stats for the request
+        """
+        if not stats or stats.get("prompt_eval_count") is None:
+            return
+
+        builder = get_prompt_builder()
+        system_tokens = builder.count(system) if system else 0
+        prompt_tokens = system_tokens + builder.count(prompt)
+        recomputed = min(stats["prompt_eval_count"], prompt_tokens)
+
+        with self.lock:
+            totals = self.templates.setdefault(
+                template_name or "other",
+                {"calls": 0, "prompt_tokens": 0, "system_tokens": 0, "recomputed": 0, "reused": 0},
+            )
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["system_tokens"] += system_tokens
+            totals["recomputed"] += recomputed
+            totals["reused"] += prompt_tokens - recomputed
+
+    def report(self):
+        """A table of prefill tokens reused vs recomputed per template."""
+        lines = [f"{'template':<42} {'calls':>5} {'prompt':>8} {'system':>8} {'recomputed':>10} {'reused':>8} {'reuse %':>7}"]
+        with self.lock:
+            for name, totals in sorted(self.templates.items()):
+                share = 100 * totals["reused"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0
+                lines.append(
+                    f"{name:<42} {totals['calls']:>5} {totals['prompt_tokens']:>8} {totals['system_tokens']:>8} "
+                    f"{totals['recomputed']:>10} {totals['reused']:>8} {share:>6.1f}%"
+                )
+        return "\n".join(lines)
+
+
+_meter = None
+_meter_configured = False
+
+
+def get_prefill_meter():
+    """Returns the active meter, or None unless measuring (LLM_MEASURE_PREFILL=1 or set_prefill_meter)."""
+    global _meter, _meter_configured
+    if not _meter_configured:
+        if os.environ.get("LLM_MEASURE_PREFILL", "").lower() in ("1", "true", "on"):
+            _meter = PrefillMeter()
+        _meter_configured = True
+    return _meter
+
+
+def set_prefill_meter(meter):
+    """Replaces the active meter; pass None to stop measuring."""
+    global _meter, _meter_configured
+    _meter = meter
+    _meter_configured = True
+    return meter
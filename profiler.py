@@ -0,0 +1,239 @@
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Shared by every section timed while profiling is off.
+NO_SECTION = contextlib.nullcontext()
+
+
+class Section:
+    """Times one named part of a frame; see Profiler.section()."""
+
+    __slots__ = ("sections", "name", "start")
+
+    def __init__(self, sections, name):
+        self.sections = sections
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.sections.append((self.name, self.start, time.perf_counter_ns() - self.start))
+
+
+class Profiler:
+    """
+    Records where frame time goes and how long each LLM call spends on the model server.
+
+    The game loop wraps a frame in begin_frame() / end_frame() and each system in
+    section(name); the last max_frames frames are kept with their sections. lm_com
+    reports every LLM call with the timing fields of Ollama's final response line
+    (load, prompt evaluation and generation durations, token counts). While disabled,
+    section() returns a shared no-op context and calls are not recorded, so the
+    instrumentation can stay in place.
+    """
+
+    def __init__(self, enabled=False, max_frames=600, max_calls=500):
+        """
+        Args:
+            enabled (bool): Record from the start; can be switched at any time
+            max_frames (int | None): How many recent frames to keep, None for all of them
+            max_calls (int | None): How many recent LLM calls to keep, None for all of them
+        """
+        self.enabled = enabled
+        self.frames = deque(maxlen=max_frames)  # (start_ns, duration_ns, [(section, start_ns, duration_ns), ...])
+        self.calls = deque(maxlen=max_calls)    # dicts, see record_call()
+        self.lock = threading.Lock()            # calls are recorded from worker threads
+        self.origin = time.perf_counter_ns()
+        self.frame_start = None
+        self.sections = []
+
+    def begin_frame(self):
+        if self.enabled:
+            self.frame_start = time.perf_counter_ns()
+            self.sections = []
+
+    def end_frame(self):
+        if self.frame_start is not None:
+            self.frames.append((self.frame_start, time.perf_counter_ns() - self.frame_start, self.sections))
+            self.frame_start = None
+
+    def section(self, name):
+        """A context manager timing part of the current frame. Main thread only."""
+        if self.frame_start is None:
+            return NO_SECTION
+        return Section(self.sections, name)
+
+    def record_call(self, template_name, start, first_chunk, end, stats):
+        """
+        Args:
+            template_name (str | None): prompt template the request was built from
+            start, first_chunk, end (int): perf_counter_ns() at the request, its first chunk (or None) and its end
+            stats (dict | None): the backend's STAT_FIELDS for the request
+        """
+        if not self.enabled:
+            return
+        call = {
+            "template": template_name or "other",
+            "thread": threading.current_thread().name,
+            "start": start,
+            "first_chunk": first_chunk,
+            "end": end,
+            "stats": dict(stats or {}),
+        }
+        with self.lock:
+            self.calls.append(call)
+
+    def frame_stats(self, window=600):
+        """Per section (and "frame" for the whole step): mean, p95 and max in ms over the last window frames."""
+        durations = {"frame": []}
+        for _, frame_duration, sections in list(itertools.islice(reversed(self.frames), window)):
+            durations["frame"].append(frame_duration)
+            per_frame = {}
+            for name, _, duration in sections:
+                per_frame[name] = per_frame.get(name, 0) + duration
+            for name, duration in per_frame.items():
+                durations.setdefault(name, []).append(duration)
+
+        stats = {}
+        for name, samples in durations.items():
+            if not samples:
+                continue
+            samples.sort()
+            stats[name] = {
+                "mean": sum(samples) / len(samples) / 1e6,
+                "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))] / 1e6,
+                "max": samples[-1] / 1e6,
+            }
+        return stats
+
+    def call_stats(self):
+        """
+        Per template: number of calls and mean milliseconds spent waiting for the first
+        chunk, in total, and (as reported by the server) loading, evaluating the prompt and
+        generating, plus prompt tokens evaluated and generation speed.
+        """
+        with self.lock:
+            calls = list(self.calls)
+
+        totals = {}
+        for call in calls:
+            stats = call["stats"]
+            t = totals.setdefault(call["template"], {
+                "calls": 0, "first_chunk": 0, "total": 0, "load": 0, "prefill": 0, "generation": 0,
+                "prompt_tokens": 0, "eval_count": 0, "eval_duration": 0,
+            })
+            t["calls"] += 1
+            t["first_chunk"] += (call["first_chunk"] or call["end"]) - call["start"]
+            t["total"] += call["end"] - call["start"]
+            t["load"] += stats.get("load_duration") or 0
+            t["prefill"] += stats.get("prompt_eval_duration") or 0
+            t["generation"] += stats.get("eval_duration") or 0
+            t["prompt_tokens"] += stats.get("prompt_eval_count") or 0
+            t["eval_count"] += stats.get("eval_count") or 0
+            t["eval_duration"] += stats.get("eval_duration") or 0
+
+        return {
+            name: {
+                "calls": t["calls"],
+                "first_chunk_ms": t["first_chunk"] / t["calls"] / 1e6,
+                "total_ms": t["total"] / t["calls"] / 1e6,
+                "load_ms": t["load"] / t["calls"] / 1e6,
+                "prefill_ms": t["prefill"] / t["calls"] / 1e6,
+                "generation_ms": t["generation"] / t["calls"] / 1e6,
+                "prompt_tokens": t["prompt_tokens"] / t["calls"],
+                "tokens_per_second": t["eval_count"] / (t["eval_duration"] / 1e9) if t["eval_duration"] else None,
+            }
+            for name, t in totals.items()
+        }
+
+    def overlay_lines(self):
+        """The frame and LLM timings as short text lines, for the in-game overlay."""
+        lines = ["system          mean    p95    max (ms)"]
+        for name, s in self.frame_stats().items():
+            lines.append(f"{name:<14}{s['mean']:>6.2f} {s['p95']:>6.2f} {s['max']:>6.2f}")
+        calls = self.call_stats()
+        if calls:
+            lines.append("llm        calls  prefill  gen  tok/s")
+            for name, c in sorted(calls.items()):
+                speed = f"{c['tokens_per_second']:.0f}" if c["tokens_per_second"] else "-"
+                lines.append(f"{name[:12]:<12}{c['calls']:>4} {c['prefill_ms']:>8.0f} {c['generation_ms']:>6.0f} {speed:>5}")
+        return lines
+
+    def report(self):
+        """A table of per-system frame times and per-template LLM timings."""
+        return "\n".join(self.overlay_lines())
+
+    def chrome_trace(self):
+        """
+        The kept frames and LLM calls in Chrome's trace event format (chrome://tracing, Perfetto).
+        An LLM call's load / prefill / generation spans come from the server's durations, laid
+        out from the start (load, prefill) and from the end (generation) of the call as seen by
+        the client, so network and queueing time shows up in between.
+        """
+        def us(ns):
+            return (ns - self.origin) / 1000
+
+        thread_ids = {"main": 1}
+        events = []
+        for start, duration, sections in list(self.frames):
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 1, "ts": us(start), "dur": duration / 1000})
+            for name, section_start, section_duration in sections:
+                events.append({
+                    "name": name, "ph": "X", "pid": 1, "tid": 1, "ts": us(section_start), "dur": section_duration / 1000,
+                })
+
+        with self.lock:
+            calls = list(self.calls)
+        for call in calls:
+            tid = thread_ids.setdefault(call["thread"], len(thread_ids) + 1)
+            start, end, stats = call["start"], call["end"], call["stats"]
+            events.append({
+                "name": f"llm {call['template']}", "ph": "X", "pid": 1, "tid": tid,
+                "ts": us(start), "dur": (end - start) / 1000, "args": stats,
+            })
+            if call["first_chunk"] is not None:
+                events.append({"name": "first chunk", "ph": "i", "s": "t", "pid": 1, "tid": tid, "ts": us(call["first_chunk"])})
+
+            load = min(stats.get("load_duration") or 0, end - start)
+            prefill = min(stats.get("prompt_eval_duration") or 0, end - start - load)
+            generation = min(stats.get("eval_duration") or 0, end - start - load - prefill)
+            for name, span_start, span in (
+                ("load", start, load), ("prefill", start + load, prefill), ("generation", end - generation, generation),
+            ):
+                if span > 0:
+                    events.append({"name": name, "ph": "X", "pid": 1, "tid": tid, "ts": us(span_start), "dur": span / 1000})
+
+        events += [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}}
+            for name, tid in thread_ids.items()
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+_profiler = None
+
+
+def get_profiler():
+    """Returns the game's profiler, created on first use; it records only while enabled (or if GAME_PROFILE=1)."""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(enabled=os.environ.get("GAME_PROFILE", "").lower() in ("1", "true", "on"))
+    return _profiler
+
+
+def set_profiler(profiler):
+    """Replaces the game's profiler."""
+    global _profiler
+    _profiler = profiler
+    return profiler
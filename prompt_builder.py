@@ -0,0 +1,252 @@
+import logging
+import os
+import re
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Token budget for a whole prompt (template included); LLM_PROMPT_BUDGET overrides it, "off" disables it.
+DEFAULT_PROMPT_BUDGET = 1536
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text):
+    """Rough token count: one per word or punctuation mark. Close enough for budgeting."""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def query_words(text):
+    return set(_WORD_PATTERN.findall((text or "").lower()))
+
+
+class EntitySection:
+    """
+    One or more entity descriptions to be fitted into a template slot.
+
+    The text matches utils.get_entity_description (and, with headers=True, the
+    "name:\\n<description>" blocks of the look prompt). headers can also be a
+    (header, footer) pair of format strings with {index} (1-based) and {name} fields.
+    Blocks and lines are ranked by relevance to the query, but whatever is kept is emitted
+    in the original order.
+    """
+
+    def __init__(self, entities, include_inventory=True, exclude_properties=None,
+                 exclude_invisible_properties=True, headers=False, origin=None):
+        self.entities = entities
+        self.include_inventory = include_inventory
+        self.exclude_properties = exclude_properties or []
+        self.exclude_invisible_properties = exclude_invisible_properties
+        self.headers = headers
+        self.origin = origin  # position used to rank entities by distance
+
+    def blocks(self, words):
+        """
+        Returns:
+            list: (score, header, [(score, line), ...], footer) per entity, in original order
+        """
+        if self.headers is True:
+            header_format, footer_format = "{name}:\n", ""
+        elif self.headers:
+            header_format, footer_format = self.headers
+        else:
+            header_format, footer_format = "", ""
+
+        blocks = []
+        for index, entity in enumerate(self.entities, 1):
+            name = str(entity.properties.get("name", ""))
+            lines = []
+            for k, v in entity.properties.items():
+                if k in self.exclude_properties or (self.exclude_invisible_properties and k.startswith("_")):
+                    continue
+                lines.append((self.property_score(k, v, words), f"- {k}: {v}"))
+
+            if self.include_inventory:
+                item_names = [item.properties["name"] for item in entity.inventory]
+                mentioned = any(query_words(item_name) & words for item_name in item_names)
+                lines.append((3 if mentioned else 1, "- inventory: " + ", ".join(item_names)))
+
+            score = 10 if query_words(name) & words else 0
+            if self.origin is not None:
+                score -= self.origin.distance_to(entity.position)
+            blocks.append((
+                score,
+                header_format.format(index=index, name=name),
+                lines,
+                footer_format.format(index=index, name=name),
+            ))
+        return blocks
+
+    @staticmethod
+    def property_score(key, value, words):
+        if key == "name":
+            return 100  # Never describe something without saying what it is
+        score = 0
+        if query_words(key.replace("_", " ")) & words:
+            score += 3
+        if query_words(str(value)) & words:
+            score += 2
+        if key.startswith("_"):
+            score -= 1
+        return score
+
+
+class PromptBuilder:
+    """
+    Fills prompt templates while keeping them inside a token budget.
+
+    The system section, the template and the fixed slots (e.g. the action text) always go in; entity sections share
+    what is left. When they don't fit, the least relevant entities and properties are dropped
+    first. Every build records size metrics, see last_metrics / metrics.
+    """
+
+    def __init__(self, budget=DEFAULT_PROMPT_BUDGET, tokenizer=None, max_metrics=200):
+        """
+        Args:
+            budget (int | None): maximum prompt size in tokens, None for no limit
+            tokenizer (callable): text -> token count, estimate_tokens by default
+            max_metrics (int): how many per-request metrics to keep
+        """
+        self.budget = budget
+        self.tokenizer = tokenizer or estimate_tokens
+        self.metrics = deque(maxlen=max_metrics)
+        self.static_tokens = {}  # template name -> (template, system tokens, literal tokens)
+
+    @property
+    def last_metrics(self):
+        return self.metrics[-1] if self.metrics else None
+
+    def count(self, text):
+        return self.tokenizer(text)
+
+    def template_tokens(self, template):
+        """(system section, literal text) token counts of a template, counted once."""
+        counts = self.static_tokens.get(template.name)
+        if counts is None or counts[0] is not template:
+            counts = (template, self.count(template.system), self.count(template.literal_text))
+            self.static_tokens[template.name] = counts
+        return counts[1:]
+
+    def build(self, command, template, fixed=None, sections=None, query=""):
+        """
+        Args:
+            command (str): request type, for the metrics ("look", "do", "trade", ...)
+            template (templates.Template): the prompt template; its system section counts against the budget
+            fixed (dict): slot -> text inserted as is
+            sections (dict): slot -> EntitySection, trimmed to the budget
+            query (str): text the relevance of entities and properties is judged against
+
+        Returns:
+            str: the prompt
+        """
+        fixed = fixed or {}
+        sections = sections or {}
+        words = query_words(query)
+
+        system_tokens, literal_tokens = self.template_tokens(template)
+        fixed_tokens = system_tokens + literal_tokens + sum(self.count(text) for text in fixed.values())
+
+        blocks = {slot: section.blocks(words) for slot, section in sections.items()}
+        full = {slot: self.render(slot_blocks) for slot, slot_blocks in blocks.items()}
+        full_tokens = {slot: self.count(text) for slot, text in full.items()}
+
+        texts = dict(full)
+        section_metrics = {}
+        truncated = False
+        if self.budget is not None and fixed_tokens + sum(full_tokens.values()) > self.budget:
+            truncated = True
+            available = max(0, self.budget - fixed_tokens)
+            # Smallest sections first, so whatever they leave over goes to the larger ones.
+            pending = sorted(sections, key=full_tokens.get)
+            for i, slot in enumerate(pending):
+                share = available // (len(pending) - i)
+                texts[slot], dropped_blocks, dropped_lines = self.fit(blocks[slot], share)
+                available -= self.count(texts[slot])
+                section_metrics[slot] = {"dropped_blocks": dropped_blocks, "dropped_lines": dropped_lines}
+
+        prompt = template.render(fixed, **texts)
+
+        metrics = {
+            "command": command,
+            "budget": self.budget,
+            "prompt_tokens": system_tokens + self.count(prompt),
+            "system_tokens": system_tokens,
+            "fixed_tokens": fixed_tokens,
+            "prefix_hash": template.prefix_hash,
+            "truncated": truncated,
+            "sections": {
+                slot: {
+                    "tokens": self.count(texts[slot]),
+                    "full_tokens": full_tokens[slot],
+                    "blocks": len(blocks[slot]),
+                    **section_metrics.get(slot, {"dropped_blocks": 0, "dropped_lines": 0}),
+                }
+                for slot in sections
+            },
+        }
+        self.metrics.append(metrics)
+        logger.info(
+            f"{command} prompt: {metrics['prompt_tokens']} tokens"
+            + (f" (truncated to budget {self.budget})" if truncated else "")
+        )
+        return prompt
+
+    @staticmethod
+    def render(blocks, keep=None):
+        """Joins blocks back into text; keep maps block index -> set of kept line indices."""
+        parts = []
+        for i, (_, header, lines, footer) in enumerate(blocks):
+            if keep is not None and i not in keep:
+                continue
+            kept_lines = [line for j, (_, line) in enumerate(lines) if keep is None or j in keep[i]]
+            parts.append(header + "\n".join(kept_lines) + footer)
+        return "\n".join(parts)
+
+    def fit(self, blocks, budget):
+        """
+        Keeps the most relevant blocks and lines that fit in budget tokens.
+
+        Returns:
+            tuple: (text, dropped block count, dropped line count)
+        """
+        keep = {}
+        used = 0
+        ranked_blocks = sorted(range(len(blocks)), key=lambda i: -blocks[i][0])
+        for i in ranked_blocks:
+            _, header, lines, footer = blocks[i]
+            cost = self.count(header) + self.count(footer) + (1 if keep else 0)  # +1 for the separating newline
+            if used + cost > budget:
+                continue
+            kept = set()
+            ranked_lines = sorted(range(len(lines)), key=lambda j: -lines[j][0])
+            for j in ranked_lines:
+                line_cost = self.count(lines[j][1])
+                if used + cost + line_cost <= budget:
+                    kept.add(j)
+                    cost += line_cost
+            if header or kept:
+                keep[i] = kept
+                used += cost
+
+        dropped_lines = sum(len(blocks[i][2]) - len(kept) for i, kept in keep.items())
+        return self.render(blocks, keep), len(blocks) - len(keep), dropped_lines
+
+
+_builder = None
+
+
+def get_prompt_builder():
+    """Returns the shared prompt builder; the budget comes from LLM_PROMPT_BUDGET ("off" for no limit)."""
+    global _builder
+    if _builder is None:
+        budget = os.environ.get("LLM_PROMPT_BUDGET", str(DEFAULT_PROMPT_BUDGET))
+        _builder = PromptBuilder(None if budget.lower() in ("", "0", "off") else int(budget))
+    return _builder
+
+
+def set_prompt_builder(builder):
+    """Replaces the shared prompt builder and returns it."""
+    global _builder
+    _builder = builder
+    return builder
@@ -1,12 +1,16 @@
 import pytmx
 from pytmx import TiledObjectGroup
 import pygame
-import textwrap
+
+from camera import Camera
+from chunk_cache import ChunkCache
+from text_layout import TextLayout
+from tile_atlas import TileAtlas
 
 
 class Render:
 
-    def __init__(self, tmx_data, MAP_WIDTH, MAP_HEIGHT):
+    def __init__(self, tmx_data, MAP_WIDTH, MAP_HEIGHT, atlas=None, viewport_tiles=(30, 20)):
 
         self.TILE_SIZE = 16  # Original tile size
         self.SCALE = 2  # Scale factor for zooming in
@@ -20,47 +24,95 @@ class Render:
         self.MAP_HEIGHT = MAP_HEIGHT
         print(f"{self.MAP_HEIGHT=} {self.MAP_WIDTH=}")
 
-        self.SCREEN_WIDTH = self.MAP_WIDTH * self.TILE_SIZE * self.SCALE
-        self.SCREEN_HEIGHT = self.MAP_HEIGHT * self.TILE_SIZE * self.SCALE
-
         pygame.display.set_caption("TMX Map with Player and NPCs (Zoomed In)")
-        self.base_surface = pygame.Surface(
-            (
-                self.MAP_WIDTH * self.TILE_SIZE,
-                self.MAP_HEIGHT * self.TILE_SIZE,
-            )
+
+        # Tiles pre-converted and pre-scaled to SCALE, indexed by gid.
+        self.atlas = atlas if atlas is not None else TileAtlas(tmx_data, self.TILE_SIZE, self.SCALE)
+        self.SCALE = self.atlas.scale
+
+        # The window shows at most viewport_tiles of the map; larger maps scroll with the camera.
+        self.VIEWPORT_WIDTH = min(self.MAP_WIDTH, viewport_tiles[0])
+        self.VIEWPORT_HEIGHT = min(self.MAP_HEIGHT, viewport_tiles[1])
+        self.SCREEN_WIDTH = self.VIEWPORT_WIDTH * self.TILE_SIZE * self.SCALE
+        self.SCREEN_HEIGHT = self.VIEWPORT_HEIGHT * self.TILE_SIZE * self.SCALE
+
+        self.camera = Camera(
+            self.SCREEN_WIDTH,
+            self.SCREEN_HEIGHT,
+            self.MAP_WIDTH * self.TILE_SIZE * self.SCALE,
+            self.MAP_HEIGHT * self.TILE_SIZE * self.SCALE,
+            self.SCALE,
         )
+        self.previous_camera_offset = None
 
-    def get_tile_image(self, gid):
-        tile = self.tmx_data.get_tile_image_by_gid(gid)
-        if tile:
-            # Scale the tile image
-            tile = pygame.transform.scale(tile, (self.TILE_SIZE, self.TILE_SIZE))
-        return tile
+        # Static layers baked lazily per CHUNK_TILES x CHUNK_TILES block at screen scale, see bake_chunk().
+        # Each chunk is (below, above): below holds the background, metadata outlines, "on_ground" and
+        # "collision", above holds "above_ground" and "npcs", drawn over the sprites.
+        self.CHUNK_TILES = 16
+        self.chunks = ChunkCache(max_chunks=64)
+        self.scaled_images = {}    # id(sprite image) -> (image, image at screen scale), for sprites not from the atlas
+
+        # Fonts and rendered lines are cached; panel surfaces are rebuilt only when their contents change.
+        self.text_layout = TextLayout()
+        self.panel_cache = {}  # panel key -> (contents key, surface)
 
-    def draw_tile_layer(self, tmx_data, layer_name, surface):
+        # Where sprites and panels were drawn last frame, to find what moved / closed and must be erased.
+        self.previous_sprite_rects = {}  # id(sprite) -> screen rect
+        self.previous_panels = []  # (surface, screen rect) of the panels drawn last frame
+        self.full_redraw = True
+
+    def get_tile_image(self, gid):
+        """Tile image at screen scale."""
+        return self.atlas.get(gid)
+
+    def draw_tile_layer(self, tmx_data, layer_name, surface, tile_rect=None):
+        """
+        Draws a tile layer onto surface. With tile_rect (in tiles), only that part of the
+        layer is drawn, with the rect's top left corner at the surface origin.
+        """
         layer = tmx_data.get_layer_by_name(layer_name)
         if layer and isinstance(layer, pytmx.TiledTileLayer):
-            for x, y, gid in layer:
-                if gid == 0:
-                    continue  # Skip empty tiles
-                tile_image = self.get_tile_image(gid)
-                # tile_image = pygame.transform.scale(tile_image, (16 * 2, 16 * 2))
-
-                if tile_image:
-                    surface.blit(
-                        tile_image,
-                        (x * self.TILE_SIZE, y * self.TILE_SIZE),
-                    )
+            if tile_rect is None:
+                tile_rect = pygame.Rect(0, 0, layer.width, layer.height)
+            scaled_tile_size = self.TILE_SIZE * self.SCALE
+            for y in range(tile_rect.top, min(tile_rect.bottom, layer.height)):
+                row = layer.data[y]
+                for x in range(tile_rect.left, min(tile_rect.right, layer.width)):
+                    gid = row[x]
+                    if gid == 0:
+                        continue  # Skip empty tiles
+                    tile_image = self.get_tile_image(gid)
+
+                    if tile_image:
+                        surface.blit(
+                            tile_image,
+                            ((x - tile_rect.left) * scaled_tile_size, (y - tile_rect.top) * scaled_tile_size),
+                        )
 
 
 
     def draw_optionbox(self, optionbox):
         box_coords = tuple(optionbox.coords)
 
+        # Prepare option list
+        has_title = optionbox.title is not None
+        option_list = [{"text": optionbox.title}] + optionbox.options if has_title else optionbox.options
+        selected_option = optionbox.get_selected()
+
+        # Reuse last frame's surface unless something shown in the box changed
+        key = (
+            tuple(option["text"] for option in option_list),
+            has_title,
+            tuple(selected_option),
+            optionbox.box_width,
+            optionbox.box_height,
+        )
+        cached = self.panel_cache.get(id(optionbox))
+        if cached is not None and cached[0] == key:
+            return cached[1], box_coords
+
         # Initialize surface
-        font = pygame.font.Font(None, 22)
-        font_height = font.get_height()
+        font_height = self.text_layout.font(22).get_height()
 
         num_lines = len(optionbox.options) + (1 if optionbox.title else 0)
         required_height = num_lines * font_height + 10  # Dynamic height calculation
@@ -68,64 +120,94 @@ class Render:
         textbox_surface.fill((25, 25, 25))
         textbox_surface.set_alpha(220)
 
-        # Prepare option list
-        has_title = optionbox.title is not None
-        option_list = [{"text": optionbox.title}] + optionbox.options if has_title else optionbox.options
-
         # Render text
         line_height = 10  # Initial padding
-        selected_option = optionbox.get_selected()
         for i, option in enumerate(option_list):
             color = (255, 255, 100) if i - 1 in selected_option else (255, 255, 255)
             if has_title and i == 0:
                 color = (255, 100, 100)
 
-            text = font.render(option["text"], True, color)
+            text = self.text_layout.render_line(option["text"], color, 22)
             textbox_surface.blit(text, (10, line_height))
             line_height += font_height
 
+        self.panel_cache[id(optionbox)] = (key, textbox_surface)
         return textbox_surface, box_coords
 
+    def textbox_rect(self):
+        box_top = int(self.SCREEN_HEIGHT * 0.5)
+        return pygame.Rect(0, box_top, self.SCREEN_WIDTH, self.SCREEN_HEIGHT - box_top)
 
+    def textbox_line_capacity(self):
+        """How many lines of chat fit in the text box."""
+        return max(1, (self.textbox_rect().height - 10) // self.text_layout.font(22).get_height())
 
-    def draw_textbox(
-        self, chat_history=[{"speaker": "system", "text": "hello world!"}]
-    ):
-
-        # surface_width = self.base_surface.get_width()
-        # surface_height = self.base_surface.get_height()
-
-        surface_width = self.SCREEN_WIDTH
-        surface_height = self.SCREEN_HEIGHT
+    def draw_textbox(self, chat_lines=["system: hello world!"]):
+        box_rect = self.textbox_rect()
 
-        box_top = int(surface_height * 0.5)
-        box_bottom = surface_height - box_top
+        # Reuse last frame's surface unless the visible lines changed
+        key = tuple(chat_lines)
+        cached = self.panel_cache.get("textbox")
+        if cached is not None and cached[0] == key:
+            return cached[1], box_rect.topleft
 
-        textbox_surface = pygame.Surface((surface_width, box_bottom))
+        textbox_surface = pygame.Surface(box_rect.size)
         textbox_surface.fill((25, 25, 25))
         textbox_surface.set_alpha(220)
-        font = pygame.font.Font(None, 22)
 
-        font_height = font.get_height()
+        font_height = self.text_layout.font(22).get_height()
         line_height = 0
 
-        for chat_message in chat_history:
-
-            chat_text = textwrap.wrap(chat_message["text"], 115)
-            if len(chat_text) > 0:
-                chat_text[0] = f"{chat_message['speaker']}: {chat_text[0]}"
-
-            for chat_text_line in chat_text:
-                text = font.render(chat_text_line, True, (150, 150, 150))
-                textbox_surface.blit(text, (10, 10 + line_height))
-                line_height += font_height
-
-        # self.base_surface.blit(textbox_surface, (0, box_top))
-        return textbox_surface, (0, box_top)
-
-    def update(self, npcs_group, screen, textboxes, optionboxes):
+        for chat_text_line in chat_lines:
+            text = self.text_layout.render_line(chat_text_line, (150, 150, 150), 22)
+            textbox_surface.blit(text, (10, 10 + line_height))
+            line_height += font_height
 
-        self.base_surface.fill(
+        self.panel_cache["textbox"] = (key, textbox_surface)
+        return textbox_surface, box_rect.topleft
+
+    def draw_overlay(self, lines):
+        """A translucent panel with the given lines in the top left corner, e.g. the profiler's timings."""
+        key = tuple(lines)
+        cached = self.panel_cache.get("overlay")
+        if cached is not None and cached[0] == key:
+            return cached[1], (0, 0)
+
+        font_height = self.text_layout.font(18).get_height()
+        rendered = [self.text_layout.render_line(line, (180, 255, 180), 18) for line in lines]
+        width = max((text.get_width() for text in rendered), default=0) + 20
+        overlay_surface = pygame.Surface((width, len(lines) * font_height + 10))
+        overlay_surface.fill((10, 10, 10))
+        overlay_surface.set_alpha(200)
+        for i, text in enumerate(rendered):
+            overlay_surface.blit(text, (10, 5 + i * font_height))
+
+        self.panel_cache["overlay"] = (key, overlay_surface)
+        return overlay_surface, (0, 0)
+
+    def invalidate_static_layers(self):
+        """Call after tile layer data changed; chunks are re-baked as they come into view."""
+        self.chunks.clear()
+        self.full_redraw = True
+
+    def bake_chunk(self, chunk_pos):
+        """
+        Renders the static layers of one chunk, directly at screen scale.
+
+        Returns:
+            tuple: (below surface, above surface)
+        """
+        chunk_x, chunk_y = chunk_pos
+        tile_rect = pygame.Rect(
+            chunk_x * self.CHUNK_TILES, chunk_y * self.CHUNK_TILES, self.CHUNK_TILES, self.CHUNK_TILES
+        ).clip(pygame.Rect(0, 0, self.MAP_WIDTH, self.MAP_HEIGHT))
+        scaled_tile_size = self.TILE_SIZE * self.SCALE
+        chunk_size = (tile_rect.width * scaled_tile_size, tile_rect.height * scaled_tile_size)
+        origin_x = tile_rect.x * scaled_tile_size
+        origin_y = tile_rect.y * scaled_tile_size
+
+        below_surface = pygame.Surface(chunk_size).convert()
+        below_surface.fill(
             self.tmx_data.background_color
             if self.tmx_data.background_color
             else (0, 0, 0)
@@ -135,80 +217,147 @@ class Render:
         # For example, drawing objects from "metadata" as needed
         metadata_layer = self.tmx_data.get_layer_by_name("metadata")
         if isinstance(metadata_layer, TiledObjectGroup):
+            chunk_rect = pygame.Rect((origin_x, origin_y), chunk_size)
             for obj in metadata_layer:
                 # Example: Draw a simple rectangle around objects
                 if obj.name.lower() != "player":  # Avoid drawing the player if present
-                    # Choose a color based on object type
-                    # if obj.type == "doorway":
-                    #     color = (0, 0, 255)  # Blue for doorways
-                    # elif obj.type == "furniture":
-                    #     color = (139, 69, 19)  # Brown for furniture
-                    # elif obj.type == "object":
-                    #     color = (255, 255, 0)  # Yellow for generic objects
-                    # elif obj.type == "transport":
-                    #     color = (0, 255, 255)  # Cyan for transport objects
-                    # else:
-                    #     color = (255, 255, 255)  # White for others
                     color = (100, 100, 100)  # White for others
 
-                    # Draw the rectangle
-                    pygame.draw.rect(
-                        self.base_surface,
-                        color,
-                        pygame.Rect(
-                            obj.x,
-                            obj.y,
-                            obj.width,
-                            obj.height,
-                        ),
-                        1,  # Border thickness
+                    # Draw the rectangle (a 1 pixel border at map resolution)
+                    rect = pygame.Rect(
+                        int(obj.x) * self.SCALE,
+                        int(obj.y) * self.SCALE,
+                        int(obj.width) * self.SCALE,
+                        int(obj.height) * self.SCALE,
                     )
+                    if rect.colliderect(chunk_rect):
+                        pygame.draw.rect(
+                            below_surface,
+                            color,
+                            rect.move(-origin_x, -origin_y),
+                            self.SCALE,  # Border thickness
+                        )
+
+        # Draw "on_ground" and "collision" layers, below the sprites
+        self.draw_tile_layer(self.tmx_data, "on_ground", below_surface, tile_rect)
+        self.draw_tile_layer(self.tmx_data, "collision", below_surface, tile_rect)
+
+        # Draw "above_ground" and "npcs" layers, over the sprites
+        above_surface = pygame.Surface(chunk_size, pygame.SRCALPHA).convert_alpha()
+        above_surface.fill((0, 0, 0, 0))
+        self.draw_tile_layer(self.tmx_data, "above_ground", above_surface, tile_rect)
+        self.draw_tile_layer(self.tmx_data, "npcs", above_surface, tile_rect)
+
+        return below_surface, above_surface
+
+    def visible_chunks(self, world_rect):
+        """
+        The chunks overlapping a rect in (scaled) world pixels.
+
+        Returns:
+            list: (below surface, above surface, chunk rect in world pixels) tuples
+        """
+        chunk_pixels = self.CHUNK_TILES * self.TILE_SIZE * self.SCALE
+        chunks = []
+        if world_rect.width <= 0 or world_rect.height <= 0:
+            return chunks
+        for chunk_y in range(max(0, world_rect.top // chunk_pixels), (world_rect.bottom - 1) // chunk_pixels + 1):
+            for chunk_x in range(max(0, world_rect.left // chunk_pixels), (world_rect.right - 1) // chunk_pixels + 1):
+                below, above = self.chunks.get((chunk_x, chunk_y), self.bake_chunk)
+                chunks.append((below, above, below.get_rect(topleft=(chunk_x * chunk_pixels, chunk_y * chunk_pixels))))
+        return chunks
+
+    def get_scaled_image(self, image):
+        cached = self.scaled_images.get(id(image))
+        if cached is None or cached[0] is not image:
+            scaled = pygame.transform.scale(image, (image.get_width() * self.SCALE, image.get_height() * self.SCALE))
+            cached = (image, scaled)
+            self.scaled_images[id(image)] = cached
+        return cached[1]
+
+    def update(self, npcs_group, screen, textboxes, optionboxes, overlays=()):
+        """
+        Draws a frame. The static layers come from the baked chunks under the camera; only the
+        regions of sprites that moved, appeared or disappeared and of UI panels that opened,
+        closed or changed are redrawn and pushed to the display. A camera move redraws the whole window.
+        """
+        camera_x, camera_y = self.camera.offset
+        if self.camera.offset != self.previous_camera_offset:
+            self.full_redraw = True
+            self.previous_camera_offset = self.camera.offset
+
+        view = screen.get_rect()
+        sprites = []
+        sprite_rects = {}
+        for sprite in npcs_group:
+            rect = pygame.Rect(
+                sprite.rect.x * self.SCALE - camera_x,
+                sprite.rect.y * self.SCALE - camera_y,
+                sprite.rect.width * self.SCALE,
+                sprite.rect.height * self.SCALE,
+            )
+            if not rect.colliderect(view):
+                continue  # Off screen
+            image = getattr(sprite, "display_image", None) or self.get_scaled_image(sprite.image)
+            sprites.append((image, rect))
+            sprite_rects[id(sprite)] = rect
 
-
-        # Draw "on_ground" layer
-        # self.draw_tile_layer(self.tmx_data, "on_ground", screen)
-        self.draw_tile_layer(self.tmx_data, "on_ground", self.base_surface)
-
-        # Draw "collision" layer
-        # self.draw_tile_layer(self.tmx_data, "collision", screen)
-        self.draw_tile_layer(self.tmx_data, "collision", self.base_surface)
-
-        # Draw NPC sprites
-        npcs_group.draw(self.base_surface)
-
-        # Draw "above_ground" layer
-        self.draw_tile_layer(self.tmx_data, "above_ground", self.base_surface)
-        self.draw_tile_layer(self.tmx_data, "npcs", self.base_surface)
-
-
-        # for textbox in textboxes:
-        #     if textbox.active:
-        #         self.draw_textbox(textbox.history + [textbox.text + "_"])
-
-        # Update the display
-        scaled_surface = pygame.transform.scale(
-            self.base_surface,
-            (
-                self.TILE_SIZE * self.MAP_WIDTH * self.SCALE,
-                self.TILE_SIZE * self.MAP_HEIGHT * self.SCALE,
-            ),
-        )
-
-        screen.blit(scaled_surface, (0, 0))
-
+        panels = []
         for textbox in textboxes:
             if textbox.active:
                 textbox_surface, coords = self.draw_textbox(
-                    textbox.get_history_to_display()
-                    + [{"speaker": textbox.turn, "text": f"{textbox.text}_"}]
+                    textbox.get_lines_to_display(self.textbox_line_capacity())
                 )
-                screen.blit(textbox_surface, coords)
+                panels.append((textbox_surface, coords))
 
         for optionbox in optionboxes:
             if not optionbox.active:
                 continue
 
             optionbox_surface, coords = self.draw_optionbox(optionbox)
-            screen.blit(optionbox_surface, coords)
-
-        pygame.display.flip()
+            panels.append((optionbox_surface, coords))
+
+        for overlay in overlays:
+            if overlay.active:
+                panels.append(self.draw_overlay(overlay.get_lines()))
+
+        drawn_panels = [(surface, surface.get_rect(topleft=coords)) for surface, coords in panels]
+
+        if self.full_redraw:
+            dirty_rects = [view]
+        else:
+            # Sprites that moved, appeared or disappeared, plus panels that opened, closed or changed.
+            dirty_rects = [rect for panel, rect in drawn_panels if (panel, rect) not in self.previous_panels]
+            dirty_rects += [rect for panel, rect in self.previous_panels if (panel, rect) not in drawn_panels]
+            for key, rect in sprite_rects.items():
+                previous = self.previous_sprite_rects.get(key)
+                if previous != rect:
+                    dirty_rects.append(rect)
+                    if previous is not None:
+                        dirty_rects.append(previous)
+            for key, previous in self.previous_sprite_rects.items():
+                if key not in sprite_rects:
+                    dirty_rects.append(previous)
+
+        for dirty in dirty_rects:
+            screen.set_clip(dirty)
+            chunks = self.visible_chunks(dirty.move(camera_x, camera_y).clip(self.camera.rect))
+            for below, above, chunk_rect in chunks:
+                screen.blit(below, chunk_rect.move(-camera_x, -camera_y))
+            for image, rect in sprites:
+                if rect.colliderect(dirty):
+                    screen.blit(image, rect)
+            for below, above, chunk_rect in chunks:
+                screen.blit(above, chunk_rect.move(-camera_x, -camera_y))
+            for surface, coords in panels:
+                screen.blit(surface, coords)
+        screen.set_clip(None)
+
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        elif dirty_rects:
+            pygame.display.update(dirty_rects)
+
+        self.previous_sprite_rects = sprite_rects
+        self.previous_panels = drawn_panels
@@ -0,0 +1,153 @@
+import json
+import os
+
+import pygame
+
+# Event types a script can contain, by the name used in script files.
+EVENT_TYPES = {
+    "quit": pygame.QUIT,
+    "keydown": pygame.KEYDOWN,
+    "keyup": pygame.KEYUP,
+    "mousemotion": pygame.MOUSEMOTION,
+    "mousebuttondown": pygame.MOUSEBUTTONDOWN,
+    "mousebuttonup": pygame.MOUSEBUTTONUP,
+}
+EVENT_NAMES = {event_type: name for name, event_type in EVENT_TYPES.items()}
+
+# Attributes kept when an event is recorded; the rest (window ids, touch flags...) are not replayed.
+EVENT_ATTRIBUTES = {
+    pygame.KEYDOWN: ("key", "mod", "unicode", "scancode"),
+    pygame.KEYUP: ("key", "mod", "unicode", "scancode"),
+    pygame.MOUSEMOTION: ("pos", "rel", "buttons"),
+    pygame.MOUSEBUTTONDOWN: ("pos", "button"),
+    pygame.MOUSEBUTTONUP: ("pos", "button"),
+}
+
+
+def use_dummy_drivers():
+    """
+    Makes SDL render to an offscreen surface and skip audio, so the game runs without a
+    display. Has to be called before pygame.init(); explicit settings are kept.
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+
+def event_to_dict(frame, event):
+    attributes = {}
+    for name in EVENT_ATTRIBUTES.get(event.type, ()):
+        if hasattr(event, name):
+            value = getattr(event, name)
+            attributes[name] = list(value) if isinstance(value, tuple) else value
+    return {"frame": frame, "type": EVENT_NAMES[event.type], **attributes}
+
+
+def event_from_dict(entry):
+    """
+    Builds a pygame event from a script entry. "key" may be a key code or a key name
+    understood by pygame.key.key_code ("return", "a", "up"...).
+    """
+    attributes = {name: value for name, value in entry.items() if name not in ("frame", "type")}
+    if isinstance(attributes.get("key"), str):
+        attributes["key"] = pygame.key.key_code(attributes["key"])
+    if entry["type"] in ("keydown", "keyup"):
+        attributes.setdefault("mod", 0)
+        attributes.setdefault("unicode", "")
+        attributes.setdefault("scancode", 0)
+    for name in ("pos", "rel"):
+        if name in attributes:
+            attributes[name] = tuple(attributes[name])
+    return pygame.event.Event(EVENT_TYPES[entry["type"]], attributes)
+
+
+def type_text(frame, text, submit=True):
+    """Script entries typing text into the command window one character per frame, then pressing RETURN."""
+    entries = []
+    for i, char in enumerate(text):
+        key = ord(char.lower()) if char.isascii() else 0
+        # Released on the same frame, so typing "w", "a", "s" or "d" doesn't hold a movement key.
+        entries.append({"frame": frame + i, "type": "keydown", "key": key, "unicode": char})
+        entries.append({"frame": frame + i, "type": "keyup", "key": key})
+    if submit:
+        entries.append({"frame": frame + len(text), "type": "keydown", "key": "return", "unicode": "\r"})
+    return entries
+
+
+def hold_key(frame, key, frames):
+    """Script entries holding key down for the given number of frames."""
+    return [
+        {"frame": frame, "type": "keydown", "key": key},
+        {"frame": frame + frames, "type": "keyup", "key": key},
+    ]
+
+
+class ScriptedInput:
+    """
+    Feeds the game a fixed stream of events instead of (or on top of) the live ones.
+
+    Entries are dicts with the frame they are delivered on, an event type from
+    EVENT_TYPES and the event's attributes; InputRecorder writes them in the same form,
+    so a recorded session replays frame for frame. Since a headless window never gets
+    real key presses, the scripted KEYDOWN / KEYUP events also drive the key state the
+    movement system reads (pressed()).
+    """
+
+    def __init__(self, entries):
+        """
+        Args:
+            entries (list[dict]): Script entries, in any order
+        """
+        self.entries = sorted(entries, key=lambda entry: entry["frame"])
+        self.position = 0
+        self.held = set()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @property
+    def finished(self):
+        return self.position >= len(self.entries)
+
+    def events(self, frame):
+        """The events due up to this frame, in script order."""
+        due = []
+        while self.position < len(self.entries) and self.entries[self.position]["frame"] <= frame:
+            event = event_from_dict(self.entries[self.position])
+            self.position += 1
+            if event.type == pygame.KEYDOWN:
+                self.held.add(event.key)
+            elif event.type == pygame.KEYUP:
+                self.held.discard(event.key)
+            due.append(event)
+        return due
+
+    def pressed(self):
+        """A pygame.key.get_pressed() look-alike for the keys the script holds down."""
+        return KeyState(self.held)
+
+
+class KeyState:
+    def __init__(self, held):
+        self.held = held
+
+    def __getitem__(self, key):
+        return key in self.held
+
+
+class InputRecorder:
+    """Collects the events the game processed, per frame, and saves them as a ScriptedInput script."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+
+    def record(self, frame, events):
+        for event in events:
+            if event.type in EVENT_NAMES:
+                self.entries.append(event_to_dict(frame, event))
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1)
@@ -0,0 +1,213 @@
+import threading
+
+
+class SharedStream:
+    """
+    One generation read by any number of consumers.
+
+    Whichever consumer first needs a chunk nobody has pulled yet pulls it from the
+    source; the others wait for it. Every chunk is kept, so a consumer that joins late
+    (or lags behind) replays the stream from the start. Once the last consumer stops
+    reading early, the source is closed, which drops the request.
+    """
+
+    def __init__(self, source, on_finish=None):
+        """
+        Args:
+            source (iterator): The generation's chunk stream
+            on_finish (callable, optional): Called once the source is exhausted, failed or abandoned
+        """
+        self.source = source
+        self.on_finish = on_finish
+        self.chunks = []
+        self.condition = threading.Condition()
+        self.pulling = False
+        self.done = False
+        self.abandoned = False
+        self.error = None
+        self.consumers = 0
+
+    def subscribe(self):
+        """A tee of the stream from its first chunk, or None if it was abandoned. Counts as a consumer right away."""
+        with self.condition:
+            if self.abandoned:
+                return None
+            self.consumers += 1
+        return Tee(self)
+
+    def _chunk(self, index):
+        """The chunk at index, pulling it from the source if needed; None at the end of the stream."""
+        with self.condition:
+            while index >= len(self.chunks) and not self.done and self.pulling:
+                self.condition.wait()
+            if index < len(self.chunks):
+                return self.chunks[index]
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return None
+            self.pulling = True
+
+        chunk = error = None
+        try:
+            chunk = next(self.source)
+        except StopIteration:
+            pass
+        except BaseException as e:
+            error = e
+
+        with self.condition:
+            self.pulling = False
+            if chunk is not None:
+                self.chunks.append(chunk)
+            else:
+                self.done = True
+                self.error = error
+            self.condition.notify_all()
+        if chunk is None:
+            self._finish()
+            if error is not None:
+                raise error
+        return chunk
+
+    def _leave(self):
+        with self.condition:
+            self.consumers -= 1
+            abandon = self.consumers == 0 and not self.done
+            if abandon:
+                self.done = True
+                self.abandoned = True
+        if abandon:
+            self.source.close()
+            self._finish()
+
+    def _finish(self):
+        if self.on_finish:
+            self.on_finish()
+
+
+class Tee:
+    """
+    One consumer's read position in a SharedStream.
+
+    It leaves the stream once exhausted, failed, closed or garbage collected, including
+    when it is closed before its first chunk, so an unread tee never keeps the source open.
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.index = 0
+        self.left = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.left:
+            raise StopIteration
+        try:
+            chunk = self.shared._chunk(self.index)
+        except BaseException:
+            self.close()
+            raise
+        if chunk is None:
+            self.close()
+            raise StopIteration
+        self.index += 1
+        return chunk
+
+    def close(self):
+        if not self.left:
+            self.left = True
+            self.shared._leave()
+
+    def __del__(self):
+        self.close()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent requests.
+
+    Callers asking for a key while a generation for it is in flight get a tee of that
+    generation instead of starting their own; the entry is forgotten as soon as the
+    generation ends, so later callers start a fresh one.
+    """
+
+    def __init__(self):
+        self.flights = {}  # key -> SharedStream
+        self.lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def stream(self, key, start):
+        """
+        Args:
+            key (str): identifies the request (model, prompt, options, ...)
+            start (callable): returns the chunk iterator of a new generation
+
+        Returns:
+            Tee: this caller's tee of the generation
+        """
+        with self.lock:
+            shared = self.flights.get(key)
+            tee = shared.subscribe() if shared is not None else None
+            if tee is not None:
+                self.coalesced += 1
+                return tee
+
+            shared = SharedStream(start(), on_finish=lambda: self._forget(key, shared))
+            self.flights[key] = shared
+            self.started += 1
+            return shared.subscribe()
+
+    def _forget(self, key, shared):
+        with self.lock:
+            if self.flights.get(key) is shared:
+                del self.flights[key]
+
+
+if __name__ == "__main__":
+    class Source:
+        """A chunk stream that records whether it was closed."""
+
+        def __init__(self):
+            self.chunks = iter("abc")
+            self.closed = False
+
+        def __next__(self):
+            return next(self.chunks)
+
+        def close(self):
+            self.closed = True
+
+    flights = SingleFlight()
+
+    # A tee closed before its first chunk leaves the flight; being the only one, it drops the request.
+    source = Source()
+    flights.stream("k", lambda: source).close()
+    assert source.closed and "k" not in flights.flights, "closing an unread tee kept the request open"
+
+    # An unread tee closed early doesn't keep the source open for a joiner that stops early.
+    source = Source()
+    unread = flights.stream("k", lambda: source)
+    joiner = flights.stream("k", lambda: source)
+    unread.close()
+    assert next(joiner) == "a"
+    joiner.close()
+    assert source.closed and "k" not in flights.flights, "the last reader did not close the source"
+
+    # Same with an unread tee that is dropped instead of closed.
+    source = Source()
+    unread = flights.stream("k", lambda: source)
+    joiner = flights.stream("k", lambda: source)
+    assert next(joiner) == "a"
+    joiner.close()
+    del unread
+    assert source.closed and "k" not in flights.flights, "a dropped tee kept the request open"
+
+    # Tees read to the end get every chunk.
+    source = Source()
+    tees = [flights.stream("k", lambda: source) for _ in range(2)]
+    assert ["".join(tee) for tee in tees] == ["abc", "abc"] and "k" not in flights.flights
+    print("single_flight: ok")
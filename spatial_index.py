@@ -0,0 +1,82 @@
+import pygame
+
+
+class SpatialHash:
+    """
+    Uniform-grid index of rectangles.
+
+    Every rectangle is registered in each grid cell it overlaps, so a query only looks at
+    the handful of cells covered by the test rectangle instead of every rectangle on the map.
+    Rectangles are stored under a caller-chosen hashable key (pygame.Rect is not hashable).
+    """
+
+    def __init__(self, cell_size=16):
+        self.cell_size = cell_size
+        self.cells = {}   # (cell_x, cell_y) -> set of keys
+        self.rects = {}   # key -> pygame.Rect
+        self.order = {}   # key -> sequence number, lower ones win in first_collision()
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, key):
+        return key in self.rects
+
+    def _cells_for(self, rect):
+        size = self.cell_size
+        # right/bottom are exclusive, so a rect ending exactly on a cell border doesn't touch the next cell.
+        for cell_x in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cell_y in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield (cell_x, cell_y)
+
+    def insert(self, key, rect, order=None):
+        """
+        Args:
+            key: hashable key of the rect; inserting an existing key moves it
+            rect: the rectangle
+            order (int, optional): sequence number to keep (e.g. when re-inserting a removed
+                rect); by default the rect goes after every one inserted before it
+        """
+        if key in self.rects:
+            self.remove(key)
+        rect = pygame.Rect(rect)
+        self.rects[key] = rect
+        if order is None:
+            order = self.counter
+        self.order[key] = order
+        self.counter = max(self.counter, order + 1)
+        for cell in self._cells_for(rect):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        rect = self.rects.pop(key, None)
+        if rect is None:
+            return
+        del self.order[key]
+        for cell in self._cells_for(rect):
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.cells[cell]
+
+    def get(self, key):
+        return self.rects.get(key)
+
+    def candidates(self, rect):
+        """Keys registered in the cells overlapped by rect (may include non-colliding ones)."""
+        keys = set()
+        for cell in self._cells_for(rect):
+            bucket = self.cells.get(cell)
+            if bucket:
+                keys.update(bucket)
+        return keys
+
+    def first_collision(self, rect):
+        """The colliding rect with the lowest sequence number, or None."""
+        best_key = None
+        for key in self.candidates(rect):
+            if rect.colliderect(self.rects[key]) and (best_key is None or self.order[key] < self.order[best_key]):
+                best_key = key
+        return self.rects[best_key] if best_key is not None else None
@@ -0,0 +1,69 @@
+import logging
+
+from llm_dispatch import BACKGROUND_PRIORITY
+from llm_logic import llm_logic
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeEngine:
+    """
+    Opt-in background work started before the player presses RETURN.
+
+    - When an entity is selected for interaction, the static prefix of the "do" prompt
+      (instructions, actor and entity) is sent to the model server so its KV cache already
+      holds it; after RETURN only the action text has to be evaluated.
+    - When the mouse rests on an entity, its "look at" answer is generated into the
+      response cache, so a later "look at" is answered immediately.
+
+    Jobs go through the game's dispatcher at BACKGROUND_PRIORITY and can be preempted, so
+    they only use slots no player or NPC turn needs and never delay the player's turn.
+    """
+
+    def __init__(self, dispatcher, enabled=False, keep_alive="10m"):
+        """
+        Args:
+            dispatcher (LLMDispatcher): The game's dispatcher, shared with player and NPC turns
+            enabled (bool): Speculation is off unless explicitly enabled
+            keep_alive (str): How long the model server should keep the model loaded after a warm-up
+        """
+        self.enabled = enabled
+        self.keep_alive = keep_alive
+        self.dispatcher = dispatcher
+        self.warmed_prefix = None
+        self.hovered_entity = None
+        self.described = set()
+
+    def on_target_selected(self, turn, player_entity, obj_entities):
+        """Called when the text box switches to "interact -> <name>"."""
+        if not self.enabled or not turn.startswith("interact ->"):
+            return
+
+        prefix = llm_logic.do_prompt_prefix(turn, player_entity, obj_entities)
+        if prefix is None or prefix == self.warmed_prefix:
+            return
+        self.warmed_prefix = prefix
+        logger.debug(f"Warming prompt prefix for {turn!r}")
+        self.dispatcher.submit(
+            llm_logic.warm_do_command, turn, player_entity, obj_entities, self.keep_alive,
+            priority=BACKGROUND_PRIORITY, cancellable=True,
+        )
+
+    def on_hover(self, entity, obj_entities):
+        """Called with the entity under the mouse (or None) whenever the hovered cell changes."""
+        if not self.enabled or entity is self.hovered_entity:
+            return
+        self.hovered_entity = entity
+        if entity is None:
+            return
+
+        name = entity.properties.get("name", "")
+        # Keyed on the visible description: a changed entity needs a new answer.
+        key = (name, tuple(sorted((k, str(v)) for k, v in entity.properties.items() if not k.startswith("_"))))
+        if not name or key in self.described:
+            return
+        self.described.add(key)
+        logger.debug(f"Pre-computing 'look at {name}'")
+        self.dispatcher.submit(
+            llm_logic.prefetch_look_at, name, obj_entities, priority=BACKGROUND_PRIORITY, cancellable=True,
+        )
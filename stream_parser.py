@@ -0,0 +1,311 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+VERDICT_PATTERN = re.compile(r'\b(success|fail|failure)\(\)')
+TRADE_PATTERN = re.compile(r'\btrade\(\s*"([^"]*)"\s*,\s*"([^"]*)"\s*\)|\bskip\(\)')
+
+
+class StreamParser:
+    """
+    Base class for parsers that consume model output chunk by chunk.
+
+    feed() returns the part of the chunk the player should see right away, close()
+    flushes what is left. Callbacks are attributes so the game can attach them after
+    the parser is created but before the stream is consumed:
+        on_verdict(verdict)   "success" or "fail", fired once, as soon as the verdict appears
+        on_trade(args)        ("offered", "requested") or () for skip(), fired once
+        on_complete(result)   fired by close() with the parser-specific final result
+    """
+
+    def __init__(self):
+        self.on_verdict = None
+        self.on_trade = None
+        self.on_complete = None
+        self.verdict = None
+
+    def feed(self, chunk):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def wrap(self, chunks):
+        """Generator yielding the visible text of a chunk stream, firing callbacks on the way."""
+        for chunk in chunks:
+            visible = self.feed(chunk)
+            if visible:
+                yield visible
+        rest = self.close()
+        if rest:
+            yield rest
+
+    def _fire_verdict(self, verdict):
+        if self.verdict is not None:
+            return
+        self.verdict = "fail" if verdict.startswith("fail") else "success"
+        if self.on_verdict:
+            self.on_verdict(self.verdict)
+
+
+class TagStreamParser(StreamParser):
+    """
+    Streams free text / tagged model output.
+
+    - Content of hidden tags (<scratchpad>, <thinking>, <think>) is never shown.
+    - With only_tag set (e.g. "description"), only text inside that tag is shown; if the
+      model never opens it, the remaining text is shown on close() instead of nothing.
+    - success()/fail() and trade("a", "b")/skip() calls fire on_verdict/on_trade.
+    - on_complete receives the raw text of the whole stream.
+    """
+
+    HIDDEN_TAGS = ("scratchpad", "thinking", "think")
+    MAX_TAG_LENGTH = 32
+
+    def __init__(self, only_tag=None, hidden_tags=HIDDEN_TAGS):
+        super().__init__()
+        self.only_tag = only_tag
+        self.hidden_tags = hidden_tags
+        self.buffer = ""
+        self.hidden = None       # name of the hidden tag we are inside
+        self.inside = False      # inside only_tag
+        self.seen_only_tag = False
+        self.raw = []
+        self.unhidden = ""       # everything outside hidden tags, scanned for function calls
+        self.outside = ""        # text outside only_tag, kept for the close() fallback
+        self.trade = None
+        self.emitted = False
+
+    def feed(self, chunk):
+        self.raw.append(chunk)
+        self.buffer += chunk
+        visible = []
+
+        while self.buffer:
+            if self.hidden:
+                closing = f"</{self.hidden}>"
+                end = self.buffer.find(closing)
+                if end == -1:
+                    # Keep just enough to recognise a closing tag split across chunks.
+                    self.buffer = self.buffer[-(len(closing) - 1):]
+                    break
+                self.buffer = self.buffer[end + len(closing):]
+                self.hidden = None
+                continue
+
+            start = self.buffer.find("<")
+            if start == -1:
+                visible.append(self._commit(self.buffer))
+                self.buffer = ""
+                break
+            visible.append(self._commit(self.buffer[:start]))
+            self.buffer = self.buffer[start:]
+
+            end = self.buffer.find(">")
+            if end == -1:
+                if len(self.buffer) <= self.MAX_TAG_LENGTH:
+                    break  # Possibly a tag split across chunks, wait for more.
+                visible.append(self._commit(self.buffer[0]))
+                self.buffer = self.buffer[1:]
+                continue
+
+            tag = self.buffer[1:end].strip().lower()
+            name = tag.lstrip("/").strip().split(" ")[0] if tag else ""
+            closing_tag = tag.startswith("/")
+            if name in self.hidden_tags and not closing_tag:
+                self.hidden = name
+            elif self.only_tag and name == self.only_tag:
+                self.inside = not closing_tag
+                self.seen_only_tag = True
+                visible.append(self._only_tag_changed(tag))
+            elif name in self.hidden_tags:
+                pass  # Stray closing tag.
+            else:
+                visible.append(self._commit(self.buffer[:end + 1]))
+            self.buffer = self.buffer[end + 1:]
+
+        self._scan_calls()
+        return self._emit("".join(visible))
+
+    def close(self):
+        rest = ""
+        if self.buffer and not self.hidden:
+            rest = self._commit(self.buffer)
+        self.buffer = ""
+        self._scan_calls()
+
+        if self.only_tag and not self.seen_only_tag:
+            rest = self.outside
+        visible = self._emit(rest.rstrip())
+
+        if self.on_complete:
+            self.on_complete(self.result())
+        return visible
+
+    def result(self):
+        """What on_complete receives: the raw text of the whole stream."""
+        return "".join(self.raw)
+
+    def _only_tag_changed(self, tag):
+        """Called when only_tag opens or closes (tag is its lowercased content); returns text to show."""
+        return ""
+
+    def _commit(self, text):
+        """Accounts for text outside hidden tags; returns the part that should be shown."""
+        self.unhidden += text
+        if self.only_tag and not self.inside:
+            self.outside += text
+            return ""
+        return text
+
+    def _emit(self, text):
+        if not self.emitted:
+            text = text.lstrip()
+            self.emitted = bool(text)
+        return text
+
+    def _scan_calls(self):
+        if self.verdict is None:
+            match = VERDICT_PATTERN.search(self.unhidden)
+            if match:
+                self._fire_verdict(match.group(1))
+        if self.trade is None:
+            match = TRADE_PATTERN.search(self.unhidden)
+            if match:
+                self.trade = (match.group(1), match.group(2)) if match.group(1) is not None else ()
+                if self.on_trade:
+                    self.on_trade(self.trade)
+
+
+class ObjectTagStreamParser(TagStreamParser):
+    """
+    Streams a batch of descriptions written as <object id="N">...</object> blocks.
+
+    Only text inside object tags is shown, one paragraph per object. descriptions maps each
+    id to its text; on_complete receives that dict (empty if the model ignored the format).
+    """
+
+    ID_PATTERN = re.compile(r'\bid\s*=\s*"?([\w-]+)')
+
+    def __init__(self, hidden_tags=TagStreamParser.HIDDEN_TAGS):
+        super().__init__(only_tag="object", hidden_tags=hidden_tags)
+        self.current_id = None
+        self.descriptions = {}
+
+    def result(self):
+        return {object_id: text.strip() for object_id, text in self.descriptions.items() if text.strip()}
+
+    def _only_tag_changed(self, tag):
+        if tag.startswith("/"):
+            self.current_id = None
+            return ""
+        match = self.ID_PATTERN.search(tag)
+        self.current_id = match.group(1) if match else str(len(self.descriptions) + 1)
+        self.descriptions.setdefault(self.current_id, "")
+        return "\n\n" if len(self.descriptions) > 1 else ""
+
+    def _commit(self, text):
+        if self.inside and self.current_id is not None:
+            self.descriptions[self.current_id] += text
+        return super()._commit(text)
+
+
+class ResolutionStreamParser(StreamParser):
+    """
+    Streams the JSON object produced for llm_logic.ACTION_RESOLUTION_SCHEMA.
+
+    The "narration" string is decoded and shown as it arrives, the verdict fires as soon as
+    its value is complete, and close() appends the verdict line and calls on_complete with
+    the parsed resolution (None if the JSON turned out to be invalid). For invalid JSON the
+    verdict is still taken from a plain success()/fail() in the text, so the caller can fall
+    back to asking for the property updates separately.
+    """
+
+    VERDICT_FIELD = re.compile(r'"verdict"\s*:\s*"(success|fail)"')
+    NARRATION_FIELD = re.compile(r'"narration"\s*:\s*"')
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, parse_resolution):
+        """
+        Args:
+            parse_resolution (callable): Turns the full JSON text into a resolution dict or None
+        """
+        super().__init__()
+        self.parse_resolution = parse_resolution
+        self.text = ""
+        self.narration_pos = None   # index of the next undecoded narration character
+        self.narration_done = False
+
+    def feed(self, chunk):
+        self.text += chunk
+
+        if self.verdict is None:
+            match = self.VERDICT_FIELD.search(self.text)
+            if match:
+                self._fire_verdict(match.group(1))
+
+        if self.narration_pos is None:
+            match = self.NARRATION_FIELD.search(self.text)
+            if not match:
+                return ""
+            self.narration_pos = match.end()
+
+        return self._decode_narration()
+
+    def close(self):
+        resolution = self.parse_resolution(self.text)
+        if resolution is None:
+            logger.warning(f"Unparseable action resolution: {self.text!r}")
+            match = VERDICT_PATTERN.search(self.text)
+            if match and self.verdict is None:
+                self._fire_verdict(match.group(1))
+        elif self.verdict is None:
+            self._fire_verdict(resolution["verdict"])
+
+        visible = ""
+        if resolution is not None and self.narration_pos is None:
+            visible = resolution["narration"]
+        if self.verdict is not None:
+            visible += f"\n{self.verdict}()"
+
+        if self.on_complete:
+            self.on_complete(resolution)
+        return visible
+
+    def _decode_narration(self):
+        if self.narration_done:
+            return ""
+
+        decoded = []
+        pos = self.narration_pos
+        while pos < len(self.text):
+            char = self.text[pos]
+            if char == '"':
+                self.narration_done = True
+                pos += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                pos += 1
+                continue
+
+            # Escape sequence: wait until it is complete.
+            if pos + 1 >= len(self.text):
+                break
+            code = self.text[pos + 1]
+            if code == "u":
+                if pos + 6 > len(self.text):
+                    break
+                try:
+                    decoded.append(chr(int(self.text[pos + 2:pos + 6], 16)))
+                except ValueError:
+                    pass
+                pos += 6
+            else:
+                decoded.append(self.ESCAPES.get(code, code))
+                pos += 2
+
+        self.narration_pos = pos
+        return "".join(decoded)
+
@@ -0,0 +1,53 @@
+import queue
+import threading
+import time
+
+
+class StreamReader:
+    """
+    Consumes a text generator on a background thread.
+
+    Chunks are pushed into a queue.SimpleQueue as they arrive, so the game loop never
+    blocks on the network: it drains whatever is available each frame with drain().
+    Anything the generator does while being iterated (stream parser callbacks included)
+    runs on the reader thread.
+    """
+
+    _DONE = object()
+
+    def __init__(self, generator):
+        self.chunks = queue.SimpleQueue()
+        self.done = False
+        self.error = None
+        self.thread = threading.Thread(target=self._read, args=(generator,), name="stream-reader", daemon=True)
+        self.thread.start()
+
+    def _read(self, generator):
+        try:
+            for chunk in generator:
+                if chunk:
+                    self.chunks.put(chunk)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.chunks.put(self._DONE)
+
+    def drain(self, budget=0.002):
+        """
+        Returns the text that arrived since the last call, joined into one string.
+        Stops early once budget seconds have been spent, leaving the rest for the next frame.
+        """
+        deadline = time.perf_counter() + budget
+        text = []
+        while not self.done:
+            try:
+                chunk = self.chunks.get_nowait()
+            except queue.Empty:
+                break
+            if chunk is self._DONE:
+                self.done = True
+                break
+            text.append(chunk)
+            if time.perf_counter() >= deadline:
+                break
+        return "".join(text)
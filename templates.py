@@ -0,0 +1,54 @@
+import hashlib
+import re
+
+SLOT_PATTERN = re.compile(r"\$([A-Z][A-Z0-9_]*)")
+
+
+class Template:
+    """
+    A prompt template parsed once into literal text and $SLOT segments.
+
+    render() fills every slot in a single pass and join, so values containing "$SOMETHING"
+    are inserted as is instead of being substituted again. The system section is static
+    text sent ahead of the rendered prompt; it may not contain slots.
+    """
+
+    def __init__(self, name, text, system=""):
+        self.name = name
+        self.text = text
+        self.system = system
+        if SLOT_PATTERN.search(system):
+            raise ValueError(f"Template {name!r}: the system section must not contain slots")
+
+        # Literals at even positions, slot names at odd ones.
+        self.segments = SLOT_PATTERN.split(text)
+        self.slots = tuple(dict.fromkeys(self.segments[1::2]))
+        self.literal_text = "".join(self.segments[0::2])
+
+        # Everything before the first slot is the same for every call.
+        self.static_prefix = system + "\n\n" + self.segments[0] if system else self.segments[0]
+        self.prefix_hash = hashlib.sha256(self.static_prefix.encode("utf-8")).hexdigest()
+
+    def __repr__(self):
+        return f"Template({self.name!r}, slots={self.slots})"
+
+    def render(self, values=None, **kwargs):
+        """
+        Args:
+            values (dict): slot name (without "$") -> text; keyword arguments are merged in
+
+        Returns:
+            str: the filled template
+        """
+        values = {**(values or {}), **kwargs}
+        missing = [slot for slot in self.slots if slot not in values]
+        if missing:
+            raise KeyError(f"Template {self.name!r} is missing slots {missing}")
+        unknown = [slot for slot in values if slot not in self.slots]
+        if unknown:
+            raise KeyError(f"Template {self.name!r} has no slots {unknown}")
+
+        parts = list(self.segments)
+        for i in range(1, len(parts), 2):
+            parts[i] = str(values[parts[i]])
+        return "".join(parts)
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+import pygame
+
+
+class TextLayout:
+    """
+    Caches for drawing UI text.
+
+    Fonts are created once per size and rendered line surfaces are kept in an LRU, so
+    redrawing a panel only renders lines that are new.
+    """
+
+    def __init__(self, max_lines=512):
+        self.fonts = {}  # size -> pygame.font.Font
+        self.max_lines = max_lines
+        self.lines = OrderedDict()  # (size, text, color) -> rendered line surface
+
+    def font(self, size=22):
+        font = self.fonts.get(size)
+        if font is None:
+            font = pygame.font.Font(None, size)
+            self.fonts[size] = font
+        return font
+
+    def render_line(self, text, color, size=22):
+        """A single antialiased line of text, rendered once and reused."""
+        key = (size, text, color)
+        surface = self.lines.get(key)
+        if surface is not None:
+            self.lines.move_to_end(key)
+            return surface
+
+        surface = self.font(size).render(text, True, color)
+        self.lines[key] = surface
+        if len(self.lines) > self.max_lines:
+            self.lines.popitem(last=False)
+        return surface
@@ -0,0 +1,81 @@
+import logging
+
+import pygame
+
+logger = logging.getLogger(__name__)
+
+
+class TileAtlas:
+    """
+    Every tile image of a map, loaded once.
+
+    Tiles are converted to the display format and kept in flat lists indexed by gid, both at
+    their native size (for logic such as sprite rects) and at final on-screen scale (for
+    drawing), so nothing has to be scaled or allocated while rendering. Loose tileset sheets
+    (e.g. the player's sprite sheet) are loaded once per path and cut into tiles on demand.
+
+    Needs a display mode to be set before it is created (convert_alpha).
+    """
+
+    def __init__(self, tmx_data, tile_size=16, scale=2):
+        self.tile_size = tile_size
+        self.scale = scale
+        self.native = []
+        self.scaled = []
+        for image in tmx_data.images:
+            if image is None:
+                self.native.append(None)
+                self.scaled.append(None)
+                continue
+            native = self._prepare(image)
+            self.native.append(native)
+            self.scaled.append(pygame.transform.scale(native, self.scaled_size))
+
+        self.sheets = {}       # path -> sheet surface
+        self.sheet_tiles = {}  # (path, tile_x, tile_y) -> (native, scaled)
+
+    @property
+    def scaled_size(self):
+        size = self.tile_size * self.scale
+        return (size, size)
+
+    def _prepare(self, image):
+        image = image.convert_alpha()
+        if image.get_size() != (self.tile_size, self.tile_size):
+            image = pygame.transform.scale(image, (self.tile_size, self.tile_size))
+        return image
+
+    def get(self, gid):
+        """Tile image at screen scale, or None for an empty gid."""
+        return self.scaled[gid] if 0 < gid < len(self.scaled) else None
+
+    def get_native(self, gid):
+        """Tile image at map resolution, or None for an empty gid."""
+        return self.native[gid] if 0 < gid < len(self.native) else None
+
+    def sheet_tile(self, path, tile_x, tile_y):
+        """
+        Cuts one tile out of a tileset image file.
+
+        Returns:
+            tuple: (native image, scaled image), or None if the tile is outside the sheet
+        """
+        key = (path, tile_x, tile_y)
+        if key in self.sheet_tiles:
+            return self.sheet_tiles[key]
+
+        sheet = self.sheets.get(path)
+        if sheet is None:
+            sheet = pygame.image.load(path).convert_alpha()
+            self.sheets[path] = sheet
+
+        rect = pygame.Rect(tile_x * self.tile_size, tile_y * self.tile_size, self.tile_size, self.tile_size)
+        try:
+            native = sheet.subsurface(rect).copy()
+        except ValueError:
+            logger.error(f"Tile ({tile_x}, {tile_y}) is out of bounds.")
+            return None
+
+        tile = (native, pygame.transform.scale(native, self.scaled_size))
+        self.sheet_tiles[key] = tile
+        return tile
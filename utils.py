@@ -24,19 +24,7 @@ def extract_property_info(text):
     for match in matches:
         entity_name, property_name, value_str = match
         
-        # Convert value_str to appropriate Python type
-        if value_str.lower() == 'true':
-            value = True
-        elif value_str.lower() == 'false':
-            value = False
-        elif value_str.isdigit():
-            value = int(value_str)
-        elif value_str.replace('.', '', 1).isdigit():
-            value = float(value_str)
-        elif value_str.startswith('"') and value_str.endswith('"'):
-            value = value_str[1:-1]
-        else:
-            value = value_str
+        value = parse_property_value(value_str)
             
         results.append({
             'entity_name': entity_name,
@@ -46,6 +34,28 @@ def extract_property_info(text):
     
     return results
 
+def parse_property_value(value_str):
+    """
+    Convert a property value written by the model to the appropriate Python type.
+    
+    Args:
+        value_str (str): The raw value, e.g. 'true', '3', '"open"'
+        
+    Returns:
+        bool | int | float | str: The converted value
+    """
+    if value_str.lower() == 'true':
+        return True
+    elif value_str.lower() == 'false':
+        return False
+    elif value_str.isdigit():
+        return int(value_str)
+    elif value_str.replace('.', '', 1).isdigit():
+        return float(value_str)
+    elif value_str.startswith('"') and value_str.endswith('"'):
+        return value_str[1:-1]
+    return value_str
+
 def get_entity_description(obj, include_inventory=True, exclude_properties=None, exclude_invisible_properties=True):
 
     if exclude_properties is None: